@@ -1,15 +1,60 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse
-from PIL import Image, ImageDraw, ImageFont
-import io
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from PIL import UnidentifiedImageError
+from typing import List
+from urllib.parse import quote
+import asyncio
+import base64
+import json
 import logging
 import re
+import resource
+import time
+import uuid
 from datetime import datetime
 
+from assets import asset_id, asset_images, asset_store
+from fonts import font_registry
+from image_cache import base_pages, derived_images
+from layout import (DPI, FICHA_TEXT_SIZE, HOJA_TEXT_SIZE, MAX_PAGES, border_slot, header_slot, layout_ficha,
+                    layout_ficha_pages, layout_hoja_preguntas, layout_hoja_preguntas_pages, resolve_escala, scale_item,
+                    tokenize_markdown)
+from batch import parse_jobs, stream_multipart, stream_zip
+from encoding import EXTENSIONS, MEDIA_TYPES, resolve_format
+from image_loader import ImageTooLarge, inspect_image, load_image, open_image
+from metrics import CallbackMetric, MetricsMiddleware, add_stage, registry
+from output_store import output_store
+from previews import PREVIEW_DPI, PREVIEW_QUALITY, pack_request, preview_store, preview_summary, unpack_request
+from render import (ficha_page_count, fit_ficha, fit_hoja_preguntas, hoja_preguntas_page_count, preview_ficha,
+                    preview_hoja_preguntas, render_ficha, render_ficha_page, render_ficha_pdf, render_hoja_preguntas,
+                    render_hoja_preguntas_page, render_hoja_preguntas_pdf, render_pdf, warm_up)
+from render_cache import render_cache, render_key
+from render_pool import RenderPool, RenderQueueFull
+from rasterizer import render_layer, stamp_sprite
+from sprites import outlined_text_sprite
+from text_metrics import token_width
+from uploads import MAX_UPLOAD_BYTES, MAX_UPLOAD_MB, UPLOAD_BYTES, UploadLimitMiddleware, too_large
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+VERSION = "7.7-MARGENES-ASIMETRICOS-CAPA-CENTRADA"
+
+# Cada worker precarga fuentes y decoraciones (en modo "process" cada proceso tiene sus cachés)
+render_pool = RenderPool(initializer=warm_up)
+
+@asynccontextmanager
+async def lifespan(app):
+    warm_up()
+    render_pool.start()
+    yield
+    render_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+# El último añadido es el más externo: las métricas también cuentan los 413 del límite de cuerpo
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 def sanitize_filename(text: str) -> str:
     """
@@ -28,492 +73,319 @@ def sanitize_filename(text: str) -> str:
     
     return sanitized if sanitized else "Sin_Titulo"
 
-def to_title_case(text: str) -> str:
+
+async def run_render(fn, *args):
     """
-    Convierte un string a Title Case (Capitalización de Título), donde la 
-    primera letra de cada palabra importante se pone en mayúscula.
-    Se mantienen en minúscula artículos, preposiciones cortas y conjunciones.
+    Envía un render al pool; si la cola está llena responde 503 con Retry-After,
+    y si la imagen supera MAX_IMAGE_PIXELS responde 413 sin haberla decodificado.
     """
-    if not text:
-        return ""
+    try:
+        return await render_pool.run(fn, *args)
+    except RenderQueueFull as e:
+        logger.warning(f"⏳ {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ImageTooLarge as e:
+        logger.warning(f"🚫 {e}")
+        raise HTTPException(status_code=413, detail=str(e))
 
-    # Palabras funcionales cortas que deben estar en minúscula (en español)
-    minor_words = [
-        'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas', # Artículos
-        'de', 'a', 'en', 'por', 'con', 'sin', 'sobre', 'tras', # Preposiciones
-        'y', 'o', 'ni', 'pero', 'mas', 'que' # Conjunciones y relativos
-    ]
 
-    words = text.lower().split()
-    title_cased_words = []
-    
-    for i, word in enumerate(words):
-        # La primera palabra siempre va capitalizada
-        if i == 0 or i == len(words) - 1:
-            title_cased_words.append(word.capitalize())
-        # Las palabras que no son "menores" se capitalizan
-        elif word not in minor_words:
-            title_cased_words.append(word.capitalize())
-        # Las palabras "menores" (artículos, preposiciones, etc.) se dejan en minúscula
-        else:
-            title_cased_words.append(word)
-
-    return " ".join(title_cased_words)
-
-
-def parse_markdown_line(line):
-    """Parsea markdown en una línea"""
-    segments = []
-    # Busca negritas (***texto*** o **texto** o *texto*)
-    pattern = r'(\*\*\*[^\*]+\*\*\*|\*\*[^\*]+\*\*|\*[^\*]+\*)'
-    
-    last_end = 0
-    for match in re.finditer(pattern, line):
-        if match.start() > last_end:
-            segments.append((line[last_end:match.start()], 'normal'))
-        
-        matched_text = match.group(0)
-        if matched_text.startswith('***') and matched_text.endswith('***'):
-            segments.append((matched_text[3:-3], 'bold'))
-        elif matched_text.startswith('**') and matched_text.endswith('**'):
-            segments.append((matched_text[2:-2], 'bold'))
-        elif matched_text.startswith('*') and matched_text.endswith('*'):
-            segments.append((matched_text[1:-1], 'bold')) # Corregido: asumimos *texto* también es bold si no hay italic separado
-        
-        last_end = match.end()
-    
-    if last_end < len(line):
-        segments.append((line[last_end:], 'normal'))
-    
-    return segments if segments else [(line, 'normal')]
+async def read_upload(upload: UploadFile) -> bytes:
+    """
+    Lee un archivo subido completo, midiendo la etapa 'upload_read'. Sin stage(): su pila
+    es por hilo y en el event loop se intercalarían varias corrutinas.
 
-def draw_formatted_line(draw, x, y, line, fonts, color, max_width_px=None):
-    """Dibuja línea con markdown, y JUSTIFICA si max_width_px es proporcionado."""
-    segments = parse_markdown_line(line)
-    current_x = x
-    
-    # Lógica de JUSTIFICACIÓN
-    extra_space_per_gap = 0
-    
-    if max_width_px:
-        # 1. Calcular ancho total del texto y número de espacios
-        total_text_width_with_default_spaces = 0
-        num_spaces = 0
-        
-        for seg_text, seg_style in segments:
-            font = fonts.get(seg_style, fonts['normal'])
-            # Usar textlength para ser más preciso y evitar el overhead de bbox
-            try:
-                text_width = draw.textlength(seg_text, font=font)
-                total_text_width_with_default_spaces += text_width
-            except AttributeError:
-                # Fallback para versiones antiguas de Pillow o fuentes no cargadas
-                bbox = draw.textbbox((0, 0), seg_text, font=font)
-                total_text_width_with_default_spaces += bbox[2] - bbox[0]
-                
-            num_spaces += seg_text.count(' ')
-        
-        # Aplicar justificación si el texto es significativo y necesita rellenar el ancho
-        # (El texto no debe ser demasiado corto para justificar)
-        if num_spaces > 0 and (total_text_width_with_default_spaces / max_width_px > 0.7):
-            remaining_width = max_width_px - total_text_width_with_default_spaces
-            # El espacio extra se divide entre el número de gaps (los espacios)
-            extra_space_per_gap = remaining_width / num_spaces
-    
-    # 2. Dibujar y distribuir el espacio extra
-    for text, style in segments:
-        font = fonts.get(style, fonts['normal'])
-        
-        draw.text((current_x, y), text, font=font, fill=color)
-        
-        # Calcular el ancho del texto dibujado (sin contar espacios)
+    Los límites se comprueban antes de decodificar: el tamaño que contó el parser multipart
+    (MAX_UPLOAD_MB) antes de pasar el archivo a memoria, y los píxeles de la cabecera
+    (MAX_IMAGE_PIXELS) antes de encolar el render. Si no es una imagen reconocible, 400.
+    Se lee una sola vez a un único bytes, que comparten la clave de caché, el decodificador
+    (BytesIO no lo copia) y el pool.
+    """
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise too_large('file', f"Archivo demasiado grande: {upload.size / 1e6:.1f} MB (máximo {MAX_UPLOAD_MB:g} MB)")
+    start = time.perf_counter()
+    data = await upload.read()
+    add_stage('upload_read', time.perf_counter() - start)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise too_large('file', f"Archivo demasiado grande (máximo {MAX_UPLOAD_MB:g} MB)")
+    UPLOAD_BYTES.observe(len(data))
+
+    try:
+        # Solo la cabecera: tamaño en píxeles sin decodificar
+        open_image(data)
+    except ImageTooLarge as e:
+        logger.warning(f"🚫 {e}")
+        raise too_large('pixels', str(e))
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail=f"El archivo no es una imagen válida: {upload.filename}")
+    return data
+
+
+async def upload_or_asset(upload: UploadFile, imagen_id: str) -> bytes:
+    """
+    Bytes de la imagen del render: el archivo subido o, con `imagen_id`, la imagen guardada
+    antes con POST /imagenes. Son los mismos bytes, así que la clave de caché y el ETag
+    coinciden con los de subirla. 400 si no llega ninguna (o llegan las dos), 404 si el id caducó.
+    """
+    if (upload is None) == (not imagen_id):
+        raise HTTPException(status_code=400, detail="Enviar la imagen o su `imagen_id` de POST /imagenes (solo una)")
+    if upload is not None:
+        return await read_upload(upload)
+    data = await asset_store.get(imagen_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="imagen_id desconocido o caducado: vuelva a subirla a POST /imagenes")
+    return data
+
+
+async def asset_image(imagen_id: str, img_bytes: bytes, slot, mode: str = None):
+    """
+    Imagen del almacén decodificada para el slot: se decodifica en el pool la primera vez y
+    después se sirve desde memoria. Sin `imagen_id` (archivo subido) devuelve los bytes tal cual
+    y el render la decodifica como siempre.
+    """
+    if not imagen_id:
+        return img_bytes
+    key = (imagen_id, slot.box, slot.fit, mode)
+    img = asset_images.get(key)
+    if img is None:
+        img = await run_render(load_image, img_bytes, slot, mode)
+        asset_images.put(key, img)
+        logger.info(f"🗃️ Imagen {imagen_id[:12]} decodificada para el slot {slot.box}: {img.width}x{img.height}")
+    return img
+
+
+def output_format(request: Request, formato: str, compresion: str):
+    """Formato y compresión de salida pedidos (campo `formato` o cabecera Accept); 400 si no son válidos."""
+    try:
+        return resolve_format(formato, compresion, request.headers.get('accept'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def output_scale(dpi: str, escala: str) -> float:
+    """Escala de salida pedida con `dpi` o `escala` (vista previa); 400 si no es válida."""
+    try:
+        return resolve_escala(dpi, escala)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def image_response(image_bytes: bytes, filename: str, etag: str, media_type: str = "image/png",
+                         extra_headers: dict = None) -> Response:
+    """
+    Entrega el archivo directamente desde memoria, con la misma cabecera Content-Disposition
+    que generaba FileResponse. La copia en disco solo se hace si OUTPUT_DIR está definido,
+    en un hilo para no bloquear el event loop (como el disco de la caché de renders).
+    """
+    if output_store.directory:
+        await asyncio.to_thread(output_store.save, filename, image_bytes)
+
+    quoted = quote(filename)
+    if quoted != filename:
+        disposition = f"attachment; filename*=utf-8''{quoted}"
+    else:
+        disposition = f'attachment; filename="{filename}"'
+    # Vary: Accept porque sin `formato` el tipo de la respuesta depende de la negociación
+    headers = {"Content-Disposition": disposition, "ETag": etag, "Vary": "Accept", **(extra_headers or {})}
+    return Response(image_bytes, media_type=media_type, headers=headers)
+
+
+async def fitted_text(ajustar: bool, fit_fn, *args):
+    """
+    Modo `ajustar`: busca en el pool (midiendo, sin rasterizar) el tamaño de letra con el que no
+    se trunca nada. Devuelve (tamaño o None si no se pidió, cabeceras para la respuesta).
+    """
+    if not ajustar:
+        return None, {}
+    fit = await run_render(fit_fn, *args)
+    logger.info(f"📏 Ajuste de texto: {fit['text_size']}px, interlineado {fit['line_spacing']}px, truncado={fit['truncated']}")
+    return fit['text_size'], {
+        "X-Tamano-Letra": str(fit['text_size']),
+        "X-Interlineado": str(fit['line_spacing']),
+        "X-Truncado": "1" if fit['truncated'] else "0",
+    }
+
+
+# Renders en curso por clave: las peticiones idénticas simultáneas esperan al mismo resultado
+_inflight = {}
+
+async def cached_render(key: str, fn, *args, runner=None) -> bytes:
+    """
+    Devuelve la imagen de la caché o la renderiza una sola vez y la guarda.
+    `runner` envía el render al pool (por defecto run_render, que responde 503 si está lleno).
+    """
+    image_bytes = await render_cache.get(key)
+    if image_bytes is not None:
+        logger.info(f"♻️ Render servido desde caché: {key[:12]}")
+        return image_bytes
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future((runner or run_render)(fn, *args))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    image_bytes = await asyncio.shield(task)
+    await render_cache.put(key, image_bytes)
+    return image_bytes
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """Comprueba If-None-Match (lista separada por comas, '*' o ETags débiles W/)."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+# Funciones de la salida paginada por tipo: (número de páginas, una página, PDF completo)
+PAGINATED_RENDERS = {
+    'ficha': (ficha_page_count, render_ficha_page, render_ficha_pdf),
+    'hoja_preguntas': (hoja_preguntas_page_count, render_hoja_preguntas_page, render_hoja_preguntas_pdf),
+}
+
+
+async def paginated_response(request: Request, tipo: str, img_bytes: bytes, params: tuple, salida: str,
+                             fmt: str, compresion, escala: float, fit_args: tuple, fit_headers: dict,
+                             filename: str, imagen_id: str = "", slot=None, mode: str = None) -> Response:
+    """
+    Modo `paginar`: lo que no cabe sigue en páginas nuevas en lugar de truncarse.
+    El layout de todas las páginas se calcula una vez; con `salida=zip` cada página se
+    renderiza en paralelo en el pool (con su propia clave de caché) y el ZIP se envía en
+    streaming en orden de página; por defecto se devuelve un único PDF vectorial.
+    Con `imagen_id`, `slot` y `mode` indican cómo decodificar la imagen del almacén (a 300 DPI).
+    """
+    if salida not in ("", "pdf", "zip"):
+        raise HTTPException(status_code=400, detail=f"salida inválida para paginar: {salida!r} (usar 'pdf' o 'zip')")
+    count_fn, page_fn, pdf_fn = PAGINATED_RENDERS[tipo]
+    pages, truncated = await run_render(count_fn, *params, *fit_args)
+    headers = {"X-Paginas": str(pages), **fit_headers}
+    if truncated:
+        # Ni en MAX_PAGES páginas cabe todo: se avisa en lugar de cortar en silencio
+        headers["X-Paginas-Truncadas"] = "1"
+        logger.warning(f"⚠️ {tipo} paginada truncada en {MAX_PAGES} páginas")
+    logger.info(f"📄 {tipo} paginada: {pages} páginas, salida={salida or 'pdf'}")
+
+    if salida != "zip":
+        key = render_key(VERSION, tipo, 'paginas', img_bytes, *params, 'pdf', *fit_args)
+        etag = f'"{key}"'
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag, **headers})
+        img = await asset_image(imagen_id, img_bytes, slot, mode)
+        pdf_bytes = await cached_render(key, pdf_fn, img, *params, *fit_args)
+        return await image_response(pdf_bytes, f"{filename}.pdf", etag, "application/pdf", headers)
+
+    img = await asset_image(imagen_id, img_bytes, scale_item(slot, escala) if imagen_id else None, mode)
+    semaphore = asyncio.Semaphore(render_pool.workers)
+
+    async def render_page(page):
+        key = render_key(VERSION, tipo, 'pagina', page, img_bytes, *params, fmt, compresion, escala, *fit_args)
+        async with semaphore:
+            return await cached_render(key, page_fn, img, *params, page, fmt, compresion, escala, *fit_args,
+                                       runner=run_render_waiting)
+
+    async def entries():
+        tasks = [asyncio.ensure_future(render_page(page)) for page in range(pages)]
         try:
-            text_width = draw.textlength(text, font=font)
-        except AttributeError:
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-        
-        current_x += text_width
-        
-        if extra_space_per_gap > 0:
-            spaces_in_segment = text.count(' ')
-            current_x += spaces_in_segment * extra_space_per_gap
-            
-    return max_width_px if extra_space_per_gap > 0 else (current_x - x)
-
-def wrap_text_with_markdown(text, fonts, max_width_px, draw):
-    """Divide texto respetando markdown Y PÁRRAFOS"""
-    
-    text_normalized = re.sub(r'\n{3,}', '\n\n', text)
-    paragraphs = text_normalized.split('\n\n')
-    
-    all_lines = []
-    
-    for para_idx, para in enumerate(paragraphs):
-        if not para.strip():
-            continue
-        
-        para_lines = para.split('\n')
-        
-        for line_idx, line in enumerate(para_lines):
-            if not line.strip():
-                continue
-            
-            words = line.strip().split()
-            current_line_words = []
-            
-            for word in words:
-                test_line = ' '.join(current_line_words + [word])
-                segments = parse_markdown_line(test_line)
-                
-                total_width = 0
-                for seg_text, seg_style in segments:
-                    font = fonts.get(seg_style, fonts['normal'])
-                    # Usar bbox para cálculo de ancho dentro del bucle
-                    try:
-                        bbox = draw.textbbox((0, 0), seg_text, font=font)
-                    except Exception:
-                        bbox = (0, 0, len(seg_text) * 20, 0) 
-                        
-                    total_width += bbox[2] - bbox[0]
-                
-                if total_width <= max_width_px:
-                    current_line_words.append(word)
-                else:
-                    if current_line_words:
-                        all_lines.append((' '.join(current_line_words), 'text'))
-                    current_line_words = [word]
-            
-            if current_line_words:
-                all_lines.append((' '.join(current_line_words), 'text'))
-        
-        # AGREGAR LÍNEA VACÍA ENTRE PÁRRAFOS (excepto después del último)
-        if para_idx < len(paragraphs) - 1:
-            all_lines.append(('', 'paragraph_break'))
-    
-    return all_lines
-
-def draw_wavy_border(draw, a4_width, a4_height):
-    """Dibuja borde ondulado infantil"""
-    import math
-    colors = ['#FF6B9D', '#FFA07A', '#FFD93D', '#6BCF7F', '#4ECDC4', '#95E1D3']
-    margin = 60
-    wave_width = 40
-    
-    # Dibujar semicírculos decorativos en el borde
-    for x in range(margin, a4_width - margin, 10):
-        wave_y_top = margin + wave_width * math.sin(x * 0.05)
-        draw.ellipse([x, wave_y_top - 5, x + 10, wave_y_top + 5], fill=colors[x % len(colors)])
-    
-    for x in range(margin, a4_width - margin, 10):
-        wave_y_bottom = a4_height - margin - wave_width * math.sin(x * 0.05)
-        draw.ellipse([x, wave_y_bottom - 5, x + 10, wave_y_bottom + 5], fill=colors[x % len(colors)])
+            for page, task in enumerate(tasks, start=1):
+                yield f"{filename}_pagina_{page:02d}.{EXTENSIONS[fmt]}", await task, MEDIA_TYPES[fmt]
+        finally:
+            # Si el cliente corta la descarga, no se siguen renderizando las páginas pendientes
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_zip(entries()), media_type="application/zip",
+                             headers={"Content-Disposition": f'attachment; filename="{quote(filename)}.zip"', **headers})
+
+
+# Slots que POST /imagenes deja decodificados con `uso` (valores por defecto de cada endpoint)
+ASSET_USES = {
+    'ficha': (header_slot(1150), 'RGB'),
+    'hoja_preguntas': (border_slot(), None),
+}
+
+
+@app.post("/imagenes")
+async def subir_imagen(
+    imagen: UploadFile = File(...),
+    uso: str = Form(default=""),
+):
+    """
+    Guarda una imagen (cabecera o borde) para reutilizarla en /crear-ficha y /crear-hoja-preguntas
+    pasando `imagen_id` en lugar de subirla otra vez. El id es el hash del contenido.
+    Con `uso` (ficha o hoja_preguntas) la deja además decodificada para el slot por defecto.
+    """
+    if uso and uso not in ASSET_USES:
+        raise HTTPException(status_code=400, detail=f"uso inválido: {uso!r} (usar 'ficha' o 'hoja_preguntas')")
+    data = await read_upload(imagen)
+    try:
+        info = await run_render(inspect_image, data)
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="El archivo no es una imagen válida")
+
+    imagen_id = asset_id(data)
+    await asset_store.put(imagen_id, data)
+    if uso:
+        await asset_image(imagen_id, data, *ASSET_USES[uso])
+    logger.info(f"🗃️ Imagen guardada: {imagen_id[:12]} ({info['ancho']}x{info['alto']} {info['formato']}, {len(data) / 1024:.0f} KB)")
+    return {"id": imagen_id, "bytes": len(data), **info}
+
 
 @app.post("/crear-ficha")
 async def crear_ficha(
-    imagen: UploadFile = File(...),
+    request: Request,
+    imagen: UploadFile = File(None),
+    imagen_id: str = Form(default=""),
     texto_cuento: str = Form(...),
     titulo: str = Form(default=""),
     header_height: int = Form(default=1150),
     estilo: str = Form(default="infantil"),
     # Se elimina imagen_modo, ahora es cover centrado por defecto
+    formato: str = Form(default=""),
+    compresion: str = Form(default=""),
+    dpi: str = Form(default=""),
+    escala: str = Form(default=""),
+    ajustar: bool = Form(default=False),
+    paginar: bool = Form(default=False),
+    salida: str = Form(default=""),
 ):
-    logger.info(f"📥 v7.5-MARGENES-ASIMETRICOS-CAPA-CENTRADA: {len(texto_cuento)} chars, header={header_height}px")
+    logger.info(f"📥 v{VERSION}: {len(texto_cuento)} chars, header={header_height}px")
     
     try:
-        img_bytes = await imagen.read()
-        header_img = Image.open(io.BytesIO(img_bytes))
-        
-        if header_img.mode != 'RGB':
-            header_img = header_img.convert('RGB')
-        
-        a4_width = 2480
-        a4_height = 3508
-        
-        # Inicializar canvas en RGBA para poder usar alpha_composite
-        canvas = Image.new('RGBA', (a4_width, a4_height), '#FFFEF0' if estilo == "infantil" else 'white')
-        
-        # PROCESAMIENTO DE IMAGEN: Implementación de COVER CENTRADO
-        # -----------------------------------------------------------
-        target_aspect = a4_width / header_height
-        image_aspect = header_img.width / header_img.height
-
-        if image_aspect < target_aspect:  
-            # La imagen es más "alta" (más estrecha) que el contenedor. Escalar por ancho.
-            new_width = a4_width
-            new_height = int(a4_width / image_aspect)
-            header_img_resized = header_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Recortar verticalmente, centrado: (new_height - header_height) / 2
-            top_crop = max(0, (new_height - header_height) // 2)
-            bottom_crop = top_crop + header_height
-            header_img_final = header_img_resized.crop((0, top_crop, new_width, bottom_crop))
-            logger.info(f"📐 Imagen escalada por ancho y recortada verticalmente (cover centrado): top={top_crop}")
-        else:  
-            # La imagen es más "ancha" (más baja) que el contenedor. Escalar por alto.
-            new_height = header_height
-            new_width = int(header_height * image_aspect)
-            header_img_resized = header_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Recortar horizontalmente, centrado: (new_width - a4_width) // 2
-            left_crop = max(0, (new_width - a4_width) // 2)
-            right_crop = left_crop + a4_width
-            header_img_final = header_img_resized.crop((left_crop, 0, right_crop, new_height))
-            logger.info(f"📐 Imagen escalada por alto y recortada horizontalmente (cover centrado): left={left_crop}")
-            
-        # Pegar la imagen de cabecera (RGB) sobre el canvas (RGBA)
-        canvas.paste(header_img_final, (0, 0))
-        # -----------------------------------------------------------
-        
-        # Crear un Draw en el canvas (RGBA)
-        draw = ImageDraw.Draw(canvas)
-        
-        # FUENTES
-        try:
-            # Fuentes del CUENTO 
-            font_normal = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 52)
-            font_bold = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 52)
-            
-            # Título del Cuento: **DejaVuSerif-Bold es la alternativa manuscrita disponible**
-            font_titulo = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSerif-Bold.ttf", 100) 
-            
-            # Letra Capital
-            font_drop_cap_base = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSerif-Bold.ttf", 150) 
-            logger.info("✅ Fuentes cargadas (Título actualizado a Serif-Bold)")
-        except Exception as e:
-            logger.error(f"❌ Error fuentes: {e}")
-            font_normal = ImageFont.load_default()
-            font_bold = ImageFont.load_default()
-            font_titulo = ImageFont.load_default()
-            font_drop_cap_base = ImageFont.load_default()
-        
-        fonts = {
-            'normal': font_normal,
-            'bold': font_bold,
-            'italic': font_bold,
-            'bold_italic': font_bold
-        }
-        
-        # LAYOUT
-        margin_left = 160
-        margin_right = 160
-        line_spacing = 80 
-        paragraph_spacing = 40  
-        max_width_px = a4_width - margin_left - margin_right
-        max_height = 3380
-
-        y_text = header_height + 245  # Bajado 2 líneas más para dar equilibrio con el título 
-        
-        # TÍTULO (En el borde inferior de la imagen: 50% sobre imagen, 50% sobre texto)
-        if titulo:
-            # APLICAR CAPITALIZACIÓN DE TÍTULO
-            titulo_capitalizado = to_title_case(titulo)
-            logger.info(f"Título original: '{titulo}' -> Capitalizado: '{titulo_capitalizado}'")
-            
-            # Calcular tamaño del bounding box del título con la nueva fuente
-            bbox_title = draw.textbbox((0, 0), titulo_capitalizado, font=font_titulo)
-            title_width = bbox_title[2] - bbox_title[0]
-            title_height = bbox_title[3] - bbox_title[1]
-
-            # AJUSTE DE MARGEN
-            padding_x = 40 
-            padding_y = 30
-            
-            # Altura total del rectángulo del título
-            rect_height = title_height + 2 * padding_y
-            
-            # CENTRAR HORIZONTALMENTE
-            title_x_bg = (a4_width - title_width - 2 * padding_x) // 2
-            
-            # POSICIONAR VERTICALMENTE: Exactamente en el borde inferior de la imagen
-            # 50% del rectángulo sobre la imagen, 50% sobre el fondo blanco
-            title_y_bg = header_height - rect_height // 2
-            
-            # Coordenadas del rectángulo de fondo
-            title_bg_rect = [
-                (title_x_bg, title_y_bg),
-                (title_x_bg + title_width + 2 * padding_x, title_y_bg + rect_height)
-            ]
-            
-            # Coordenadas donde empieza el texto (centrado dentro del padding)
-            title_offset_x = title_x_bg + padding_x
-            title_offset_y = title_y_bg + padding_y
-            
-            logger.info(f"📍 Título posicionado: Y={title_y_bg} (borde imagen: {header_height}, altura rect: {rect_height})")
-            
-            # Crear una capa temporal para el fondo semitransparente (RGBA)
-            alpha_img = Image.new('RGBA', canvas.size, (255, 255, 255, 0)) # Completamente transparente
-            alpha_draw = ImageDraw.Draw(alpha_img)
-            
-            # Dibuja el rectángulo BLANCO semitransparente (180 de opacidad)
-            alpha_draw.rectangle(title_bg_rect, fill=(255, 255, 255, 180)) 
-            
-            # Componer la capa semitransparente sobre el canvas (Ambos son RGBA)
-            canvas = Image.alpha_composite(canvas, alpha_img) 
-
-            # Volver a obtener el Draw después de alpha_composite
-            draw = ImageDraw.Draw(canvas)
-            
-            # APLICAR EFECTO INFANTIL AL TÍTULO DEL CUENTO (ROSA FUERTE/PÚRPURA)
-            title_main_color = '#E91E63'  # Rosa Fuerte/Fucsia
-            title_outline_color = '#8E24AA' # Púrpura Profundo (Para sombra/contorno)
-            outline_width = 4
-            
-            # Dibujar contorno para efecto de dulzura/dibujo animado
-            for dx in range(-outline_width, outline_width + 1):
-                for dy in range(-outline_width, outline_width + 1):
-                    # Dibujar contorno circular
-                    if dx * dx + dy * dy >= outline_width * outline_width: 
-                        draw.text((title_offset_x + dx, title_offset_y + dy), titulo_capitalizado, font=font_titulo, fill=title_outline_color)
-            
-            # Dibujar Título principal (Playful color)
-            draw.text((title_offset_x, title_offset_y), titulo_capitalizado, font=font_titulo, fill=title_main_color)
-            
-        # Convertir RGBA -> RGB antes del bucle principal de dibujado de texto.
-        canvas = canvas.convert('RGB')
-        draw = ImageDraw.Draw(canvas) # Vuelve a crear el objeto Draw para el nuevo modo
-        # ----------------------------------------------------------------------
-        # LÓGICA DE DIBUJADO DE TEXTO CON LETRA CAPITAL
-        # ----------------------------------------------------------------------
-        
-        text_color = '#2C3E50' if estilo == "infantil" else '#2c2c2c'
-        
-        # 1. Procesar el texto completo en líneas (dummy draw para cálculo de ancho)
-        temp_draw = ImageDraw.Draw(Image.new('RGB', (1, 1))) 
-        texto_lines = wrap_text_with_markdown(texto_cuento, fonts, max_width_px, temp_draw)
-        
-        # 2. Encontrar la primera línea de texto real para la letra capital
-        first_text_line_index = -1
-        for i, (line, line_type) in enumerate(texto_lines):
-            if line_type == 'text' and line.strip():
-                first_text_line_index = i
-                break
-
-        start_index_for_main_loop = 0
-        lines_drawn = 0
-        
-        if first_text_line_index != -1:
-            full_first_line_content, _ = texto_lines[first_text_line_index]
-            drop_cap_char = full_first_line_content[0]
-            
-            # 2a. Recolectar todo el texto del primer párrafo (después de la letra capital)
-            first_paragraph_content_lines = []
-            idx_end_first_para = first_text_line_index
-            while idx_end_first_para < len(texto_lines) and texto_lines[idx_end_first_para][1] != 'paragraph_break':
-                first_paragraph_content_lines.append(texto_lines[idx_end_first_para][0])
-                idx_end_first_para += 1
-            
-            text_to_reflow = " ".join(first_paragraph_content_lines)[1:].lstrip() # Quitar la letra capital
-            
-            # --- SETUP DE LETRA CAPITAL ---
-            DROP_CAP_LINES = 3 # Ocupará 3 líneas de altura.
-            
-            # Ajuste de tamaño de fuente para que la altura total de la caja del texto
-            drop_cap_size = line_spacing * (DROP_CAP_LINES + 0.3) 
-            
-            try:
-                font_drop_cap = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSerif-Bold.ttf", int(drop_cap_size))
-            except Exception:
-                font_drop_cap = font_drop_cap_base 
-            
-            # Calcular ancho de la Letra Capital
-            bbox_cap = draw.textbbox((0, 0), drop_cap_char, font=font_drop_cap)
-            cap_width = bbox_cap[2] - bbox_cap[0]
-            
-            # Ajuste vertical fino para alinear la parte superior de la cap con la primera línea de texto
-            cap_y_adjustment = -15 
-            drop_cap_x = margin_left 
-            drop_cap_y_final = y_text + cap_y_adjustment
-            
-            # Colores
-            cap_color = '#ef4444' 
-            
-            # DIBUJAR LETRA CAPITAL
-            draw.text((drop_cap_x, drop_cap_y_final), drop_cap_char, font=font_drop_cap, fill=cap_color)
-            
-            # 3. RE-WRAPPING para el texto que va junto a la cap
-            rest_x = drop_cap_x + cap_width + 25 # Margen derecho de la cap
-            rest_max_width = a4_width - rest_x - margin_right
-            
-            wrapped_reflow_text = wrap_text_with_markdown(text_to_reflow, fonts, rest_max_width, temp_draw)
-            
-            y_current_reflow = y_text 
-            
-            # 3a. Dibuja las líneas que van AL LADO de la Letra Capital
-            lines_drawn_around_cap = 0
-            
-            for j, (line_content, _) in enumerate(wrapped_reflow_text):
-                if lines_drawn_around_cap < DROP_CAP_LINES:
-                    if line_content.strip(): 
-                        draw_formatted_line(draw, rest_x, y_current_reflow, line_content, fonts, text_color, max_width_px=rest_max_width)
-                    y_current_reflow += line_spacing
-                    lines_drawn_around_cap += 1
-                else:
-                    break
-
-            # 3b. Mover el punto de inicio para el resto del cuento
-            # El nuevo punto Y empieza después de las 3 líneas ocupadas por la letra capital
-            y_text = y_text + DROP_CAP_LINES * line_spacing + paragraph_spacing 
-            lines_drawn = lines_drawn_around_cap
-            
-            # 3c. Dibujar el resto de las líneas del primer párrafo (si hubo overflow)
-            for j in range(lines_drawn_around_cap, len(wrapped_reflow_text)):
-                line_content, _ = wrapped_reflow_text[j]
-                if y_text > max_height: break
-                
-                # Usar ancho completo para el resto del párrafo
-                x_pos = margin_left
-                draw_formatted_line(draw, x_pos, y_text, line_content, fonts, text_color, max_width_px=max_width_px)
-                y_text += line_spacing
-                lines_drawn += 1
-            
-            # Si el primer párrafo original terminó con un salto de línea, avanzar
-            if idx_end_first_para < len(texto_lines) and texto_lines[idx_end_first_para][1] == 'paragraph_break':
-                y_text += paragraph_spacing
-                idx_end_first_para += 1 
-            
-            start_index_for_main_loop = idx_end_first_para 
-        
-        # ----------------------------------------------------------------------
-        # BUCLE PRINCIPAL PARA EL RESTO DEL CUENTO (PÁRRAFOS SIGUIENTES)
-        # ----------------------------------------------------------------------
-
-        for i in range(start_index_for_main_loop, len(texto_lines)):
-            line, line_type = texto_lines[i]
-            
-            if y_text > max_height:
-                logger.warning(f"⚠️ Truncado en línea {i+1}/{len(texto_lines)}")
-                break
-            
-            if line_type == 'paragraph_break':
-                y_text += paragraph_spacing  
-                continue
-
-            x_pos = margin_left
-            
-            draw_formatted_line(draw, x_pos, y_text, line, fonts, text_color, 
-                                max_width_px=max_width_px)
-            
-            y_text += line_spacing
-            lines_drawn += 1
-
-        logger.info(f"✅ {lines_drawn} líneas de texto dibujadas (incluyendo párrafos reflow)")
-        
-        if estilo == "infantil":
-            draw_wavy_border(draw, a4_width, a4_height)
+        fmt, compresion = output_format(request, formato, compresion)
+        escala = output_scale(dpi, escala)
+        img_bytes = await upload_or_asset(imagen, imagen_id)
+        text_size, fit_headers = await fitted_text(ajustar, fit_ficha, texto_cuento, titulo, header_height, estilo)
+        # Si el texto ya cabe al tamaño normal, la clave (y la caché) es la misma que sin `ajustar`
+        fit_args = (text_size,) if text_size not in (None, FICHA_TEXT_SIZE) else ()
+
+        if paginar:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            titulo_sanitizado = sanitize_filename(titulo) if titulo else "Sin_Titulo"
+            return await paginated_response(request, 'ficha', img_bytes, (texto_cuento, titulo, header_height, estilo),
+                                            salida, fmt, compresion, escala, fit_args, fit_headers,
+                                            f"Cuento_{titulo_sanitizado}_ficha_lectura_{timestamp}",
+                                            imagen_id, header_slot(header_height), 'RGB')
+
+        # El ETag es el hash del contenido de la petición: mismo contenido, misma imagen
+        key = render_key(VERSION, 'ficha', img_bytes, texto_cuento, titulo, header_height, estilo, fmt, compresion, escala,
+                         *fit_args)
+        etag = f'"{key}"'
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept", **fit_headers})
+
+        img = await asset_image(imagen_id, img_bytes, scale_item(header_slot(header_height), escala), 'RGB')
+        image_bytes = await cached_render(key, render_ficha, img, texto_cuento, titulo, header_height, estilo,
+                                          fmt, compresion, escala, *fit_args)
         
         # GENERAR NOMBRE DE ARCHIVO CON TIMESTAMP
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         titulo_sanitizado = sanitize_filename(titulo) if titulo else "Sin_Titulo"
-        filename = f"Cuento_{titulo_sanitizado}_ficha_lectura_{timestamp}.png"
-        
-        output_path = f"/tmp/{filename}"
-        canvas.save(output_path, quality=95, dpi=(300, 300))
+        filename = f"Cuento_{titulo_sanitizado}_ficha_lectura_{timestamp}.{EXTENSIONS[fmt]}"
         
         logger.info(f"✅ Ficha creada: {filename}")
         
-        return FileResponse(output_path, media_type="image/png", filename=filename)
+        return await image_response(image_bytes, filename, etag, MEDIA_TYPES[fmt], fit_headers)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
         import traceback
@@ -523,406 +395,456 @@ async def crear_ficha(
         
 @app.post("/crear-hoja-preguntas")
 async def crear_hoja_preguntas(
-    imagen_borde: UploadFile = File(...),
+    request: Request,
+    imagen_borde: UploadFile = File(None),
+    imagen_id: str = Form(default=""),
     preguntas: str = Form(...),
     titulo_cuento: str = Form(default=""),
-    estilo: str = Form(default="infantil")
+    estilo: str = Form(default="infantil"),
+    formato: str = Form(default=""),
+    compresion: str = Form(default=""),
+    dpi: str = Form(default=""),
+    escala: str = Form(default=""),
+    ajustar: bool = Form(default=False),
+    paginar: bool = Form(default=False),
+    salida: str = Form(default=""),
 ):
     # Se añade la versión al logger para seguimiento
-    logger.info(f"📝 v7.5-MARGENES-ASIMETRICOS-CAPA-CENTRADA: {len(preguntas)} caracteres")
+    logger.info(f"📝 v{VERSION}: {len(preguntas)} caracteres")
     
     try:
-        # Leer imagen del borde
-        img_bytes = await imagen_borde.read()
-        border_img = Image.open(io.BytesIO(img_bytes))
-        
-        # Dimensiones A4
-        a4_width = 2480
-        a4_height = 3508
-        
-        # ESTIRAR imagen de fondo para cubrir TODA la hoja A4
-        # (La imagen de fondo es cuadrada y debe expandirse a lo alto/ancho de la hoja)
-        logger.info(f"📐 Estirando imagen de fondo {border_img.width}x{border_img.height} a A4 {a4_width}x{a4_height}")
-        canvas = border_img.resize((a4_width, a4_height), Image.Resampling.LANCZOS)
-        logger.info(f"✅ Imagen de fondo expandida completamente a toda la hoja")
-        
-        if canvas.mode != 'RGBA':
-            canvas = canvas.convert('RGBA')
-
-        # ----------------------------------------------------------------------
-        # PASO CLAVE: DIBUJAR CAPA SEMI-TRANSPARENTE BLANCA CENTRAL
-        # FIX 2: La capa blanca solo cubre la zona CENTRAL del texto, 
-        # respetando los márgenes para dejar visible el borde temático de la IA.
-        # ----------------------------------------------------------------------
-        
-        # Márgenes para la capa blanca (AUMENTADOS verticalmente para centrar mejor)
-        BACKGROUND_MARGIN_X = 150  # Horizontal: bien establecido
-        BACKGROUND_MARGIN_Y = 200  # AUMENTADO de 120 a 200 para hacer la capa más pequeña y centrada
-        
-        # Coordenadas del área de contenido central (el rectangulo blanco)
-        content_x1 = BACKGROUND_MARGIN_X
-        content_x2 = a4_width - BACKGROUND_MARGIN_X
-        content_y1 = BACKGROUND_MARGIN_Y
-        content_y2 = a4_height - BACKGROUND_MARGIN_Y
-        
-        # Rectángulo que solo cubre el centro
-        rect_coords = [
-            (content_x1, content_y1),
-            (content_x2, content_y2)
-        ]
-        
-        # Crear una imagen temporal RGBA para la capa
-        alpha_img = Image.new('RGBA', canvas.size, (255, 255, 255, 0)) # Completamente transparente
-        alpha_draw = ImageDraw.Draw(alpha_img)
-        
-        # Dibujar el rectángulo semi-transparente BLANCO (Casi opaco: 230/255)
-        fill_color = (255, 255, 255, 230) # Blanco 90% opaco
-        
-        alpha_draw.rectangle(rect_coords, fill=fill_color)
-        
-        # Componer la capa sobre el canvas.
-        canvas = Image.alpha_composite(canvas, alpha_img)
-        # ----------------------------------------------------------------------
-        
-        # Convertir a RGB y volver a obtener el Draw.
-        canvas = canvas.convert('RGB') 
-        draw = ImageDraw.Draw(canvas) 
-        
-        # FUENTES Y ESTILO
-        
-        # Color del texto (gris oscuro, plomito) para contrastar con el fondo blanco
-        text_color = '#333333' 
-        
-        try:
-            # Título principal (Comprensión Lectora) 
-            font_titulo = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 85) 
-            
-            # Título del Cuento: 
-            font_subtitulo = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 70) 
-            
-            # Fuentes para el texto de las preguntas y opciones (más grandes y dulces)
-            font_preguntas = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 50) 
-            font_bold = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 52) 
-            font_numero = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 58) 
-            font_opciones = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 48) 
-            
-            logger.info("✅ Fuentes cargadas para hoja de preguntas")
-        except Exception as e:
-            logger.error(f"❌ Error fuentes: {e}. Usando default.")
-            font_titulo = ImageFont.load_default()
-            font_subtitulo = ImageFont.load_default()
-            font_preguntas = ImageFont.load_default()
-            font_bold = ImageFont.load_default()
-            font_numero = ImageFont.load_default()
-            font_opciones = ImageFont.load_default()
-        
-        fonts = {
-            'normal': font_preguntas, 
-            'bold': font_bold,
-            'italic': font_bold,
-            'bold_italic': font_bold
-        }
-        
-        fonts_opciones = {
-            'normal': font_opciones, 
-            'bold': font_bold,
-            'italic': font_bold,
-            'bold_italic': font_bold
-        }
-        
-        # PROCESAR PREGUNTAS
-        try:
-            import json
-            import re
-            
-            # Intenta cargar como JSON (lista de preguntas/opciones)
-            preguntas_list = json.loads(preguntas)
-            if not isinstance(preguntas_list, list):
-                preguntas_list = [preguntas]
-
-            # Si es un array con 1 elemento, intentar separar de forma inteligente
-            if len(preguntas_list) == 1:
-                texto_completo = str(preguntas_list[0])
-                
-                # ESTRATEGIA 1: Buscar numeración (1., 2., 3., etc.) - Funciona con \n o \n\n
-                # El patrón busca: inicio de línea O salto de línea, seguido de dígito(s) y punto
-                partes_numeradas = re.split(r'(?:^|\n+)(?=\d+\.)', texto_completo)
-                partes_numeradas = [p.strip() for p in partes_numeradas if p.strip()]
-                
-                if len(partes_numeradas) > 1:
-                    # Si encontró preguntas numeradas, usarlas (maneja \n y \n\n)
-                    preguntas_list = partes_numeradas
-                    logger.info(f"✅ Separado por numeración: {len(preguntas_list)} preguntas")
-                elif '\n\n' in texto_completo:
-                    # ESTRATEGIA 2: Fallback a separación por doble salto
-                    preguntas_list = [p.strip() for p in texto_completo.split('\n\n') if p.strip()]
-                    logger.info(f"✅ Separado por \\n\\n: {len(preguntas_list)} preguntas")
-                else:
-                    logger.warning("⚠️ No se pudo separar las preguntas, usando como una sola")
-
-            logger.info(f"✅ {len(preguntas_list)} preguntas parseadas en total")
-        except (json.JSONDecodeError, TypeError) as e:
-            logger.error(f"Error parseando JSON: {e}. Cayendo a split inteligente.")
-            # Fallback con el mismo método inteligente
-            texto_completo = str(preguntas)
-            partes_numeradas = re.split(r'(?:^|\n+)(?=\d+\.)', texto_completo)
-            preguntas_list = [p.strip() for p in partes_numeradas if p.strip()]
-        
-        # CONFIGURACIÓN DE LAYOUT
-        
-        # Margen de texto interno (ASIMÉTRICO: más margen a la izquierda)
-        TEXT_MARGIN_LEFT = 280   # DOBLE margen izquierdo para que círculo y texto queden dentro
-        TEXT_MARGIN_RIGHT = 200  # Margen derecho normal (está bien)
-        TEXT_MARGIN_Y_TOP = 320  # Ajustado para la nueva altura de capa blanca
-        
-        # El ancho máximo de texto se define por los márgenes asimétricos
-        text_start_x = TEXT_MARGIN_LEFT 
-        text_end_x = a4_width - TEXT_MARGIN_RIGHT
-        max_width_px = text_end_x - text_start_x
-        
-        margin_top = TEXT_MARGIN_Y_TOP # Iniciar texto con margen superior
-        
-        line_spacing = 75 
-        option_spacing = 65 
-        question_spacing = 50
-        answer_line_height = 60 
-        space_after_answer = 80
-        
-        # Altura máxima: debe terminar antes del margen inferior
-        max_height = a4_height - 320  # Margen inferior para mantener contenido dentro de la capa 
+        fmt, compresion = output_format(request, formato, compresion)
+        escala = output_scale(dpi, escala)
+        # Leer imagen del borde (subida o guardada con POST /imagenes)
+        img_bytes = await upload_or_asset(imagen_borde, imagen_id)
+        text_size, fit_headers = await fitted_text(ajustar, fit_hoja_preguntas, preguntas, titulo_cuento, estilo)
+        fit_args = (text_size,) if text_size not in (None, HOJA_TEXT_SIZE) else ()
 
-        y_text = margin_top
-        
-        # ENCABEZADO "Comprensión Lectora" (MANTENIENDO ESTILO 3D AZUL/ROSA)
-        encabezado = "Comprensión Lectora"
-        bbox = draw.textbbox((0, 0), encabezado, font=font_titulo)
-        text_width = bbox[2] - bbox[0]
-        x_centered = (a4_width - text_width) // 2
-        
-        if estilo == "infantil":
-            # Estilo original '3D y rosa' restaurado
-            shadow_color = '#1a5490' # Azul oscuro para sombra/contorno
-            main_color = '#42A5F5' # Azul claro/juguetón
-            outline_width = 4
-            
-            # Dibujar contorno
-            for dx in range(-outline_width, outline_width + 1):
-                for dy in range(-outline_width, outline_width + 1):
-                    if dx * dx + dy * dy >= outline_width * outline_width:
-                        draw.text((x_centered + dx, y_text + dy), encabezado, font=font_titulo, fill=shadow_color)
-            
-            # Dibujar texto principal
-            draw.text((x_centered, y_text), encabezado, font=font_titulo, fill=main_color)
-        else:
-            draw.text((x_centered, y_text), encabezado, font=font_titulo, fill='#1a5490')
-        
-        y_text += 105
-        
-        # TÍTULO DEL CUENTO
-        if titulo_cuento:
-            titulo_capitalizado = to_title_case(titulo_cuento)
-            cuento_text = f'Cuento: "{titulo_capitalizado}"'
-            bbox = draw.textbbox((0, 0), cuento_text, font=font_subtitulo)
-            text_width = bbox[2] - bbox[0]
-            x_centered = (a4_width - text_width) // 2
-            
-            # Subtítulo sin efecto para contraste
-            draw.text((x_centered, y_text), cuento_text, font=font_subtitulo, fill='#333333') 
-            
-            y_text += 80
-        
-        # LÍNEA SEPARADORA
-        line_margin = text_start_x + 80 
-        if estilo == "infantil":
-            colors = ['#FF6B9D', '#FFD93D', '#6BCF7F', '#4ECDC4']
-            segment_width = (text_end_x - line_margin - 80) // len(colors)
-            for i, color in enumerate(colors):
-                x1 = line_margin + i * segment_width
-                x2 = x1 + segment_width
-                draw.rectangle([(x1, y_text), (x2, y_text + 6)], fill=color)
-        else:
-            draw.line([(line_margin, y_text), (text_end_x - 80, y_text)], fill='#1a5490', width=3)
-        
-        y_text += 55
-        
-        # CAMPOS DE NOMBRE Y FECHA
-        campos_y = y_text
-        # Texto de campos en el color principal (gris oscuro)
-        draw.text((text_start_x, campos_y), "Nombre:", font=font_preguntas, fill=text_color)
-        line_x_start = text_start_x + 200
-        line_x_end = text_start_x + 800
-        # Dibujar línea un poco debajo del texto
-        draw.line([(line_x_start, campos_y + 50), (line_x_end, campos_y + 50)], fill=text_color, width=2)
-        
-        fecha_x = text_end_x - 400
-        draw.text((fecha_x, campos_y), "Fecha:", font=font_preguntas, fill=text_color)
-        line_x_start = fecha_x + 140
-        line_x_end = text_end_x
-        # Dibujar línea un poco debajo del texto
-        draw.line([(line_x_start, campos_y + 50), (line_x_end, campos_y + 50)], fill=text_color, width=2)
-        
-        y_text += 120
-        
-        # DIBUJAR PREGUNTAS CON OPCIONES Y RESPUESTAS
-        
-        questions_drawn = 0
-        # La posición del círculo se ajusta ligeramente ANTES de donde empieza el texto (text_start_x)
-        CIRCLE_START_X = text_start_x - 50 
-        
-        for idx, pregunta_completa in enumerate(preguntas_list):
-            if not pregunta_completa.strip():
-                continue
-            
-            # Verificar si hay espacio para la siguiente pregunta
-            estimated_height_needed = line_spacing * 2 + space_after_answer 
-            
-            if y_text + estimated_height_needed > max_height:
-                logger.warning(f"⚠️ Truncado en pregunta {idx+1}/{len(preguntas_list)}")
-                break
-            
-            # Separar pregunta de opciones
-            partes = pregunta_completa.split('\n')
-            pregunta_principal = partes[0].strip()
-            # Filtra opciones que tengan formato a), b), etc.
-            opciones = [p.strip() for p in partes[1:] if p.strip() and re.match(r'^[a-dA-D]\)', p.strip())]
-            
-            # Limpiar numeración si ya viene
-            pregunta_sin_numero = re.sub(r'^\d+\.\s*', '', pregunta_principal)
-            
-            # NÚMERO DE PREGUNTA
-            numero = str(idx + 1)
-            
-            if estilo == "infantil":
-                circle_x = CIRCLE_START_X
-                circle_y = y_text + 18
-                circle_radius = 26
-                
-                # Círculo 'Dulce' para el número de pregunta
-                draw.ellipse(
-                    [(circle_x - circle_radius, circle_y - circle_radius),
-                     (circle_x + circle_radius, circle_y + circle_radius)],
-                    fill='#FF6B9D', # Rosa Fuerte
-                    outline='#E91E63', # Rosa más oscuro para el borde
-                    width=3
-                )
-                
-                bbox = draw.textbbox((0, 0), numero, font=font_numero)
-                num_width = bbox[2] - bbox[0]
-                num_height = bbox[3] - bbox[1]
-                draw.text(
-                    (circle_x - num_width//2, circle_y - num_height//2 - 3),
-                    numero,
-                    font=font_numero,
-                    fill='white' # Blanco para el número
-                )
-                
-                # El texto de la pregunta empieza donde debería iniciar el texto
-                x_pregunta = text_start_x
-            else:
-                # Dibujar número en la posición de inicio del círculo (que está antes del texto)
-                draw.text((CIRCLE_START_X + 15, y_text), f"{numero}.", font=font_numero, fill=text_color)
-                # El texto principal empieza en el inicio del texto
-                x_pregunta = text_start_x 
-            
-            # TEXTO DE LA PREGUNTA
-            max_width_pregunta = max_width_px
-            
-            temp_draw = ImageDraw.Draw(Image.new('RGB', (1, 1))) 
-            pregunta_lines_with_type = wrap_text_with_markdown(pregunta_sin_numero, fonts, max_width_pregunta, temp_draw)
-            
-            for line, line_type in pregunta_lines_with_type:
-                if line_type == 'paragraph_break':
-                    y_text += 40  
-                    continue
-                # Las preguntas se dibujan con el nuevo text_color (gris oscuro)
-                draw_formatted_line(draw, x_pregunta, y_text, line, fonts, text_color, max_width_pregunta)
-                y_text += line_spacing
-            
-            # OPCIONES (si las hay)
-            if opciones:
-                y_text += 15
-                
-                for opcion in opciones:
-                    if y_text > max_height:
-                        break
-                    
-                    x_opcion = x_pregunta + 60
-                    max_width_opcion = max_width_px - 60
-                    opcion_lines_with_type = wrap_text_with_markdown(opcion, fonts_opciones, max_width_opcion, temp_draw)
-                    
-                    for line, line_type in opcion_lines_with_type:
-                        if line_type == 'paragraph_break':
-                            continue
-                        # Las opciones se dibujan con el nuevo text_color (gris oscuro) y fuente más amigable
-                        draw_formatted_line(draw, x_opcion, y_text, line, fonts_opciones, text_color, max_width_opcion)
-                        y_text += option_spacing
-                
-                y_text += question_spacing
-            else:
-                y_text += question_spacing + 20
-            
-            # LÍNEA PARA RESPUESTA
-            # La línea se dibuja en la posición actual de y_text
-            line_y = y_text 
-            
-            if line_y < max_height:
-                line_start_x = text_start_x + 50
-                line_end_x = text_end_x - 50
-                
-                if estilo == "infantil":
-                    dot_spacing = 20
-                    dot_radius = 3
-                    # Dibuja la línea de puntos
-                    for x in range(line_start_x, line_end_x, dot_spacing):
-                        color = ['#FF6B9D', '#FFD93D', '#6BCF7F', '#4ECDC4'][idx % 4]
-                        draw.ellipse([(x - dot_radius, line_y - dot_radius),
-                                     (x + dot_radius, line_y + dot_radius)],
-                                     fill=color)
-                else:
-                    # Dibuja línea sólida
-                    draw.line([(line_start_x, line_y), (line_end_x, line_y)], 
-                             fill=text_color, width=2)
-                
-                # Avanzamos y_text *después* de dibujar la línea, para asegurar el espacio.
-                y_text += answer_line_height + space_after_answer
-            
-            questions_drawn += 1
-        
-        logger.info(f"✅ {questions_drawn}/{len(preguntas_list)} preguntas dibujadas")
+        if paginar:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            titulo_sanitizado = sanitize_filename(titulo_cuento) if titulo_cuento else "Sin_Titulo"
+            return await paginated_response(request, 'hoja_preguntas', img_bytes, (preguntas, titulo_cuento, estilo),
+                                            salida, fmt, compresion, escala, fit_args, fit_headers,
+                                            f"Cuento_{titulo_sanitizado}_ficha_preguntas_{timestamp}",
+                                            imagen_id, border_slot())
+
+        key = render_key(VERSION, 'hoja_preguntas', img_bytes, preguntas, titulo_cuento, estilo, fmt, compresion, escala,
+                         *fit_args)
+        etag = f'"{key}"'
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept", **fit_headers})
+
+        img = await asset_image(imagen_id, img_bytes, scale_item(border_slot(), escala))
+        image_bytes = await cached_render(key, render_hoja_preguntas, img, preguntas, titulo_cuento, estilo,
+                                          fmt, compresion, escala, *fit_args)
         
         # GENERAR NOMBRE DE ARCHIVO CON TIMESTAMP
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         titulo_sanitizado = sanitize_filename(titulo_cuento) if titulo_cuento else "Sin_Titulo"
-        filename = f"Cuento_{titulo_sanitizado}_ficha_preguntas_{timestamp}.png"
-        
-        # GUARDAR
-        canvas = canvas.convert('RGB')
-        output_path = f"/tmp/{filename}"
-        canvas.save(output_path, quality=95, dpi=(300, 300))
+        filename = f"Cuento_{titulo_sanitizado}_ficha_preguntas_{timestamp}.{EXTENSIONS[fmt]}"
         
         logger.info(f"✅ Hoja de preguntas creada: {filename}")
         
-        return FileResponse(output_path, media_type="image/png", filename=filename)
+        return await image_response(image_bytes, filename, etag, MEDIA_TYPES[fmt], fit_headers)
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    
+@app.post("/crear-pdf")
+async def crear_pdf(
+    request: Request,
+    imagen: UploadFile = File(...),
+    imagen_borde: UploadFile = File(...),
+    texto_cuento: str = Form(...),
+    preguntas: str = Form(...),
+    titulo: str = Form(default=""),
+    titulo_cuento: str = Form(default=None),
+    header_height: int = Form(default=1150),
+    estilo: str = Form(default="infantil"),
+):
+    """
+    Ficha de lectura + hoja de preguntas en un PDF A4 de dos páginas, listo para imprimir.
+    `titulo_cuento` (el de la hoja de preguntas) toma por defecto el `titulo` de la ficha.
+    """
+    if titulo_cuento is None:
+        titulo_cuento = titulo
+    logger.info(f"📄 v{VERSION}: PDF, {len(texto_cuento)} chars, {len(preguntas)} caracteres de preguntas")
+
+    try:
+        header_bytes = await read_upload(imagen)
+        border_bytes = await read_upload(imagen_borde)
+
+        key = render_key(VERSION, 'pdf', header_bytes, border_bytes, texto_cuento, titulo, header_height, estilo,
+                         preguntas, titulo_cuento)
+        etag = f'"{key}"'
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        pdf_bytes = await cached_render(key, render_pdf, header_bytes, border_bytes, texto_cuento, titulo,
+                                        header_height, estilo, preguntas, titulo_cuento)
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        titulo_sanitizado = sanitize_filename(titulo) if titulo else "Sin_Titulo"
+        filename = f"Cuento_{titulo_sanitizado}_fichas_{timestamp}.pdf"
+
+        logger.info(f"✅ PDF creado: {filename} ({len(pdf_bytes) / 1024:.0f} KB)")
+
+        return await image_response(pdf_bytes, filename, etag, "application/pdf")
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def preview_response(tipo: str, img_bytes: bytes, params: tuple, formato: str, compresion: str,
+                           dpi: str, escala: str) -> dict:
+    """
+    Renderiza la vista previa y guarda el pedido: el `id` devuelto permite pedir después el
+    render completo en GET /render/{id}, que comparte caché con /crear-ficha y /crear-hoja-preguntas.
+    """
+    try:
+        fmt, calidad = resolve_format(formato or 'jpeg', compresion)
+        # Sin `compresion`, JPEG y WebP usan la calidad de vista previa (más ligera que la de impresión)
+        compresion = PREVIEW_QUALITY if fmt in ('jpeg', 'webp') and not compresion else calidad
+        escala = resolve_escala(dpi if dpi or escala else str(PREVIEW_DPI), escala)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    render_id = render_key(VERSION, tipo, img_bytes, *params)
+    await preview_store.put(render_id, pack_request(tipo, img_bytes, params))
+
+    preview_fn = preview_ficha if tipo == 'ficha' else preview_hoja_preguntas
+    image_bytes, info = await run_render(preview_fn, img_bytes, *params, fmt, compresion, escala)
+    logger.info(f"👀 Vista previa {tipo}: {len(image_bytes) / 1024:.0f} KB, truncado={info['truncated']}")
+
+    return {
+        "id": render_id,
+        "url": f"/render/{render_id}",
+        "imagen": f"data:{MEDIA_TYPES[fmt]};base64,{base64.b64encode(image_bytes).decode('ascii')}",
+        "dpi": round(DPI * escala),
+        **preview_summary(tipo, info),
+    }
+
+
+@app.post("/vista-previa/ficha")
+async def vista_previa_ficha(
+    imagen: UploadFile = File(...),
+    texto_cuento: str = Form(...),
+    titulo: str = Form(default=""),
+    header_height: int = Form(default=1150),
+    estilo: str = Form(default="infantil"),
+    formato: str = Form(default=""),
+    compresion: str = Form(default=""),
+    dpi: str = Form(default=""),
+    escala: str = Form(default=""),
+):
+    """
+    Vista previa rápida de la ficha (JPEG a 72 DPI por defecto) con las líneas que caben,
+    si el cuento se trunca y en qué línea. Los saltos de línea son los de la versión final.
+    """
+    try:
+        img_bytes = await read_upload(imagen)
+        return await preview_response('ficha', img_bytes, (texto_cuento, titulo, header_height, estilo),
+                                      formato, compresion, dpi, escala)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/vista-previa/hoja-preguntas")
+async def vista_previa_hoja_preguntas(
+    imagen_borde: UploadFile = File(...),
+    preguntas: str = Form(...),
+    titulo_cuento: str = Form(default=""),
+    estilo: str = Form(default="infantil"),
+    formato: str = Form(default=""),
+    compresion: str = Form(default=""),
+    dpi: str = Form(default=""),
+    escala: str = Form(default=""),
+):
+    """Vista previa rápida de la hoja de preguntas con cuántas preguntas caben y si se trunca."""
+    try:
+        img_bytes = await read_upload(imagen_borde)
+        return await preview_response('hoja_preguntas', img_bytes, (preguntas, titulo_cuento, estilo),
+                                      formato, compresion, dpi, escala)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/render/{render_id}")
+async def render_completo(
+    request: Request,
+    render_id: str,
+    formato: str = "",
+    compresion: str = "",
+    dpi: str = "",
+    escala: str = "",
+):
+    """
+    Render completo de una vista previa anterior, por su `id`. Usa la misma clave de caché que
+    /crear-ficha y /crear-hoja-preguntas: si ya se renderizó con esos parámetros no se repite.
+    """
+    try:
+        data = await preview_store.get(render_id)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Vista previa desconocida o caducada: vuelva a enviarla")
+        tipo, img_bytes, params = unpack_request(data)
+        fmt, compresion = output_format(request, formato, compresion)
+        escala = output_scale(dpi, escala)
+
+        key = render_key(VERSION, tipo, img_bytes, *params, fmt, compresion, escala)
+        etag = f'"{key}"'
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+
+        render_fn = render_ficha if tipo == 'ficha' else render_hoja_preguntas
+        image_bytes = await cached_render(key, render_fn, img_bytes, *params, fmt, compresion, escala)
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        titulo_sanitizado = sanitize_filename(params[1]) if params[1] else "Sin_Titulo"
+        suffix = "ficha_lectura" if tipo == 'ficha' else "ficha_preguntas"
+        filename = f"Cuento_{titulo_sanitizado}_{suffix}_{timestamp}.{EXTENSIONS[fmt]}"
+        logger.info(f"✅ Render completo de vista previa: {filename}")
+        return await image_response(image_bytes, filename, etag, MEDIA_TYPES[fmt])
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Pausa entre reintentos cuando un lote encuentra el pool lleno
+BATCH_RETRY_DELAY = 0.05
+
+async def run_render_waiting(fn, *args):
+    """Como run_render, pero si la cola está llena espera turno en lugar de responder 503 (lotes)."""
+    while True:
+        try:
+            return await render_pool.run(fn, *args)
+        except RenderQueueFull:
+            await asyncio.sleep(BATCH_RETRY_DELAY)
+
+
+def job_filename(job, fmt: str) -> str:
+    titulo_sanitizado = sanitize_filename(job.titulo) if job.titulo else "Sin_Titulo"
+    suffix = "ficha_lectura" if job.tipo == 'ficha' else "ficha_preguntas"
+    return f"{job.index:03d}_Cuento_{titulo_sanitizado}_{suffix}.{EXTENSIONS[fmt]}"
+
+
+@app.post("/crear-lote")
+async def crear_lote(
+    request: Request,
+    imagenes: List[UploadFile] = File(...),
+    trabajos: str = Form(...),
+    formato: str = Form(default=""),
+    compresion: str = Form(default=""),
+    dpi: str = Form(default=""),
+    escala: str = Form(default=""),
+    salida: str = Form(default=""),
+):
+    """
+    Renderiza un lote de fichas y hojas de preguntas en paralelo en el pool.
+    Cada imagen subida se decodifica una sola vez por slot aunque la usen varios trabajos
+    (p. ej. el mismo borde en todas las hojas). La respuesta es un ZIP en streaming, o
+    multipart/mixed con `salida=multipart` o Accept: multipart/mixed; los errores de
+    trabajos sueltos se informan en `errores.json` sin cortar el lote.
+    """
+    try:
+        fmt, compresion = resolve_format(formato, compresion)
+        escala = resolve_escala(dpi, escala)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if salida not in ("", "zip", "multipart"):
+        raise HTTPException(status_code=400, detail=f"salida inválida: {salida!r} (usar 'zip' o 'multipart')")
+
+    # Los trabajos eligen su imagen por nombre: dos archivos con el mismo nombre serían ambiguos
+    names = [imagen.filename for imagen in imagenes]
+    repeated = sorted({name for name in names if names.count(name) > 1})
+    if repeated:
+        raise HTTPException(status_code=400, detail=f"Imágenes con el mismo nombre: {', '.join(repeated)} "
+                                                    "(cada archivo de `imagenes` necesita un nombre distinto)")
+
+    uploads = {}
+    for imagen in imagenes:
+        uploads[imagen.filename] = await read_upload(imagen)
+    try:
+        jobs = parse_jobs(trabajos, uploads)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    multipart = salida == "multipart" or (not salida and "multipart/mixed" in request.headers.get("accept", ""))
+    logger.info(f"📦 v{VERSION}: lote de {len(jobs)} trabajos, {len(uploads)} imágenes, salida={'multipart' if multipart else 'zip'}")
+
+    # Cuántos trabajos usan cada (imagen, slot): solo se comparte lo que se repite
+    slots = {}
+    for job in jobs:
+        slot = scale_item(header_slot(job.params[2]) if job.tipo == 'ficha' else border_slot(), escala)
+        slots[job.index] = (job.imagen, slot, 'RGB' if job.tipo == 'ficha' else None)
+    uses = {}
+    for decode_key in slots.values():
+        uses[decode_key] = uses.get(decode_key, 0) + 1
+
+    decoded = {}
+    semaphore = asyncio.Semaphore(render_pool.workers)
+
+    async def render_job(job):
+        img_bytes = uploads[job.imagen]
+        render_fn = render_ficha if job.tipo == 'ficha' else render_hoja_preguntas
+        key = render_key(VERSION, job.tipo, img_bytes, *job.params, fmt, compresion, escala)
+        try:
+            async with semaphore:
+                img = img_bytes
+                decode_key = slots[job.index]
+                # Sondeo sin contar fallos: cached_render cuenta el acierto o el fallo real
+                if uses[decode_key] > 1 and not render_cache.contains(key):
+                    if decode_key not in decoded:
+                        decoded[decode_key] = asyncio.ensure_future(
+                            run_render_waiting(load_image, img_bytes, *decode_key[1:]))
+                    img = await asyncio.shield(decoded[decode_key])
+                image_bytes = await cached_render(key, render_fn, img, *job.params, fmt, compresion, escala,
+                                                  runner=run_render_waiting)
+            return job, image_bytes, None
+        except Exception as e:
+            logger.error(f"❌ Lote, trabajo {job.index} ({job.tipo}): {e}")
+            return job, None, e
+
+    async def entries():
+        tasks = [asyncio.ensure_future(render_job(job)) for job in jobs]
+        errors = []
+        try:
+            for done in asyncio.as_completed(tasks):
+                job, image_bytes, error = await done
+                if error is not None:
+                    errors.append({"trabajo": job.index, "tipo": job.tipo, "imagen": job.imagen, "error": str(error)})
+                    continue
+                yield job_filename(job, fmt), image_bytes, MEDIA_TYPES[fmt]
+        finally:
+            # Si el cliente corta la descarga, no se siguen renderizando los pendientes
+            for task in tasks:
+                task.cancel()
+        if errors:
+            yield "errores.json", json.dumps(errors, ensure_ascii=False, indent=2).encode('utf-8'), "application/json"
+        logger.info(f"✅ Lote terminado: {len(jobs) - len(errors)} renders, {len(errors)} errores")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if multipart:
+        boundary = uuid.uuid4().hex
+        return StreamingResponse(stream_multipart(entries(), boundary),
+                                 media_type=f"multipart/mixed; boundary={boundary}")
+    return StreamingResponse(stream_zip(entries()), media_type="application/zip",
+                             headers={"Content-Disposition": f'attachment; filename="Lote_{timestamp}.zip"'})
+    
     
 @app.get("/")
 def root():
     return {
         "status": "ok",
-        "version": "7.5-MARGENES-ASIMETRICOS-CAPA-CENTRADA",
-        "features": ["crear_ficha", "crear_hoja_preguntas"],
+        "version": VERSION,
+        "features": ["crear_ficha", "crear_hoja_preguntas", "crear_pdf", "crear_lote", "vista_previa", "imagenes"],
         "endpoints": {
-            "POST /crear-ficha": "Crea ficha de lectura con mejor espaciado entre título y texto",
-            "POST /crear-hoja-preguntas": "Crea hoja de preguntas con capa blanca centrada y márgenes asimétricos"
+            "POST /imagenes": "Guarda una imagen y devuelve su id para usarla con imagen_id",
+            "POST /crear-ficha": "Crea ficha de lectura con mejor espaciado entre título y texto (paginar=true: varias páginas)",
+            "POST /crear-hoja-preguntas": "Crea hoja de preguntas con capa blanca centrada y márgenes asimétricos (paginar=true: varias páginas)",
+            "POST /crear-pdf": "Crea ficha + hoja de preguntas en un PDF A4 de dos páginas (texto real)",
+            "POST /crear-lote": "Crea fichas y hojas de preguntas en lote (ZIP o multipart en streaming)",
+            "POST /vista-previa/ficha": "Vista previa rápida de la ficha con líneas y truncado",
+            "POST /vista-previa/hoja-preguntas": "Vista previa rápida de la hoja con preguntas que caben",
+            "GET /render/{id}": "Render completo de una vista previa anterior",
+            "GET /metrics": "Métricas para Prometheus (peticiones, tiempos por etapa, bytes, cachés)"
         },
         "message": "Dual service: reading worksheets + question sheets (CAPA BLANCA CENTRADA + MÁRGENES ASIMÉTRICOS)"
     }
 
 @app.get("/health")
 def health():
-    return {"status": "healthy", "version": "7.5-MARGENES-ASIMETRICOS-CAPA-CENTRADA"}
+    return {
+        "status": "healthy",
+        "version": VERSION,
+        "fonts": font_registry.stats(),
+        "render_cache": render_cache.stats(),
+        "previews": preview_store.stats(),
+        "assets": asset_store.stats(),
+        "asset_images": asset_images.stats(),
+        "derived_images": derived_images.stats(),
+        "base_pages": base_pages.stats()
+    }
+
+
+# ----------------------------------------------------------------------
+# MÉTRICAS (formato Prometheus)
+# ----------------------------------------------------------------------
+
+# Cachés con lru_cache; con RENDER_POOL=process solo se ven las del proceso principal
+LRU_CACHES = {
+    "layout_ficha": layout_ficha,
+    "layout_ficha_pages": layout_ficha_pages,
+    "layout_hoja_preguntas": layout_hoja_preguntas,
+    "layout_hoja_preguntas_pages": layout_hoja_preguntas_pages,
+    "markdown": tokenize_markdown,
+    "token_width": token_width,
+    "layers": render_layer,
+    "sprites": outlined_text_sprite,
+    "stamps": stamp_sprite,
+}
+
+
+def cache_counts() -> dict:
+    """(aciertos, fallos) de cada caché"""
+    counts = {name: (stats["hits"], stats["misses"])
+              for name, stats in (("render", render_cache.stats()), ("previews", preview_store.stats()),
+                                  ("fonts", font_registry.stats()), ("assets", asset_store.stats()),
+                                  ("asset_images", asset_images.stats()), ("derived_images", derived_images.stats()),
+                                  ("base_pages", base_pages.stats()))}
+    for name, cached_fn in LRU_CACHES.items():
+        info = cached_fn.cache_info()
+        counts[name] = (info.hits, info.misses)
+    return counts
+
+
+def cache_hit_ratios() -> dict:
+    return {name: round(hits / (hits + misses), 3) if hits + misses else 0.0
+            for name, (hits, misses) in cache_counts().items()}
+
+
+registry.register(CallbackMetric("cache_hits_total", "Aciertos por caché", ("cache",),
+                                 lambda: {name: hits for name, (hits, _) in cache_counts().items()}, kind="counter"))
+registry.register(CallbackMetric("cache_misses_total", "Fallos por caché", ("cache",),
+                                 lambda: {name: misses for name, (_, misses) in cache_counts().items()}, kind="counter"))
+registry.register(CallbackMetric("cache_hit_ratio", "Proporción de aciertos por caché", ("cache",), cache_hit_ratios))
+registry.register(CallbackMetric("render_queue_depth", "Renders esperando un worker libre",
+                                 collect=lambda: render_pool.queue_depth))
+registry.register(CallbackMetric("render_in_flight", "Renders admitidos en el pool (en curso + en cola)",
+                                 collect=lambda: render_pool.pending))
+registry.register(CallbackMetric("render_workers", "Workers del pool de renderizado",
+                                 collect=lambda: render_pool.workers))
+# ru_maxrss viene en KB en Linux; con RENDER_POOL=process es el del proceso principal
+registry.register(CallbackMetric("process_peak_rss_bytes", "Memoria residente máxima del proceso desde el arranque",
+                                 collect=lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+
+
+@app.get("/metrics")
+def metrics():
+    """Métricas para Prometheus: peticiones, errores, cola, tiempos por etapa, bytes y cachés"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
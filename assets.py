@@ -0,0 +1,27 @@
+import hashlib
+import os
+
+from image_cache import ImageCache
+from render_cache import RenderCache
+
+# CONFIGURACIÓN (variables de entorno)
+# ASSET_STORE_MB: memoria para las imágenes subidas a POST /imagenes (bytes originales)
+# ASSET_DIR: directorio donde se conservan además en disco ("" lo desactiva)
+# ASSET_DISK_MB: tamaño máximo del almacén en disco (LRU por fecha de último uso)
+# ASSET_IMAGES_MB: memoria para las imágenes del almacén ya decodificadas por slot
+ASSET_STORE_MB = int(os.environ.get("ASSET_STORE_MB", 64))
+ASSET_DIR = os.environ.get("ASSET_DIR", "/tmp/asset-store")
+ASSET_DISK_MB = int(os.environ.get("ASSET_DISK_MB", 1024))
+ASSET_IMAGES_MB = int(os.environ.get("ASSET_IMAGES_MB", 256))
+
+
+def asset_id(data: bytes) -> str:
+    """Id de una imagen subida: el hash de su contenido (la misma imagen siempre tiene el mismo id)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+# Bytes originales por id: en disco sobreviven a reinicios, así los ids siguen valiendo
+asset_store = RenderCache(memory_bytes=ASSET_STORE_MB * 1024 * 1024, directory=ASSET_DIR,
+                          disk_bytes=ASSET_DISK_MB * 1024 * 1024)
+# Decodificadas por (id, caja del slot, ajuste, modo), ya reducidas cerca del tamaño final
+asset_images = ImageCache(ASSET_IMAGES_MB * 1024 * 1024)
@@ -0,0 +1,109 @@
+from typing import NamedTuple
+import io
+import json
+import os
+import zipfile
+
+# Máximo de trabajos por lote
+BATCH_MAX_JOBS = int(os.environ.get("BATCH_MAX_JOBS", 200))
+
+JOB_TYPES = ('ficha', 'hoja_preguntas')
+
+
+class BatchJob(NamedTuple):
+    """Un render del lote: tipo, nombre de la imagen subida y argumentos del render tras la imagen"""
+    index: int
+    tipo: str
+    imagen: str
+    params: tuple
+    titulo: str
+
+
+def parse_jobs(trabajos: str, image_names) -> list:
+    """
+    Valida el campo `trabajos` (lista JSON) y lo convierte en BatchJob.
+    Cada trabajo indica `tipo` ("ficha" u "hoja_preguntas"), `imagen` (nombre de uno de los
+    archivos subidos) y los mismos campos que el endpoint individual correspondiente.
+    Lanza ValueError con un mensaje para el cliente si algo no es válido.
+    """
+    try:
+        raw_jobs = json.loads(trabajos)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"`trabajos` no es JSON válido: {e}")
+    if not isinstance(raw_jobs, list) or not raw_jobs:
+        raise ValueError("`trabajos` debe ser una lista JSON no vacía")
+    if len(raw_jobs) > BATCH_MAX_JOBS:
+        raise ValueError(f"Demasiados trabajos: {len(raw_jobs)} (máximo {BATCH_MAX_JOBS})")
+
+    jobs = []
+    for i, raw in enumerate(raw_jobs, start=1):
+        if not isinstance(raw, dict):
+            raise ValueError(f"Trabajo {i}: debe ser un objeto JSON")
+        tipo = str(raw.get('tipo', '')).replace('-', '_')
+        if tipo not in JOB_TYPES:
+            raise ValueError(f"Trabajo {i}: tipo {raw.get('tipo')!r} no válido (usar 'ficha' u 'hoja_preguntas')")
+        imagen = raw.get('imagen')
+        if imagen not in image_names:
+            raise ValueError(f"Trabajo {i}: la imagen {imagen!r} no está entre los archivos subidos")
+
+        try:
+            if tipo == 'ficha':
+                titulo = str(raw.get('titulo', ''))
+                params = (str(raw['texto_cuento']), titulo, int(raw.get('header_height', 1150)),
+                          str(raw.get('estilo', 'infantil')))
+            else:
+                preguntas = raw['preguntas']
+                if not isinstance(preguntas, str):
+                    preguntas = json.dumps(preguntas, ensure_ascii=False)
+                titulo = str(raw.get('titulo_cuento', ''))
+                params = (preguntas, titulo, str(raw.get('estilo', 'infantil')))
+        except KeyError as e:
+            raise ValueError(f"Trabajo {i}: falta el campo {e.args[0]!r}")
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Trabajo {i}: {e}")
+
+        jobs.append(BatchJob(i, tipo, imagen, params, titulo))
+    return jobs
+
+
+class _ChunkSink(io.RawIOBase):
+    """Destino no posicionable para ZipFile: acumula lo escrito hasta que se vacía"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_zip(entries):
+    """
+    ZIP en streaming: cada entrada (nombre, bytes, media_type) se envía en cuanto llega.
+    Sin compresión (ZIP_STORED): PNG, JPEG y WebP ya están comprimidos.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        async for name, data, _ in entries:
+            archive.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+async def stream_multipart(entries, boundary: str):
+    """multipart/mixed en streaming: una parte por entrada (nombre, bytes, media_type)."""
+    async for name, data, media_type in entries:
+        head = (f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Disposition: attachment; filename=\"{name}\"\r\n"
+                f"Content-Length: {len(data)}\r\n\r\n")
+        yield head.encode('utf-8') + data + b"\r\n"
+    yield f"--{boundary}--\r\n".encode('utf-8')
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark del wrapper: original (textbbox del prefijo completo en cada palabra) frente
+al incremental (anchos por palabra cacheados), con un cuento de 5.000 caracteres.
+
+    python benchmarks/bench_wrap.py
+"""
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+
+from PIL import Image, ImageDraw
+
+from fonts import SANS, SANS_BOLD, SANS_BOLD_ITALIC, SANS_ITALIC, get_font
+from layout import tokenize_markdown, wrap_text_with_markdown
+from legacy_markdown import wrap_text_with_markdown as legacy_wrap
+from text_metrics import text_bbox, token_width
+
+PARAGRAPH = ("Había una vez un **zorro** muy curioso que vivía en el bosque, junto a un río de aguas "
+             "claras. Cada noche miraba la *Luna* y se preguntaba qué habría allá arriba, más allá de "
+             "las nubes y de las estrellas que brillaban sobre los árboles.")
+STORY = '\n\n'.join([PARAGRAPH] * (5000 // len(PARAGRAPH) + 1))[:5000]
+REPEAT = 20
+
+
+def timed(fn, repeat=REPEAT, clear=None) -> float:
+    """Mediana en ms de `repeat` ejecuciones; `clear` vacía las cachés antes de cada una (en frío)"""
+    samples = []
+    for _ in range(repeat):
+        if clear:
+            clear()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def clear_caches():
+    for cache in (token_width, text_bbox, tokenize_markdown):
+        cache.cache_clear()
+
+
+def main():
+    fonts = {'normal': get_font(SANS, 52), 'bold': get_font(SANS_BOLD, 52),
+             'italic': get_font(SANS_ITALIC, 52), 'bold_italic': get_font(SANS_BOLD_ITALIC, 52)}
+    draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    max_width_px = 2480 - 160 - 160
+
+    legacy = timed(lambda: legacy_wrap(STORY, fonts, max_width_px, draw))
+    cold = timed(lambda: wrap_text_with_markdown(STORY, fonts, max_width_px), clear=clear_caches)
+    warm = timed(lambda: wrap_text_with_markdown(STORY, fonts, max_width_px))
+    lines = len(wrap_text_with_markdown(STORY, fonts, max_width_px))
+
+    print(f"Cuento de {len(STORY)} caracteres, {lines} líneas a {max_width_px}px (mediana de {REPEAT})")
+    print(f"  original (textbbox por prefijo): {legacy:8.2f} ms")
+    print(f"  incremental, cachés en frío:     {cold:8.2f} ms  ({legacy / cold:.0f}x)")
+    print(f"  incremental, cachés calientes:   {warm:8.2f} ms  ({legacy / warm:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+from functools import lru_cache
+import bisect
+import struct
+
+# Tablas que necesita un TrueType incrustado (PDF FontFile2 o @font-face en SVG); el resto se descarta
+SUBSET_TABLES = (b'cmap', b'cvt ', b'fpgm', b'glyf', b'head', b'hhea', b'hmtx', b'loca', b'maxp', b'prep', b'OS/2')
+# Los navegadores rechazan un @font-face sin 'name' y 'post' (post va sin nombres de glifo, formato 3)
+WEB_FONT_TABLES = SUBSET_TABLES + (b'name', b'post')
+
+
+def _u16(data, offset):
+    return struct.unpack_from('>H', data, offset)[0]
+
+
+def _i16(data, offset):
+    return struct.unpack_from('>h', data, offset)[0]
+
+
+def _checksum(data: bytes) -> int:
+    data += b'\0' * (-len(data) % 4)
+    return sum(struct.unpack(f'>{len(data) // 4}I', data)) & 0xFFFFFFFF
+
+
+class TrueTypeFont:
+    """
+    TTF leído una sola vez por proceso: cmap, anchos y métricas para incrustarlo en PDF o SVG.
+    `subset` conserva los IDs de glifo y vacía los que no se usan, así que hmtx sigue
+    siendo válido sin renumerar; el tamaño baja de ~700 KB a unas decenas de KB.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.tables = {}
+        for i in range(_u16(self.data, 4)):
+            tag, _, offset, length = struct.unpack_from('>4sIII', self.data, 12 + 16 * i)
+            self.tables[tag] = (offset, length)
+
+        head = self.table(b'head')
+        self.units_per_em = _u16(head, 18)
+        self.bbox = [_i16(head, 36 + 2 * i) * 1000 // self.units_per_em for i in range(4)]
+        self.long_loca = _i16(head, 50) == 1
+        self.num_glyphs = _u16(self.table(b'maxp'), 4)
+        hhea = self.table(b'hhea')
+        self.ascent = _i16(hhea, 4) * 1000 // self.units_per_em
+        self.descent = _i16(hhea, 6) * 1000 // self.units_per_em
+        os2 = self.table(b'OS/2')
+        self.cap_height = _i16(os2, 88) * 1000 // self.units_per_em if _u16(os2, 0) >= 2 else self.ascent
+        self._load_cmap()
+
+        hmtx = self.table(b'hmtx')
+        num_metrics = _u16(hhea, 34)
+        self.advances = [_u16(hmtx, 4 * min(gid, num_metrics - 1)) for gid in range(self.num_glyphs)]
+
+    def table(self, tag: bytes) -> bytes:
+        offset, length = self.tables[tag]
+        return self.data[offset:offset + length]
+
+    def _load_cmap(self):
+        """
+        Localiza la subtabla cmap: la de formato 12 (Unicode completo, incluidos emojis y
+        símbolos fuera del plano básico) si la hay, si no la de formato 4 (plano básico)
+        """
+        self._cmap = cmap = self.table(b'cmap')
+        self._seg_count = 0
+        self._groups = None
+        subtables = {}
+        for i in range(_u16(cmap, 2)):
+            platform, encoding, offset = struct.unpack_from('>HHI', cmap, 4 + 8 * i)
+            subtables[(platform, encoding, _u16(cmap, offset))] = offset
+        offset = subtables.get((3, 10, 12), subtables.get((0, 4, 12)))
+        if offset is not None:
+            count = struct.unpack_from('>I', cmap, offset + 12)[0]
+            self._groups = [struct.unpack_from('>III', cmap, offset + 16 + 12 * i) for i in range(count)]
+            self._end_codes = [end for _, end, _ in self._groups]
+            return
+        offset = subtables.get((3, 1, 4), subtables.get((0, 3, 4)))
+        if offset is not None:
+            self._seg_count = seg_count = _u16(cmap, offset + 6) // 2
+            self._ends = offset + 14
+            self._starts = self._ends + 2 * seg_count + 2
+            self._deltas = self._starts + 2 * seg_count
+            self._range_offsets = self._deltas + 2 * seg_count
+            self._end_codes = [_u16(cmap, self._ends + 2 * seg) for seg in range(seg_count)]
+
+    def glyph_id(self, code: int) -> int:
+        """Glifo de un código Unicode (0 = .notdef si la fuente no lo tiene)"""
+        if self._groups is not None:
+            group = bisect.bisect_left(self._end_codes, code)
+            if group >= len(self._groups) or self._groups[group][0] > code:
+                return 0
+            start, _, start_gid = self._groups[group]
+            return start_gid + code - start
+        seg = bisect.bisect_left(self._end_codes, code) if self._seg_count else 0
+        if seg >= self._seg_count:
+            return 0
+        cmap = self._cmap
+        start = _u16(cmap, self._starts + 2 * seg)
+        if start > code:
+            return 0
+        delta = _u16(cmap, self._deltas + 2 * seg)
+        range_offset = _u16(cmap, self._range_offsets + 2 * seg)
+        if range_offset == 0:
+            return (code + delta) & 0xFFFF
+        gid = _u16(cmap, self._range_offsets + 2 * seg + range_offset + 2 * (code - start))
+        return (gid + delta) & 0xFFFF if gid else 0
+
+    def glyph_range(self, loca: bytes, gid: int):
+        if self.long_loca:
+            return struct.unpack_from('>II', loca, 4 * gid)
+        start, end = struct.unpack_from('>HH', loca, 2 * gid)
+        return start * 2, end * 2
+
+    def width(self, gid: int) -> int:
+        """Avance de un glifo en milésimas de em (las unidades de /W en el PDF)"""
+        return self.advances[gid] * 1000 // self.units_per_em
+
+    def subset(self, chars, tables=SUBSET_TABLES) -> bytes:
+        """TTF con solo los glifos de `chars` (y los componentes de los glifos compuestos)"""
+        glyf, loca = self.table(b'glyf'), self.table(b'loca')
+        pending = [0] + [self.glyph_id(ord(c)) for c in chars]
+        keep = set()
+        while pending:
+            gid = pending.pop()
+            if gid in keep:
+                continue
+            keep.add(gid)
+            start, end = self.glyph_range(loca, gid)
+            if end > start and _i16(glyf, start) < 0:
+                # Glifo compuesto: incluir sus componentes
+                pos = start + 10
+                while True:
+                    flags, component = struct.unpack_from('>HH', glyf, pos)
+                    pending.append(component)
+                    pos += 4 + (4 if flags & 0x0001 else 2)
+                    pos += 2 if flags & 0x0008 else 4 if flags & 0x0040 else 8 if flags & 0x0080 else 0
+                    if not flags & 0x0020:
+                        break
+
+        new_glyf, offsets = bytearray(), []
+        for gid in range(self.num_glyphs):
+            offsets.append(len(new_glyf))
+            if gid in keep:
+                start, end = self.glyph_range(loca, gid)
+                new_glyf += glyf[start:end]
+                new_glyf += b'\0' * (-len(new_glyf) % 4)
+        offsets.append(len(new_glyf))
+
+        head = bytearray(self.table(b'head'))
+        struct.pack_into('>I', head, 8, 0)  # checkSumAdjustment
+        struct.pack_into('>h', head, 50, 1)  # loca en formato largo
+        tables = {tag: self.table(tag) for tag in tables if tag in self.tables}
+        tables.update({b'glyf': bytes(new_glyf), b'loca': struct.pack(f'>{len(offsets)}I', *offsets), b'head': bytes(head)})
+        if b'post' in tables:
+            tables[b'post'] = struct.pack('>I', 0x00030000) + tables[b'post'][4:32]
+        return _build_sfnt(tables)
+
+
+def _build_sfnt(tables: dict) -> bytes:
+    count = len(tables)
+    entry_selector = count.bit_length() - 1
+    search_range = 16 * (1 << entry_selector)
+    header = struct.pack('>IHHHH', 0x00010000, count, search_range, entry_selector, count * 16 - search_range)
+    directory, body = bytearray(), bytearray()
+    offset = 12 + 16 * count
+    for tag in sorted(tables):
+        data = tables[tag]
+        directory += struct.pack('>4sIII', tag, _checksum(data), offset + len(body), len(data))
+        body += data + b'\0' * (-len(data) % 4)
+    return header + bytes(directory) + bytes(body)
+
+
+@lru_cache(maxsize=16)
+def truetype_font(path: str) -> TrueTypeFont:
+    return TrueTypeFont(path)
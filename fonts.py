@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from PIL import ImageFont
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+FONT_DIR = "/usr/share/fonts/truetype/dejavu"
+SANS = f"{FONT_DIR}/DejaVuSans.ttf"
+SANS_BOLD = f"{FONT_DIR}/DejaVuSans-Bold.ttf"
+SERIF_BOLD = f"{FONT_DIR}/DejaVuSerif-Bold.ttf"
+
+
+def _font_file(name: str, fallback: str) -> str:
+    """Ruta de una variante de DejaVu; si su paquete no está instalado se usa `fallback`"""
+    path = f"{FONT_DIR}/{name}"
+    return path if os.path.exists(path) else fallback
+
+
+# Cursivas para *texto* y ***texto*** (paquete fonts-dejavu-extra)
+SANS_ITALIC = _font_file("DejaVuSans-Oblique.ttf", SANS)
+SANS_BOLD_ITALIC = _font_file("DejaVuSans-BoldOblique.ttf", SANS_BOLD)
+
+# Máximo de fuentes (ruta, tamaño) residentes; las menos usadas se descartan
+FONT_CACHE_SIZE = int(os.environ.get("FONT_CACHE_SIZE", 64))
+
+# Tamaño de la letra capital: 3 líneas de texto + 0.3 de holgura (line_spacing = 80)
+DROP_CAP_SIZE = int(80 * (3 + 0.3))
+
+# Todas las fuentes que usan los dos layouts, para precargarlas al arrancar
+LAYOUT_FONTS = [
+    # crear_ficha
+    (SANS, 52), (SANS_BOLD, 52), (SANS_ITALIC, 52), (SANS_BOLD_ITALIC, 52), (SERIF_BOLD, 100),
+    (SERIF_BOLD, DROP_CAP_SIZE),
+    # crear_hoja_preguntas
+    (SANS_BOLD, 85), (SANS_BOLD, 70), (SANS, 50), (SANS_BOLD, 58), (SANS, 48),
+]
+
+
+class FontRegistry:
+    """
+    Caché LRU de fuentes por (ruta, tamaño), compartida por todo el proceso.
+    Cada TTF se parsea una sola vez; si no se puede cargar se usa ImageFont.load_default()
+    y ese fallback también queda cacheado para no volver a tocar el disco.
+    """
+
+    def __init__(self, maxsize=FONT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._fonts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, size: int):
+        key = (path, int(size))
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+
+            self.misses += 1
+            try:
+                font = ImageFont.truetype(path, key[1])
+            except Exception as e:
+                logger.error(f"❌ Error fuente {path} ({key[1]}px): {e}. Usando default.")
+                font = ImageFont.load_default()
+
+            self._fonts[key] = font
+            if len(self._fonts) > self.maxsize:
+                self._fonts.popitem(last=False)
+            return font
+
+    def warm(self, specs):
+        for path, size in specs:
+            self.get(path, size)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._fonts), "maxsize": self.maxsize}
+
+
+font_registry = FontRegistry()
+
+
+def get_font(path: str, size: int):
+    return font_registry.get(path, size)
+
+
+def warm_up():
+    """Precarga las fuentes de ambos layouts (se llama al arrancar y en cada worker del pool)."""
+    font_registry.warm(LAYOUT_FONTS)
+    logger.info(f"✅ Fuentes precargadas: {font_registry.stats()}")
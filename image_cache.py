@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import os
+import threading
+
+# CONFIGURACIÓN (variables de entorno)
+# DERIVED_IMAGES_MB: memoria para las imágenes ya redimensionadas a su slot (fondo A4 estirado, cabecera recortada)
+# BASE_PAGES_MB: memoria para las bases de página ya dibujadas (la parte fija de la hoja de preguntas)
+DERIVED_IMAGES_MB = int(os.environ.get("DERIVED_IMAGES_MB", 256))
+BASE_PAGES_MB = int(os.environ.get("BASE_PAGES_MB", 128))
+
+# Clave de `info` con el hash de los bytes subidos (la pone load_image al decodificar)
+CONTENT_HASH = 'content_hash'
+
+
+def image_bytes(img) -> int:
+    """Memoria que ocupa una imagen decodificada"""
+    return img.width * img.height * len(img.getbands())
+
+
+class ImageCache:
+    """
+    Imágenes ya decodificadas (PIL) en memoria, LRU acotada en bytes. Las imágenes se
+    comparten entre renders: quien las use como lienzo debe copiarlas antes de pintar.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            img = self._images.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return img
+
+    def put(self, key, img):
+        size = image_bytes(img)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            if key in self._images:
+                self._size -= image_bytes(self._images[key])
+            self._images[key] = img
+            self._images.move_to_end(key)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._size -= image_bytes(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._images),
+                "memory_mb": round(self._size / 1e6, 1),
+            }
+
+
+# Resultado de fit_image por (hash de la subida, modo y tamaño decodificados, tamaño final, ajuste):
+# el mismo borde o la misma cabecera no se vuelven a remuestrear con LANCZOS
+derived_images = ImageCache(DERIVED_IMAGES_MB * 1024 * 1024)
+# Página sin la parte variable por (fondo, tamaño y elementos fijos): las variantes de preguntas
+# de un mismo cuento solo dibujan sus preguntas sobre una copia
+base_pages = ImageCache(BASE_PAGES_MB * 1024 * 1024)
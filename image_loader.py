@@ -0,0 +1,92 @@
+from PIL import Image
+import hashlib
+import io
+import logging
+import math
+import os
+import warnings
+
+from image_cache import CONTENT_HASH
+from layout import ImageSlot
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Límite de píxeles de una imagen subida (protección contra decompression bombs)
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 50_000_000))
+# La reducción rápida (draft / reduce) se detiene a este factor por encima del tamaño final
+IMAGE_REDUCING_GAP = float(os.environ.get("IMAGE_REDUCING_GAP", 1.5))
+
+# Pillow solo avisa al pasar su límite y falla al doble; se alinea con el nuestro
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def scaled_size(img_size, slot: ImageSlot):
+    """Tamaño al que fit_image redimensionará una imagen de `img_size` para el slot."""
+    x0, y0, x1, y1 = slot.box
+    width, height = x1 - x0, y1 - y0
+    if slot.fit != 'cover':
+        return width, height
+    scale = max(width / img_size[0], height / img_size[1])
+    return math.ceil(img_size[0] * scale), math.ceil(img_size[1] * scale)
+
+
+def open_image(img_bytes: bytes):
+    """Abre una imagen leyendo solo la cabecera; ImageTooLarge si supera MAX_IMAGE_PIXELS."""
+    try:
+        with warnings.catch_warnings():
+            # El aviso de Pillow se sustituye por nuestro propio error
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            img = Image.open(io.BytesIO(img_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(f"Imagen demasiado grande (máximo {MAX_IMAGE_PIXELS:,} píxeles)") from e
+
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f"Imagen demasiado grande: {width}x{height} px (máximo {MAX_IMAGE_PIXELS:,} píxeles)")
+    return img
+
+
+def inspect_image(img_bytes: bytes) -> dict:
+    """Formato, tamaño y modo de una imagen subida, sin decodificarla (valida que sea una imagen)"""
+    img = open_image(img_bytes)
+    return {"formato": img.format, "ancho": img.width, "alto": img.height, "modo": img.mode}
+
+
+@stage('decode')
+def load_image(img_bytes: bytes, slot: ImageSlot, mode: str = None):
+    """
+    Abre una imagen subida ya reducida cerca del tamaño que ocupará en el slot.
+
+    Solo se lee la cabecera para comprobar el límite de píxeles, antes de decodificar nada.
+    En JPEG se usa el modo draft (el decodificador escala 1/2, 1/4 o 1/8 por DCT) y en el
+    resto reduce() (promedio por bloques); ambos se quedan a IMAGE_REDUCING_GAP veces por
+    encima del tamaño final, que sigue haciendo el LANCZOS de fit_image.
+    """
+    img = open_image(img_bytes)
+    width, height = img.size
+    target = scaled_size(img.size, slot)
+    needed = (math.ceil(target[0] * IMAGE_REDUCING_GAP), math.ceil(target[1] * IMAGE_REDUCING_GAP))
+
+    if img.format == 'JPEG':
+        img.draft(mode or img.mode, needed)
+
+    factor = min(img.width // needed[0], img.height // needed[1])
+    # reduce() no admite imágenes con paleta ni bitonales (resize ya usa NEAREST con ellas)
+    if factor >= 2 and img.mode not in ('1', 'P'):
+        img = img.reduce(factor)
+
+    if img.size != (width, height):
+        logger.info(f"🔻 Imagen {width}x{height} reducida al decodificar a {img.width}x{img.height} (destino {target[0]}x{target[1]})")
+
+    if mode and img.mode != mode:
+        img = img.convert(mode)
+    # Decodificada del todo: la misma imagen puede compartirse entre varios renders (lotes)
+    img.load()
+    # Hash de la subida: clave de la caché de imágenes redimensionadas de fit_image
+    img.info[CONTENT_HASH] = hashlib.sha256(img_bytes).hexdigest()
+    return img
@@ -0,0 +1,1130 @@
+from functools import lru_cache
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+import json
+import logging
+import math
+import os
+import re
+
+from fonts import SANS, SANS_BOLD, SANS_BOLD_ITALIC, SANS_ITALIC, SERIF_BOLD, get_font
+from metrics import stage
+from text_metrics import LineMeasure, advance_width, text_bbox
+
+logger = logging.getLogger(__name__)
+
+# Layouts recientes que se reutilizan tal cual (mismo texto, título, estilo y cabecera)
+LAYOUT_CACHE_SIZE = int(os.environ.get("LAYOUT_CACHE_SIZE", 128))
+# Párrafos ya tokenizados (markdown) que se reutilizan entre layouts y tamaños de letra
+MARKDOWN_CACHE_SIZE = int(os.environ.get("MARKDOWN_CACHE_SIZE", 1024))
+
+# Dimensiones A4 a 300 DPI
+DPI = 300
+A4_WIDTH = 2480
+A4_HEIGHT = 3508
+
+# Tamaño por defecto del texto de la ficha (cuento) y de la hoja (preguntas); `ajustar` solo lo reduce
+FICHA_TEXT_SIZE = 52
+HOJA_TEXT_SIZE = 50
+# Páginas máximas de una ficha u hoja paginada (`paginar`); lo que no quepa se trunca
+MAX_PAGES = int(os.environ.get("MAX_PAGES", 20))
+# Tamaño mínimo que prueba `ajustar` antes de rendirse y truncar
+FIT_MIN_TEXT_SIZE = int(os.environ.get("FIT_MIN_TEXT_SIZE", 28))
+
+# Resolución máxima pedida con `dpi`/`escala` (el canvas crece con el cuadrado)
+MAX_DPI = int(os.environ.get("MAX_DPI", 300))
+MIN_DPI = 10
+
+
+# ----------------------------------------------------------------------
+# DISPLAY LIST: primitivas posicionadas, sin píxeles
+# ----------------------------------------------------------------------
+
+class FontSpec(NamedTuple):
+    path: str
+    size: int
+
+
+class TextRun(NamedTuple):
+    """Texto de un solo estilo dibujado en (x, y) (esquina superior izquierda, como draw.text)"""
+    x: float
+    y: float
+    text: str
+    font: FontSpec
+    fill: str
+
+
+class OutlinedText(NamedTuple):
+    """Texto con contorno circular de `outline_width` px en `outline`"""
+    x: float
+    y: float
+    text: str
+    font: FontSpec
+    fill: str
+    outline: str
+    outline_width: int
+
+
+class Rect(NamedTuple):
+    """Rectángulo (x0, y0, x1, y1). Un fill RGBA con alpha < 255 se compone sobre lo anterior."""
+    box: tuple
+    fill: object
+
+
+class Ellipse(NamedTuple):
+    box: tuple
+    fill: str
+    outline: Optional[str] = None
+    width: int = 1
+
+
+class Line(NamedTuple):
+    points: tuple
+    fill: str
+    width: int = 1
+
+
+class ImageSlot(NamedTuple):
+    """Hueco para una imagen subida; `fit` es 'cover' (centrado y recortado) o 'stretch'"""
+    name: str
+    box: tuple
+    fit: str
+
+
+class Layer(NamedTuple):
+    """
+    Grupo de primitivas estáticas en coordenadas locales, colocado en (x, y).
+    Solo depende de sus items, así que el rasterizador lo cachea como capa RGBA.
+    """
+    x: int
+    y: int
+    size: tuple
+    items: tuple
+
+
+class Stamp(NamedTuple):
+    """
+    Grupo pequeño que se repite igual entre peticiones (círculo numerado, etiqueta, letra
+    capital), con sus items en coordenadas de la página. El rasterizador lo pega desde el
+    atlas de sprites con una sola operación; SVG y PDF dibujan sus items.
+    """
+    items: tuple
+
+
+class DisplayList(NamedTuple):
+    size: tuple
+    background: object  # color de fondo o ImageSlot que cubre la hoja
+    items: tuple
+    info: MappingProxyType  # métricas del layout (líneas, truncado...), solo lectura
+
+    def slot(self, name: str) -> ImageSlot:
+        """ImageSlot con ese nombre (fondo o elemento)"""
+        for item in (self.background, *self.items):
+            if isinstance(item, ImageSlot) and item.name == name:
+                return item
+        raise KeyError(name)
+
+
+class Token(NamedTuple):
+    """Palabra (o trozo de palabra de un mismo estilo) del texto markdown y el separador que la sigue"""
+    text: str
+    style: str  # 'normal', 'bold', 'italic' o 'bold_italic'
+    space: str = ''  # '' (sigue la misma palabra), ' ' o '\n' (salto de línea forzado)
+    space_style: str = 'normal'  # el espacio es del énfasis solo si está dentro de él
+
+
+class TextLine(NamedTuple):
+    """Línea ya partida: segmentos markdown y su avance medido una sola vez"""
+    text: str
+    kind: str  # 'text' o 'paragraph_break'
+    segments: tuple = ()
+    widths: tuple = ()
+
+
+def is_translucent(item) -> bool:
+    return isinstance(item, Rect) and isinstance(item.fill, tuple) and len(item.fill) == 4 and item.fill[3] < 255
+
+
+def resolve_escala(dpi: str, escala: str) -> float:
+    """
+    Factor de escala pedido con `dpi` (p. ej. 72) o `escala` (p. ej. 0.24) respecto a 300 DPI.
+    Lanza ValueError si el valor no es un número o queda fuera de MIN_DPI-MAX_DPI.
+    """
+    dpi, escala = (dpi or '').strip(), (escala or '').strip()
+    if dpi and escala:
+        raise ValueError("Indicar `dpi` o `escala`, no ambos")
+    try:
+        factor = float(dpi) / DPI if dpi else float(escala) if escala else 1.0
+    except ValueError:
+        raise ValueError(f"Valor no numérico: {dpi or escala!r}")
+    if not MIN_DPI <= factor * DPI <= MAX_DPI:
+        raise ValueError(f"Resolución fuera de rango: {factor * DPI:g} DPI ({MIN_DPI}-{MAX_DPI})")
+    return factor
+
+
+def fit_text_size(layout_fn, default_size: int, *args) -> int:
+    """
+    Mayor tamaño de texto (entre FIT_MIN_TEXT_SIZE y `default_size`) con el que `layout_fn(*args, tamaño)`
+    no trunca nada. Búsqueda binaria sobre layouts: solo se mide texto, nunca se rasteriza, y cada
+    prueba queda en la caché de layouts. Si ni el mínimo cabe, devuelve el mínimo (y se trunca).
+    """
+    if not layout_fn(*args, default_size).info['truncated']:
+        return default_size
+    low, high = FIT_MIN_TEXT_SIZE, default_size - 1
+    best = FIT_MIN_TEXT_SIZE
+    while low <= high:
+        size = (low + high) // 2
+        if layout_fn(*args, size).info['truncated']:
+            high = size - 1
+        else:
+            best = size
+            low = size + 1
+    return best
+
+
+def _scale_box(box, escala):
+    return tuple(round(v * escala) for v in box)
+
+
+def scale_item(item, escala: float):
+    """
+    Primitiva de la display list con coordenadas, tamaños de fuente y grosores multiplicados
+    por `escala`. Los huecos de imagen y las capas quedan en píxeles enteros.
+    """
+    def font(spec):
+        return FontSpec(spec.path, max(1, round(spec.size * escala)))
+
+    def width(w):
+        return max(1, round(w * escala))
+
+    if isinstance(item, TextRun):
+        return item._replace(x=item.x * escala, y=item.y * escala, font=font(item.font))
+    if isinstance(item, OutlinedText):
+        return item._replace(x=item.x * escala, y=item.y * escala, font=font(item.font),
+                             outline_width=width(item.outline_width))
+    if isinstance(item, Rect):
+        return item._replace(box=tuple(v * escala for v in item.box))
+    if isinstance(item, Ellipse):
+        return item._replace(box=tuple(v * escala for v in item.box), width=width(item.width))
+    if isinstance(item, Line):
+        return item._replace(points=tuple((x * escala, y * escala) for x, y in item.points), width=width(item.width))
+    if isinstance(item, ImageSlot):
+        return item._replace(box=_scale_box(item.box, escala))
+    if isinstance(item, Layer):
+        return Layer(round(item.x * escala), round(item.y * escala), (math.ceil(item.size[0] * escala), math.ceil(item.size[1] * escala)),
+                     tuple(scale_item(child, escala) for child in item.items))
+    if isinstance(item, Stamp):
+        return Stamp(tuple(scale_item(child, escala) for child in item.items))
+    return item
+
+
+def shift_item(item, dy: int):
+    """Primitiva de la display list desplazada `dy` píxeles en vertical (las capas solo mueven su origen)"""
+    if isinstance(item, (TextRun, OutlinedText, Layer)):
+        return item._replace(y=item.y + dy)
+    if isinstance(item, (Rect, Ellipse, ImageSlot)):
+        return item._replace(box=(item.box[0], item.box[1] + dy, item.box[2], item.box[3] + dy))
+    if isinstance(item, Line):
+        return item._replace(points=tuple((x, y + dy) for x, y in item.points))
+    if isinstance(item, Stamp):
+        return Stamp(tuple(shift_item(child, dy) for child in item.items))
+    return item
+
+
+def scale_display_list(display_list: DisplayList, escala: float) -> DisplayList:
+    """
+    La misma página a otra resolución (vista previa a 72 DPI, miniaturas...).
+    El layout se calcula siempre a 300 DPI y después se escala: los saltos de línea, el
+    truncado y las métricas de `info` son exactamente los de la versión de impresión.
+    """
+    if escala == 1:
+        return display_list
+    width, height = display_list.size
+    background = display_list.background
+    if isinstance(background, ImageSlot):
+        background = scale_item(background, escala)
+    line = [None, 0]  # y de la última línea de texto y dónde termina, ya escalado
+
+    def scaled_run(item):
+        scaled = scale_item(item, escala)
+        # A tamaños pequeños el hinting redondea los avances hacia arriba: un segmento no
+        # empieza antes de que termine el anterior de la misma línea
+        if item.y == line[0] and scaled.x < line[1]:
+            scaled = scaled._replace(x=line[1])
+        line[0] = item.y
+        line[1] = scaled.x + advance_width(get_font(*scaled.font), scaled.text)
+        return scaled
+
+    items = []
+    for item in display_list.items:
+        if isinstance(item, TextRun):
+            scaled = scaled_run(item)
+        elif isinstance(item, Stamp):
+            scaled = Stamp(tuple(scaled_run(child) if isinstance(child, TextRun) else scale_item(child, escala)
+                                 for child in item.items))
+        else:
+            scaled = scale_item(item, escala)
+        items.append(scaled)
+    return DisplayList((round(width * escala), round(height * escala)), background, tuple(items), display_list.info)
+
+
+# ----------------------------------------------------------------------
+# TEXTO
+# ----------------------------------------------------------------------
+
+def to_title_case(text: str) -> str:
+    """
+    Convierte un string a Title Case (Capitalización de Título), donde la
+    primera letra de cada palabra importante se pone en mayúscula.
+    Se mantienen en minúscula artículos, preposiciones cortas y conjunciones.
+    """
+    if not text:
+        return ""
+
+    # Palabras funcionales cortas que deben estar en minúscula (en español)
+    minor_words = [
+        'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas', # Artículos
+        'de', 'a', 'en', 'por', 'con', 'sin', 'sobre', 'tras', # Preposiciones
+        'y', 'o', 'ni', 'pero', 'mas', 'que' # Conjunciones y relativos
+    ]
+
+    words = text.lower().split()
+    title_cased_words = []
+
+    for i, word in enumerate(words):
+        # La primera palabra siempre va capitalizada
+        if i == 0 or i == len(words) - 1:
+            title_cased_words.append(word.capitalize())
+        # Las palabras que no son "menores" se capitalizan
+        elif word not in minor_words:
+            title_cased_words.append(word.capitalize())
+        # Las palabras "menores" (artículos, preposiciones, etc.) se dejan en minúscula
+        else:
+            title_cased_words.append(word)
+
+    return " ".join(title_cased_words)
+
+
+# Énfasis markdown: ***negrita cursiva***, **negrita** o *cursiva* (sin asteriscos dentro).
+# Se busca en el párrafo entero, así que un énfasis puede cruzar saltos de línea
+MARKDOWN_SPAN = re.compile(r'(\*{3}|\*{2}|\*)([^*]+)\1')
+MARKDOWN_STYLES = {'***': 'bold_italic', '**': 'bold', '*': 'italic'}
+WHITESPACE = re.compile(r'(\s+)')
+
+
+@lru_cache(maxsize=MARKDOWN_CACHE_SIZE)
+def tokenize_markdown(paragraph: str) -> tuple:
+    """
+    Parsea un párrafo una sola vez en Tokens (palabra, estilo, separador).
+    El wrapper mide y parte sobre estos tokens y place_line dibuja los segmentos que salen
+    de ellos: el regex no se vuelve a aplicar por cada prefijo ni por cada línea.
+    Los asteriscos sin pareja quedan como texto.
+    """
+    chunks = []
+    last_end = 0
+    for match in MARKDOWN_SPAN.finditer(paragraph):
+        if match.start() > last_end:
+            chunks.append((paragraph[last_end:match.start()], 'normal'))
+        chunks.append((match.group(2), MARKDOWN_STYLES[match.group(1)]))
+        last_end = match.end()
+    chunks.append((paragraph[last_end:], 'normal'))
+
+    tokens = []
+    for chunk, style in chunks:
+        for piece in WHITESPACE.split(chunk):
+            if not piece:
+                continue
+            if not piece.isspace():
+                tokens.append(Token(piece, style))
+            elif tokens:
+                # Los espacios seguidos se reducen a uno; un salto de línea se conserva
+                last = tokens[-1]
+                space = '\n' if '\n' in piece or last.space == '\n' else ' '
+                tokens[-1] = last._replace(space=space, space_style=style if not last.space else last.space_style)
+    if tokens:
+        tokens[-1] = tokens[-1]._replace(space='')
+    return tuple(tokens)
+
+
+def _append_segment(segments: list, text: str, style: str):
+    """Añade texto al último segmento si es del mismo estilo, o abre uno nuevo"""
+    if segments and segments[-1][1] == style:
+        segments[-1] = (segments[-1][0] + text, style)
+    else:
+        segments.append((text, style))
+
+
+def line_segments(tokens) -> tuple:
+    """Segmentos (texto, estilo) de una línea de tokens: lo consecutivo del mismo estilo va junto"""
+    segments = []
+    for i, token in enumerate(tokens):
+        if i:
+            _append_segment(segments, ' ' if tokens[i - 1].space else '', tokens[i - 1].space_style)
+        _append_segment(segments, token.text, token.style)
+    return tuple(segment for segment in segments if segment[0])
+
+
+def measured_line(tokens, fonts):
+    """Línea final: sus segmentos y el avance de cada uno (tokens cacheados)"""
+    segments = line_segments(tokens)
+    widths = tuple(advance_width(fonts.get(style, fonts['normal']), seg_text) for seg_text, style in segments)
+    return TextLine(''.join(seg_text for seg_text, _ in segments), 'text', segments, widths)
+
+
+def wrap_text_with_markdown(text, fonts, max_width_px):
+    """Divide texto respetando markdown Y PÁRRAFOS. Devuelve TextLine ya medidas."""
+
+    text_normalized = re.sub(r'\n{3,}', '\n\n', text)
+    paragraphs = text_normalized.split('\n\n')
+
+    all_lines = []
+
+    for para_idx, para in enumerate(paragraphs):
+        tokens = tokenize_markdown(para)
+        if not tokens:
+            continue
+
+        line_tokens = []
+        word_start = 0
+        # Mide cada palabra una sola vez y acumula anchos (ver text_metrics.LineMeasure)
+        measure = LineMeasure(fonts, max_width_px)
+
+        for i, token in enumerate(tokens):
+            # Una palabra puede tener varios tokens si cambia de estilo (p. ej. "**Luna**,")
+            if not token.space and i < len(tokens) - 1:
+                continue
+            word = tokens[word_start:i + 1]
+            word_start = i + 1
+
+            pieces = [(part.text, part.style) for part in word]
+            separator = [(' ', line_tokens[-1].space_style)] if line_tokens else []
+
+            if measure.fits(separator + pieces, lambda: line_segments(line_tokens + list(word))):
+                line_tokens += word
+            else:
+                # No cabe: la palabra empieza línea (aunque ella sola no quepa)
+                if line_tokens:
+                    all_lines.append(measured_line(line_tokens, fonts))
+                measure.reset(pieces)
+                line_tokens = list(word)
+
+            # Salto de línea dentro del párrafo: la línea termina aquí aunque quepa más
+            if token.space == '\n':
+                all_lines.append(measured_line(line_tokens, fonts))
+                line_tokens = []
+                measure.reset()
+
+        if line_tokens:
+            all_lines.append(measured_line(line_tokens, fonts))
+
+        # AGREGAR LÍNEA VACÍA ENTRE PÁRRAFOS (excepto después del último)
+        if para_idx < len(paragraphs) - 1:
+            all_lines.append(TextLine('', 'paragraph_break'))
+
+    return all_lines
+
+
+def place_line(x, y, line, specs, color, max_width_px=None):
+    """
+    Posiciona los segmentos de una línea y la JUSTIFICA si max_width_px es proporcionado.
+    Usa los avances ya medidos por el wrapper: no vuelve a medir texto.
+    """
+    runs = []
+    current_x = x
+
+    # Lógica de JUSTIFICACIÓN
+    extra_space_per_gap = 0
+
+    if max_width_px:
+        # 1. Ancho total del texto y número de espacios
+        total_text_width_with_default_spaces = 0
+        num_spaces = 0
+        for (seg_text, _), width in zip(line.segments, line.widths):
+            total_text_width_with_default_spaces += width
+            num_spaces += seg_text.count(' ')
+
+        # Aplicar justificación si el texto es significativo y necesita rellenar el ancho
+        # (El texto no debe ser demasiado corto para justificar)
+        if num_spaces > 0 and (total_text_width_with_default_spaces / max_width_px > 0.7):
+            remaining_width = max_width_px - total_text_width_with_default_spaces
+            # El espacio extra se divide entre el número de gaps (los espacios)
+            extra_space_per_gap = remaining_width / num_spaces
+
+    # 2. Posicionar y distribuir el espacio extra
+    for (text, style), width in zip(line.segments, line.widths):
+        if text.strip():
+            runs.append(TextRun(current_x, y, text, specs.get(style, specs['normal']), color))
+
+        current_x += width
+
+        if extra_space_per_gap > 0:
+            current_x += text.count(' ') * extra_space_per_gap
+
+    return runs
+
+
+def resolve_fonts(specs):
+    return {style: get_font(*spec) for style, spec in specs.items()}
+
+
+# ----------------------------------------------------------------------
+# DECORACIONES
+# ----------------------------------------------------------------------
+
+@lru_cache(maxsize=8)
+def wavy_border(a4_width, a4_height):
+    """Borde ondulado infantil: dos franjas (superior e inferior) de semicírculos decorativos"""
+    colors = ['#FF6B9D', '#FFA07A', '#FFD93D', '#6BCF7F', '#4ECDC4', '#95E1D3']
+    margin = 60
+    wave_width = 40
+    # Cada franja cubre la onda completa (±wave_width) más el radio de los puntos
+    strip_height = 2 * (wave_width + 6) + 1
+    top_y = margin - wave_width - 6
+    bottom_y = a4_height - margin - wave_width - 6
+    top, bottom = [], []
+
+    for x in range(margin, a4_width - margin, 10):
+        wave_y_top = margin + wave_width * math.sin(x * 0.05) - top_y
+        top.append(Ellipse((x, wave_y_top - 5, x + 10, wave_y_top + 5), fill=colors[x % len(colors)]))
+
+    for x in range(margin, a4_width - margin, 10):
+        wave_y_bottom = a4_height - margin - wave_width * math.sin(x * 0.05) - bottom_y
+        bottom.append(Ellipse((x, wave_y_bottom - 5, x + 10, wave_y_bottom + 5), fill=colors[x % len(colors)]))
+
+    return (Layer(0, top_y, (a4_width, strip_height), tuple(top)),
+            Layer(0, bottom_y, (a4_width, strip_height), tuple(bottom)))
+
+
+def rainbow_separator(x, y, width, height=6):
+    """Separador de 4 colores"""
+    colors = ['#FF6B9D', '#FFD93D', '#6BCF7F', '#4ECDC4']
+    segment_width = width // len(colors)
+    rects = tuple(Rect((i * segment_width, 0, (i + 1) * segment_width, height), fill=color) for i, color in enumerate(colors))
+    return Layer(x, y, (segment_width * len(colors) + 1, height + 1), rects)
+
+
+def dotted_line(start_x, end_x, y, color, dot_spacing=20, dot_radius=3):
+    """Línea de puntos para respuestas; en coordenadas locales solo depende de su largo y color"""
+    dots = tuple(Ellipse((x - start_x, 0, x - start_x + 2 * dot_radius, 2 * dot_radius), fill=color)
+                 for x in range(start_x, end_x, dot_spacing))
+    return Layer(start_x - dot_radius, y - dot_radius, (end_x - start_x + 2 * dot_radius + 1, 2 * dot_radius + 1), dots)
+
+
+# ----------------------------------------------------------------------
+# FICHA DE LECTURA
+# ----------------------------------------------------------------------
+
+def header_slot(header_height: int) -> ImageSlot:
+    """Zona de la imagen de cabecera de la ficha (ancho completo, cover centrado)"""
+    return ImageSlot('header', (0, 0, A4_WIDTH, header_height), 'cover')
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def layout_ficha(titulo: str, texto_cuento: str, estilo: str, header_height: int,
+                 text_size: int = FICHA_TEXT_SIZE) -> DisplayList:
+    """Ficha de lectura en una sola página: lo que no cabe se trunca (ver `info`)."""
+    return _layout_ficha(titulo, texto_cuento, estilo, header_height, text_size, paginate=False)[0]
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def layout_ficha_pages(titulo: str, texto_cuento: str, estilo: str, header_height: int,
+                       text_size: int = FICHA_TEXT_SIZE) -> tuple:
+    """Ficha de lectura paginada: el cuento continúa en páginas siguientes, sin cabecera."""
+    return _layout_ficha(titulo, texto_cuento, estilo, header_height, text_size, paginate=True)
+
+
+@stage('text_layout')
+def _layout_ficha(titulo: str, texto_cuento: str, estilo: str, header_height: int, text_size: int,
+                  paginate: bool) -> tuple:
+    """
+    Calcula la ficha de lectura completa como display lists (cabecera, título, letra capital y cuento).
+    `text_size` es el tamaño del cuento; interlineado y letra capital se escalan con él.
+    Con `paginate`, al llegar a max_height el texto sigue en una página nueva con los mismos
+    márgenes y decoración (hasta MAX_PAGES); sin él, se trunca y solo hay una página.
+    """
+    a4_width = A4_WIDTH
+    a4_height = A4_HEIGHT
+    items = [header_slot(header_height)]
+    pages = [items]
+
+    def sized(value):
+        return round(value * text_size / FICHA_TEXT_SIZE)
+
+    # FUENTES
+    specs = {
+        'normal': FontSpec(SANS, text_size),
+        'bold': FontSpec(SANS_BOLD, text_size),
+        'italic': FontSpec(SANS_ITALIC, text_size),
+        'bold_italic': FontSpec(SANS_BOLD_ITALIC, text_size)
+    }
+    fonts = resolve_fonts(specs)
+    # Título del Cuento: **DejaVuSerif-Bold es la alternativa manuscrita disponible**
+    titulo_spec = FontSpec(SERIF_BOLD, 100)
+
+    # LAYOUT
+    margin_left = 160
+    margin_right = 160
+    line_spacing = sized(80)
+    paragraph_spacing = sized(40)
+    max_width_px = a4_width - margin_left - margin_right
+    max_height = 3380
+    # Páginas de continuación: sin cabecera, el texto empieza bajo el borde ondulado
+    continuation_top = 200
+
+    y_text = header_height + 245  # Bajado 2 líneas más para dar equilibrio con el título
+
+    # TÍTULO (En el borde inferior de la imagen: 50% sobre imagen, 50% sobre texto)
+    if titulo:
+        # APLICAR CAPITALIZACIÓN DE TÍTULO
+        titulo_capitalizado = to_title_case(titulo)
+        logger.info(f"Título original: '{titulo}' -> Capitalizado: '{titulo_capitalizado}'")
+
+        # Calcular tamaño del bounding box del título con la nueva fuente
+        bbox_title = text_bbox(get_font(*titulo_spec), titulo_capitalizado)
+        title_width = bbox_title[2] - bbox_title[0]
+        title_height = bbox_title[3] - bbox_title[1]
+
+        # AJUSTE DE MARGEN
+        padding_x = 40
+        padding_y = 30
+
+        # Altura total del rectángulo del título
+        rect_height = title_height + 2 * padding_y
+
+        # CENTRAR HORIZONTALMENTE
+        title_x_bg = (a4_width - title_width - 2 * padding_x) // 2
+
+        # POSICIONAR VERTICALMENTE: Exactamente en el borde inferior de la imagen
+        # 50% del rectángulo sobre la imagen, 50% sobre el fondo blanco
+        title_y_bg = header_height - rect_height // 2
+
+        # Coordenadas donde empieza el texto (centrado dentro del padding)
+        title_offset_x = title_x_bg + padding_x
+        title_offset_y = title_y_bg + padding_y
+
+        logger.info(f"📍 Título posicionado: Y={title_y_bg} (borde imagen: {header_height}, altura rect: {rect_height})")
+
+        # Rectángulo BLANCO semitransparente (180 de opacidad)
+        items.append(Rect((title_x_bg, title_y_bg, title_x_bg + title_width + 2 * padding_x, title_y_bg + rect_height),
+                          fill=(255, 255, 255, 180)))
+
+        # EFECTO INFANTIL AL TÍTULO DEL CUENTO (ROSA FUERTE/PÚRPURA)
+        items.append(OutlinedText(
+            title_offset_x, title_offset_y, titulo_capitalizado, titulo_spec,
+            fill='#E91E63',  # Rosa Fuerte/Fucsia
+            outline='#8E24AA',  # Púrpura Profundo (Para sombra/contorno)
+            outline_width=4
+        ))
+
+    # ----------------------------------------------------------------------
+    # TEXTO CON LETRA CAPITAL
+    # ----------------------------------------------------------------------
+
+    text_color = '#2C3E50' if estilo == "infantil" else '#2c2c2c'
+
+    # 1. Separar el primer párrafo (va junto a la letra capital) del resto del cuento
+    text_normalized = re.sub(r'\n{3,}', '\n\n', texto_cuento)
+    paragraphs = text_normalized.split('\n\n')
+    first_para_idx = next((i for i, para in enumerate(paragraphs) if para.strip()), -1)
+
+    lines_drawn = 0
+    lines_total = 0
+    truncated = False
+    cut_text = ''  # primera línea que no cabe (para señalar el corte en la vista previa)
+
+    if first_para_idx != -1:
+        first_words = paragraphs[first_para_idx].split()
+        drop_cap_char = first_words[0][0]
+        text_to_reflow = " ".join(first_words)[1:].lstrip() # Quitar la letra capital
+
+        # --- SETUP DE LETRA CAPITAL ---
+        DROP_CAP_LINES = 3 # Ocupará 3 líneas de altura.
+
+        # Ajuste de tamaño de fuente para que la altura total de la caja del texto
+        drop_cap_size = line_spacing * (DROP_CAP_LINES + 0.3)
+        drop_cap_spec = FontSpec(SERIF_BOLD, int(drop_cap_size))
+
+        # Calcular ancho de la Letra Capital
+        bbox_cap = text_bbox(get_font(*drop_cap_spec), drop_cap_char)
+        cap_width = bbox_cap[2] - bbox_cap[0]
+
+        # Ajuste vertical fino para alinear la parte superior de la cap con la primera línea de texto
+        cap_y_adjustment = sized(-15)
+        drop_cap_x = margin_left
+        drop_cap_y_final = y_text + cap_y_adjustment
+
+        # LETRA CAPITAL (sello del atlas: se pega ya rasterizada)
+        items.append(Stamp((TextRun(drop_cap_x, drop_cap_y_final, drop_cap_char, drop_cap_spec, '#ef4444'),)))
+
+        # 2. El primer párrafo se parte una sola vez, al ancho que deja libre la capital
+        rest_x = drop_cap_x + cap_width + 25 # Margen derecho de la cap
+        rest_max_width = a4_width - rest_x - margin_right
+
+        wrapped_reflow_text = wrap_text_with_markdown(text_to_reflow, fonts, rest_max_width)
+        lines_total += len(wrapped_reflow_text)
+
+        y_current_reflow = y_text
+
+        # 2a. Líneas que van AL LADO de la Letra Capital
+        lines_drawn_around_cap = 0
+
+        for line in wrapped_reflow_text[:DROP_CAP_LINES]:
+            if line.text.strip():
+                items.extend(place_line(rest_x, y_current_reflow, line, specs, text_color, max_width_px=rest_max_width))
+            y_current_reflow += line_spacing
+            lines_drawn_around_cap += 1
+
+        # 2b. El resto del cuento empieza después de las 3 líneas ocupadas por la letra capital
+        y_text = y_text + DROP_CAP_LINES * line_spacing + paragraph_spacing
+        lines_drawn = lines_drawn_around_cap
+
+        # 2c. Resto de las líneas del primer párrafo (si hubo overflow), a ancho completo
+        for line in wrapped_reflow_text[lines_drawn_around_cap:]:
+            if y_text > max_height:
+                if not paginate or len(pages) >= MAX_PAGES:
+                    truncated = True
+                    cut_text = line.text
+                    break
+                items = []
+                pages.append(items)
+                y_text = continuation_top
+
+            items.extend(place_line(margin_left, y_text, line, specs, text_color, max_width_px=max_width_px))
+            y_text += line_spacing
+            lines_drawn += 1
+
+        # Si el primer párrafo terminó con un salto de párrafo, avanzar
+        if first_para_idx < len(paragraphs) - 1:
+            y_text += paragraph_spacing
+
+        rest_text = '\n\n'.join(paragraphs[first_para_idx + 1:])
+    else:
+        rest_text = ''
+
+    # ----------------------------------------------------------------------
+    # RESTO DEL CUENTO (PÁRRAFOS SIGUIENTES)
+    # ----------------------------------------------------------------------
+
+    texto_lines = wrap_text_with_markdown(rest_text, fonts, max_width_px)
+    lines_total += sum(1 for line in texto_lines if line.kind == 'text')
+
+    for i, line in enumerate(texto_lines):
+        if y_text > max_height:
+            if not paginate or len(pages) >= MAX_PAGES:
+                logger.warning(f"⚠️ Truncado en línea {i+1}/{len(texto_lines)}")
+                truncated = True
+                cut_text = cut_text or next((rest.text for rest in texto_lines[i:] if rest.kind == 'text'), '')
+                break
+            logger.info(f"📄 Página {len(pages) + 1}: el cuento continúa en la línea {i+1}/{len(texto_lines)}")
+            items = []
+            pages.append(items)
+            y_text = continuation_top
+
+        if line.kind == 'paragraph_break':
+            # Un salto de párrafo no deja hueco al principio de una página de continuación
+            if items:
+                y_text += paragraph_spacing
+            continue
+
+        items.extend(place_line(margin_left, y_text, line, specs, text_color, max_width_px=max_width_px))
+
+        y_text += line_spacing
+        lines_drawn += 1
+
+    logger.info(f"✅ {lines_drawn} líneas de texto dibujadas (incluyendo párrafos reflow)")
+
+    if estilo == "infantil":
+        for page_items in pages:
+            page_items.extend(wavy_border(a4_width, a4_height))
+
+    background = '#FFFEF0' if estilo == "infantil" else 'white'
+    info = {'lines_total': lines_total, 'lines_drawn': lines_drawn, 'truncated': truncated, 'cut_text': cut_text,
+            'y_end': y_text, 'max_height': max_height, 'text_size': text_size, 'line_spacing': line_spacing,
+            'pages': len(pages)}
+    return tuple(DisplayList((a4_width, a4_height), background, tuple(page_items), MappingProxyType(dict(info, page=n)))
+                 for n, page_items in enumerate(pages, start=1))
+
+
+# ----------------------------------------------------------------------
+# HOJA DE PREGUNTAS
+# ----------------------------------------------------------------------
+
+def parse_preguntas(preguntas: str) -> list:
+    """Convierte el campo `preguntas` (JSON o texto numerado) en la lista de preguntas con sus opciones."""
+    try:
+        # Intenta cargar como JSON (lista de preguntas/opciones)
+        preguntas_list = json.loads(preguntas)
+        if not isinstance(preguntas_list, list):
+            preguntas_list = [preguntas]
+
+        # Si es un array con 1 elemento, intentar separar de forma inteligente
+        if len(preguntas_list) == 1:
+            texto_completo = str(preguntas_list[0])
+
+            # ESTRATEGIA 1: Buscar numeración (1., 2., 3., etc.) - Funciona con \n o \n\n
+            # El patrón busca: inicio de línea O salto de línea, seguido de dígito(s) y punto
+            partes_numeradas = re.split(r'(?:^|\n+)(?=\d+\.)', texto_completo)
+            partes_numeradas = [p.strip() for p in partes_numeradas if p.strip()]
+
+            if len(partes_numeradas) > 1:
+                # Si encontró preguntas numeradas, usarlas (maneja \n y \n\n)
+                preguntas_list = partes_numeradas
+                logger.info(f"✅ Separado por numeración: {len(preguntas_list)} preguntas")
+            elif '\n\n' in texto_completo:
+                # ESTRATEGIA 2: Fallback a separación por doble salto
+                preguntas_list = [p.strip() for p in texto_completo.split('\n\n') if p.strip()]
+                logger.info(f"✅ Separado por \\n\\n: {len(preguntas_list)} preguntas")
+            else:
+                logger.warning("⚠️ No se pudo separar las preguntas, usando como una sola")
+
+        logger.info(f"✅ {len(preguntas_list)} preguntas parseadas en total")
+    except (json.JSONDecodeError, TypeError) as e:
+        logger.error(f"Error parseando JSON: {e}. Cayendo a split inteligente.")
+        # Fallback con el mismo método inteligente
+        texto_completo = str(preguntas)
+        partes_numeradas = re.split(r'(?:^|\n+)(?=\d+\.)', texto_completo)
+        preguntas_list = [p.strip() for p in partes_numeradas if p.strip()]
+
+    return preguntas_list
+
+
+def border_slot() -> ImageSlot:
+    """Zona del borde de la hoja de preguntas: la imagen se estira a toda la hoja A4"""
+    return ImageSlot('border', (0, 0, A4_WIDTH, A4_HEIGHT), 'stretch')
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def layout_hoja_preguntas(preguntas: str, titulo_cuento: str, estilo: str,
+                          text_size: int = HOJA_TEXT_SIZE) -> DisplayList:
+    """Hoja de preguntas en una sola página: las preguntas que no caben se descartan (ver `info`)."""
+    return _layout_hoja_preguntas(preguntas, titulo_cuento, estilo, text_size, paginate=False)[0]
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def layout_hoja_preguntas_pages(preguntas: str, titulo_cuento: str, estilo: str,
+                                text_size: int = HOJA_TEXT_SIZE) -> tuple:
+    """Hoja de preguntas paginada: las preguntas que no caben pasan enteras a la página siguiente."""
+    return _layout_hoja_preguntas(preguntas, titulo_cuento, estilo, text_size, paginate=True)
+
+
+@stage('text_layout')
+def _layout_hoja_preguntas(preguntas: str, titulo_cuento: str, estilo: str, text_size: int,
+                           paginate: bool) -> tuple:
+    """
+    Calcula la hoja de preguntas completa como display lists sobre el borde estirado a A4.
+    `text_size` es el tamaño de las preguntas; opciones, números y espacios se escalan con él
+    (el encabezado y los campos Nombre/Fecha no cambian).
+    Con `paginate`, una pregunta que no cabe entera empieza una página nueva con el mismo
+    borde y capa blanca (hasta MAX_PAGES); sin él, se descarta junto con las siguientes.
+    """
+    a4_width = A4_WIDTH
+    a4_height = A4_HEIGHT
+
+    def sized(value):
+        return round(value * text_size / HOJA_TEXT_SIZE)
+
+    # ESTIRAR imagen de fondo para cubrir TODA la hoja A4
+    # (La imagen de fondo es cuadrada y debe expandirse a lo alto/ancho de la hoja)
+    background = border_slot()
+
+    # ----------------------------------------------------------------------
+    # PASO CLAVE: CAPA SEMI-TRANSPARENTE BLANCA CENTRAL
+    # FIX 2: La capa blanca solo cubre la zona CENTRAL del texto,
+    # respetando los márgenes para dejar visible el borde temático de la IA.
+    # ----------------------------------------------------------------------
+
+    # Márgenes para la capa blanca (AUMENTADOS verticalmente para centrar mejor)
+    BACKGROUND_MARGIN_X = 150  # Horizontal: bien establecido
+    BACKGROUND_MARGIN_Y = 200  # AUMENTADO de 120 a 200 para hacer la capa más pequeña y centrada
+
+    # Rectángulo semi-transparente BLANCO que solo cubre el centro (Casi opaco: 230/255)
+    white_layer = Rect((BACKGROUND_MARGIN_X, BACKGROUND_MARGIN_Y, a4_width - BACKGROUND_MARGIN_X, a4_height - BACKGROUND_MARGIN_Y),
+                       fill=(255, 255, 255, 230))
+    items = [white_layer]
+    pages = [items]
+
+    # FUENTES Y ESTILO
+
+    # Color del texto (gris oscuro, plomito) para contrastar con el fondo blanco
+    text_color = '#333333'
+
+    # Título principal (Comprensión Lectora)
+    titulo_spec = FontSpec(SANS_BOLD, 85)
+    # Título del Cuento:
+    subtitulo_spec = FontSpec(SANS_BOLD, 70)
+    numero_spec = FontSpec(SANS_BOLD, sized(58))
+    campos_spec = FontSpec(SANS, HOJA_TEXT_SIZE)
+
+    # Fuentes para el texto de las preguntas y opciones (más grandes y dulces)
+    specs = {
+        'normal': FontSpec(SANS, text_size),
+        'bold': FontSpec(SANS_BOLD, sized(52)),
+        'italic': FontSpec(SANS_ITALIC, sized(52)),
+        'bold_italic': FontSpec(SANS_BOLD_ITALIC, sized(52))
+    }
+    specs_opciones = dict(specs, normal=FontSpec(SANS, sized(48)))
+    fonts = resolve_fonts(specs)
+    fonts_opciones = resolve_fonts(specs_opciones)
+
+    preguntas_list = parse_preguntas(preguntas)
+
+    # CONFIGURACIÓN DE LAYOUT
+
+    # Margen de texto interno (ASIMÉTRICO: más margen a la izquierda)
+    TEXT_MARGIN_LEFT = 280   # DOBLE margen izquierdo para que círculo y texto queden dentro
+    TEXT_MARGIN_RIGHT = 200  # Margen derecho normal (está bien)
+    TEXT_MARGIN_Y_TOP = 320  # Ajustado para la nueva altura de capa blanca
+
+    # El ancho máximo de texto se define por los márgenes asimétricos
+    text_start_x = TEXT_MARGIN_LEFT
+    text_end_x = a4_width - TEXT_MARGIN_RIGHT
+    max_width_px = text_end_x - text_start_x
+
+    margin_top = TEXT_MARGIN_Y_TOP # Iniciar texto con margen superior
+
+    line_spacing = sized(75)
+    option_spacing = sized(65)
+    question_spacing = sized(50)
+    answer_line_height = sized(60)
+    space_after_answer = sized(80)
+
+    # Altura máxima: debe terminar antes del margen inferior
+    max_height = a4_height - 320  # Margen inferior para mantener contenido dentro de la capa
+
+    y_text = margin_top
+
+    # ENCABEZADO "Comprensión Lectora" (MANTENIENDO ESTILO 3D AZUL/ROSA)
+    encabezado = "Comprensión Lectora"
+    bbox = text_bbox(get_font(*titulo_spec), encabezado)
+    text_width = bbox[2] - bbox[0]
+    x_centered = (a4_width - text_width) // 2
+
+    if estilo == "infantil":
+        # Estilo original '3D y rosa': azul claro con contorno azul oscuro
+        items.append(OutlinedText(x_centered, y_text, encabezado, titulo_spec,
+                                  fill='#42A5F5', outline='#1a5490', outline_width=4))
+    else:
+        items.append(TextRun(x_centered, y_text, encabezado, titulo_spec, '#1a5490'))
+
+    y_text += 105
+
+    # TÍTULO DEL CUENTO
+    if titulo_cuento:
+        titulo_capitalizado = to_title_case(titulo_cuento)
+        cuento_text = f'Cuento: "{titulo_capitalizado}"'
+        bbox = text_bbox(get_font(*subtitulo_spec), cuento_text)
+        text_width = bbox[2] - bbox[0]
+        x_centered = (a4_width - text_width) // 2
+
+        # Subtítulo sin efecto para contraste
+        items.append(TextRun(x_centered, y_text, cuento_text, subtitulo_spec, '#333333'))
+
+        y_text += 80
+
+    # LÍNEA SEPARADORA
+    line_margin = text_start_x + 80
+    if estilo == "infantil":
+        items.append(rainbow_separator(line_margin, y_text, text_end_x - line_margin - 80))
+    else:
+        items.append(Line(((line_margin, y_text), (text_end_x - 80, y_text)), fill='#1a5490', width=3))
+
+    y_text += 55
+
+    # CAMPOS DE NOMBRE Y FECHA
+    campos_y = y_text
+    # Texto de campos en el color principal (gris oscuro), con su línea un poco debajo
+    items.append(Stamp((TextRun(text_start_x, campos_y, "Nombre:", campos_spec, text_color),)))
+    items.append(Line(((text_start_x + 200, campos_y + 50), (text_start_x + 800, campos_y + 50)), fill=text_color, width=2))
+
+    fecha_x = text_end_x - 400
+    items.append(Stamp((TextRun(fecha_x, campos_y, "Fecha:", campos_spec, text_color),)))
+    items.append(Line(((fecha_x + 140, campos_y + 50), (text_end_x, campos_y + 50)), fill=text_color, width=2))
+
+    y_text += 120
+    # Hasta aquí la página solo depende del borde, el título y el estilo: el rasterizador
+    # cachea esa base y las variantes de preguntas se dibujan sobre una copia
+    base_items = [len(items)]
+
+    # PREGUNTAS CON OPCIONES Y RESPUESTAS
+
+    questions_drawn = 0
+    truncated = False
+    # La posición del círculo se ajusta ligeramente ANTES de donde empieza el texto (text_start_x)
+    CIRCLE_START_X = text_start_x - 50
+
+    def place_question(idx, pregunta_completa, y_text, limit):
+        """
+        Coloca una pregunta (número, texto, opciones y línea de respuesta) desde y_text.
+        Las opciones y la línea que pasan de `limit` se omiten.
+        Devuelve (items, y siguiente, y de la línea de respuesta, si se omitió algo, filas),
+        donde cada fila es (y, primer item) de una línea; al paginar se puede cortar entre ellas.
+        """
+        items = []
+        rows = []
+        clipped = False
+
+        # Separar pregunta de opciones
+        partes = pregunta_completa.split('\n')
+        pregunta_principal = partes[0].strip()
+        # Filtra opciones que tengan formato a), b), etc.
+        opciones = [p.strip() for p in partes[1:] if p.strip() and re.match(r'^[a-dA-D]\)', p.strip())]
+
+        # Limpiar numeración si ya viene
+        pregunta_sin_numero = re.sub(r'^\d+\.\s*', '', pregunta_principal)
+
+        # NÚMERO DE PREGUNTA
+        numero = str(idx + 1)
+
+        if estilo == "infantil":
+            circle_x = CIRCLE_START_X
+            circle_y = y_text + sized(18)
+            circle_radius = sized(26)
+
+            # Círculo 'Dulce' para el número de pregunta
+            circle = Ellipse(
+                (circle_x - circle_radius, circle_y - circle_radius, circle_x + circle_radius, circle_y + circle_radius),
+                fill='#FF6B9D', # Rosa Fuerte
+                outline='#E91E63', # Rosa más oscuro para el borde
+                width=3
+            )
+
+            bbox = text_bbox(get_font(*numero_spec), numero)
+            num_width = bbox[2] - bbox[0]
+            num_height = bbox[3] - bbox[1]
+            # Blanco para el número; círculo y número se pegan juntos desde el atlas de sprites
+            items.append(Stamp((circle, TextRun(circle_x - num_width//2, circle_y - num_height//2 - sized(3), numero,
+                                                numero_spec, 'white'))))
+        else:
+            # Número en la posición de inicio del círculo (que está antes del texto)
+            items.append(Stamp((TextRun(CIRCLE_START_X + 15, y_text, f"{numero}.", numero_spec, text_color),)))
+
+        # El texto de la pregunta empieza donde debería iniciar el texto
+        x_pregunta = text_start_x
+
+        # TEXTO DE LA PREGUNTA
+        max_width_pregunta = max_width_px
+
+        for line in wrap_text_with_markdown(pregunta_sin_numero, fonts, max_width_pregunta):
+            if line.kind == 'paragraph_break':
+                y_text += sized(40)
+                continue
+            # La primera fila incluye el número
+            rows.append((y_text, len(items) if rows else 0))
+            items.extend(place_line(x_pregunta, y_text, line, specs, text_color, max_width_pregunta))
+            y_text += line_spacing
+
+        # OPCIONES (si las hay)
+        if opciones:
+            y_text += sized(15)
+
+            for opcion in opciones:
+                if y_text > limit:
+                    clipped = True
+                    break
+
+                x_opcion = x_pregunta + sized(60)
+                max_width_opcion = max_width_px - sized(60)
+
+                for line in wrap_text_with_markdown(opcion, fonts_opciones, max_width_opcion):
+                    if line.kind == 'paragraph_break':
+                        continue
+                    # Las opciones usan la fuente más amigable
+                    rows.append((y_text, len(items) if rows else 0))
+                    items.extend(place_line(x_opcion, y_text, line, specs_opciones, text_color, max_width_opcion))
+                    y_text += option_spacing
+
+            y_text += question_spacing
+        else:
+            y_text += question_spacing + sized(20)
+
+        # LÍNEA PARA RESPUESTA, en la posición actual de y_text
+        line_y = y_text
+
+        if line_y < limit:
+            line_start_x = text_start_x + 50
+            line_end_x = text_end_x - 50
+            rows.append((line_y, len(items) if rows else 0))
+
+            if estilo == "infantil":
+                # Línea de puntos
+                color = ['#FF6B9D', '#FFD93D', '#6BCF7F', '#4ECDC4'][idx % 4]
+                items.append(dotted_line(line_start_x, line_end_x, line_y, color))
+            else:
+                # Línea sólida
+                items.append(Line(((line_start_x, line_y), (line_end_x, line_y)), fill=text_color, width=2))
+
+            # Avanzamos y_text *después* de la línea, para asegurar el espacio.
+            y_text += answer_line_height + space_after_answer
+        else:
+            # La pregunta cabe pero su línea de respuesta no
+            clipped = True
+
+        return items, y_text, line_y, clipped, rows
+
+    def new_page():
+        page = [white_layer]
+        pages.append(page)
+        base_items.append(len(page))
+        return page
+
+    # Al paginar nada se omite: la pregunta se coloca entera y, si su línea de respuesta no cabe,
+    # se vuelve a colocar al principio de una página nueva; si ni ahí cabe, se corta entre líneas
+    limit = math.inf if paginate else max_height
+    page_questions = 0
+
+    for idx, pregunta_completa in enumerate(preguntas_list):
+        if not pregunta_completa.strip():
+            continue
+
+        # Verificar si hay espacio para la siguiente pregunta
+        estimated_height_needed = line_spacing * 2 + space_after_answer
+
+        placed = None
+        if y_text + estimated_height_needed <= max_height:
+            placed = place_question(idx, pregunta_completa, y_text, limit)
+            if paginate and placed[2] >= max_height and page_questions:
+                placed = None
+
+        if placed is None:
+            if not paginate or len(pages) >= MAX_PAGES:
+                logger.warning(f"⚠️ Truncado en pregunta {idx+1}/{len(preguntas_list)}")
+                truncated = True
+                break
+            logger.info(f"📄 Página {len(pages) + 1}: desde la pregunta {idx+1}/{len(preguntas_list)}")
+            items = new_page()
+            page_questions = 0
+            y_text = margin_top
+            placed = place_question(idx, pregunta_completa, y_text, limit)
+
+        question_items, y_text, line_y, clipped, rows = placed
+        if paginate and line_y >= max_height:
+            # Más alta que una página: cada fila que no cabe empieza una página nueva
+            offset = 0
+            ends = [start for _, start in rows[1:]] + [len(question_items)]
+            for (top, start), end in zip(rows, ends):
+                if start and top + offset + line_spacing > max_height:
+                    if len(pages) >= MAX_PAGES:
+                        logger.warning(f"⚠️ Truncado dentro de la pregunta {idx+1}/{len(preguntas_list)}")
+                        truncated = True
+                        break
+                    logger.info(f"📄 Página {len(pages) + 1}: sigue la pregunta {idx+1}/{len(preguntas_list)}")
+                    items = new_page()
+                    offset = margin_top - top
+                items.extend(shift_item(item, offset) for item in question_items[start:end])
+            y_text += offset
+        else:
+            items.extend(question_items)
+        truncated = truncated or clipped
+        page_questions += 1
+        questions_drawn += 1
+        if truncated and paginate:
+            break
+
+    logger.info(f"✅ {questions_drawn}/{len(preguntas_list)} preguntas dibujadas")
+
+    info = {'questions_total': len(preguntas_list), 'questions_drawn': questions_drawn, 'truncated': truncated,
+            'y_end': y_text, 'max_height': max_height, 'text_size': text_size, 'line_spacing': line_spacing,
+            'pages': len(pages)}
+    return tuple(DisplayList((a4_width, a4_height), background, tuple(page_items),
+                             MappingProxyType(dict(info, page=n, base_items=base)))
+                 for n, (page_items, base) in enumerate(zip(pages, base_items), start=1))
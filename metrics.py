@@ -0,0 +1,256 @@
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+# Métricas en formato de texto de Prometheus (0.0.4), sin dependencias: contadores, gauges
+# e histogramas en memoria del proceso principal. Los tiempos por etapa medidos dentro del
+# pool (hilos o procesos) vuelven junto con el resultado de cada trabajo (ver collect_stages).
+
+PREFIX = "pillow_service"
+
+# Etapas del pipeline de render, en orden
+STAGES = ('upload_read', 'decode', 'resize', 'composite', 'text_layout', 'text_draw', 'decorations', 'encode')
+# Segundos: desde una pegada de sprite (~1 ms) hasta un PNG de hoja completa a 300 DPI
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """(sufijo, valores de las etiquetas, etiquetas extra, valor) de cada serie"""
+        return []
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}  # etiquetas -> [conteos por bucket (no acumulados), suma, total]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', key, (('le', _format_value(float(bound))),), cumulative))
+                samples.append(('_sum', key, (), round(total, 6)))
+                samples.append(('_count', key, (), count))
+        return samples
+
+
+class CallbackMetric(Metric):
+    """
+    Valor leído en el momento del scrape: `collect()` devuelve {valores de etiquetas: valor}
+    (o un único valor). Sirve para colas y para los contadores que ya llevan las cachés.
+    """
+
+    def __init__(self, name, help_text, labelnames=(), collect=None, kind='gauge'):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self):
+        values = self.collect() if self.collect else {}
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', key if isinstance(key, tuple) else (key,), (), value) for key, value in values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "stage_seconds", "Tiempo por etapa del pipeline de render (por trabajo)", ("stage",)))
+REQUESTS = registry.register(Counter(
+    "http_requests_total", "Peticiones HTTP atendidas", ("method", "endpoint", "status")))
+ERRORS = registry.register(Counter(
+    "http_errors_total", "Peticiones HTTP respondidas con error (4xx/5xx)", ("method", "endpoint", "status")))
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_seconds", "Duración de las peticiones HTTP", ("method", "endpoint"), buckets=REQUEST_BUCKETS))
+BYTES_IN = registry.register(Counter(
+    "http_request_bytes_total", "Bytes recibidos en el cuerpo de las peticiones", ("endpoint",)))
+BYTES_OUT = registry.register(Counter(
+    "http_response_bytes_total", "Bytes enviados en el cuerpo de las respuestas", ("endpoint",)))
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: cuenta peticiones, errores, duración y bytes de entrada y salida por
+    endpoint (la plantilla de la ruta, p. ej. /render/{render_id}). Cuenta los cuerpos tal
+    como pasan, así que también mide las respuestas en streaming (ZIP, multipart).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        seen = {'in': 0, 'out': 0, 'status': 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message['type'] == 'http.request':
+                seen['in'] += len(message.get('body', b''))
+            return message
+
+        async def counting_send(message):
+            if message['type'] == 'http.response.start':
+                seen['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                seen['out'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            # El router deja la ruta en el scope; sin ella (404) no se crea una serie por URL
+            route = scope.get('route')
+            endpoint = getattr(route, 'path', 'unmatched')
+            method, status = scope['method'], seen['status']
+            REQUESTS.inc(method=method, endpoint=endpoint, status=status)
+            if status >= 400:
+                ERRORS.inc(method=method, endpoint=endpoint, status=status)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=method, endpoint=endpoint)
+            BYTES_IN.inc(seen['in'], endpoint=endpoint)
+            BYTES_OUT.inc(seen['out'], endpoint=endpoint)
+
+
+# ----------------------------------------------------------------------
+# TIEMPOS POR ETAPA
+# ----------------------------------------------------------------------
+
+_local = threading.local()
+
+
+def _record(name: str, seconds: float):
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        STAGE_SECONDS.observe(seconds, stage=name)
+    else:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+def add_stage(name: str, seconds: float):
+    """
+    Suma tiempo a una etapa. Dentro de un trabajo del pool se acumula en el trabajo
+    (collect_stages lo devuelve al proceso principal); fuera, se observa directamente.
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        # La etapa que la contiene no cuenta este tiempo dos veces
+        stack[-1] += seconds
+    _record(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Mide un bloque (o una función, como decorador); descuenta las etapas anidadas."""
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        _record(name, elapsed - nested)
+
+
+def collect_stages(fn, *args):
+    """
+    Ejecuta fn(*args) en el worker y devuelve (resultado, {etapa: segundos}).
+    Así los tiempos medidos en un proceso del pool llegan al proceso que sirve /metrics.
+    """
+    _local.stages = stages = {}
+    try:
+        return fn(*args), stages
+    finally:
+        _local.stages = None
+
+
+def observe_stages(stages: dict):
+    for name, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURACIÓN (variables de entorno)
+# OUTPUT_DIR: si se define, cada PNG entregado se guarda también en este directorio
+# OUTPUT_RETENTION_HOURS: los archivos más antiguos se borran al guardar uno nuevo
+# OUTPUT_MAX_FILES: como mucho se conservan estos archivos (los más recientes)
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "")
+OUTPUT_RETENTION_HOURS = float(os.environ.get("OUTPUT_RETENTION_HOURS", 24))
+OUTPUT_MAX_FILES = int(os.environ.get("OUTPUT_MAX_FILES", 1000))
+
+# La limpieza del directorio se hace como mucho una vez por minuto
+PRUNE_INTERVAL = 60
+
+
+class OutputStore:
+    """
+    Copia opcional en disco de los PNG entregados (depuración, auditoría).
+    Cada archivo lleva un sufijo único, así que dos renders con el mismo título en el mismo
+    segundo ya no se sobrescriben, y los antiguos se borran según la política de retención.
+    """
+
+    def __init__(self, directory=OUTPUT_DIR, retention_hours=OUTPUT_RETENTION_HOURS, max_files=OUTPUT_MAX_FILES):
+        self.directory = directory or None
+        self.retention_seconds = retention_hours * 3600
+        self.max_files = max_files
+        self._last_prune = 0.0
+        self._lock = threading.Lock()  # save() se llama desde varios hilos
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def save(self, filename: str, data: bytes):
+        """Guarda `data` con un nombre único derivado de `filename`; no hace nada si está desactivado."""
+        if not self.directory:
+            return None
+        stem, ext = os.path.splitext(filename)
+        path = os.path.join(self.directory, f"{stem}_{uuid.uuid4().hex[:8]}{ext}")
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            logger.error(f"❌ No se pudo guardar la copia en disco: {e}")
+            return None
+
+        # Solo un hilo a la vez recorre el directorio
+        with self._lock:
+            due = time.time() - self._last_prune >= PRUNE_INTERVAL
+            if due:
+                self._last_prune = time.time()
+        if due:
+            self.prune()
+        return path
+
+    def prune(self):
+        """Borra los archivos más viejos que la retención y los que excedan OUTPUT_MAX_FILES."""
+        self._last_prune = now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                entries.append((entry.stat().st_mtime, entry.path))
+        entries.sort(reverse=True)
+
+        removed = 0
+        for i, (mtime, path) in enumerate(entries):
+            if i >= self.max_files or now - mtime > self.retention_seconds:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"🧹 {removed} copias antiguas eliminadas de {self.directory}")
+
+
+output_store = OutputStore()
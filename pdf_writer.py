@@ -0,0 +1,308 @@
+from PIL import ImageColor
+import hashlib
+import io
+import os
+import zlib
+
+from font_subset import truetype_font
+from fonts import get_font
+from layout import Ellipse, ImageSlot, Layer, Line, OutlinedText, Rect, Stamp, TextRun
+from metrics import stage
+from rasterizer import fit_image, has_alpha
+
+# Calidad JPEG de las imágenes incrustadas en el PDF (cabecera y borde)
+PDF_IMAGE_QUALITY = int(os.environ.get("PDF_IMAGE_QUALITY", 90))
+
+# Los layouts están en píxeles a 300 DPI; el PDF trabaja en puntos (1/72")
+PX_TO_PT = 72 / 300
+# Constante de Bézier para aproximar un cuarto de círculo
+KAPPA = 0.5522847498
+
+# ----------------------------------------------------------------------
+# DOCUMENTO
+# ----------------------------------------------------------------------
+
+def _color(fill):
+    """Color de la display list (nombre, #hex o tupla) -> (r, g, b) en 0-1 y alpha 0-1"""
+    rgba = ImageColor.getrgb(fill) if isinstance(fill, str) else tuple(fill)
+    alpha = rgba[3] / 255 if len(rgba) == 4 else 1.0
+    return ' '.join(f'{c / 255:.4g}' for c in rgba[:3]), alpha
+
+
+def _num(value) -> str:
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+
+def _to_unicode(cids: dict) -> bytes:
+    """CMap ToUnicode: CID -> carácter, para que copiar, buscar y extraer devuelvan el texto original"""
+    entries = [f'<{cid:04x}> <{char.encode("utf-16-be").hex()}>' for char, cid in cids.items()]
+    blocks = []
+    for i in range(0, len(entries), 100):  # como máximo 100 entradas por bloque bfchar
+        chunk = entries[i:i + 100]
+        blocks.append(f'{len(chunk)} beginbfchar\n' + '\n'.join(chunk) + '\nendbfchar')
+    return ('/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+            '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n'
+            '/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+            '1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n'
+            + '\n'.join(blocks) +
+            '\nendcmap\nCMapName currentdict /CMap defineresource pop\nend\nend').encode('ascii')
+
+
+class PdfDocument:
+    """
+    Escritor PDF mínimo para display lists: texto real con fuentes TrueType incrustadas
+    (subconjunto, Type0 con Identity-H: cualquier carácter de la fuente, no solo cp1252),
+    vectores para rectángulos, elipses y líneas, e imágenes JPEG.
+    Cada imagen distinta y cada fuente se incrustan una sola vez para todo el documento.
+    """
+
+    def __init__(self):
+        self._objects = [None]  # los objetos PDF empiezan en 1
+        self._pages = []
+        self._fonts = {}  # ruta -> (nombre de recurso, carácter -> CID)
+        self._images = {}  # (id(imagen), hueco) -> nombre de recurso
+        self._image_objects = {}
+        self._sources = []  # imágenes incrustadas, vivas hasta serializar
+        self._alphas = {}  # alpha -> nombre de ExtGState
+        self._pages_id = self._reserve()
+
+    def _reserve(self) -> int:
+        self._objects.append(None)
+        return len(self._objects) - 1
+
+    def _add(self, body: bytes, object_id: int = None) -> int:
+        if object_id is None:
+            object_id = self._reserve()
+        self._objects[object_id] = body
+        return object_id
+
+    def _stream(self, entries: str, data: bytes, compress: bool = True) -> int:
+        if compress:
+            data = zlib.compress(data, 6)
+            entries += ' /Filter /FlateDecode'
+        return self._add(f'<< {entries} /Length {len(data)} >>\nstream\n'.encode('latin-1') + data + b'\nendstream')
+
+    def _font(self, spec) -> str:
+        if spec.path not in self._fonts:
+            self._fonts[spec.path] = (f'F{len(self._fonts) + 1}', {})
+        return self._fonts[spec.path][0]
+
+    def _alpha(self, alpha: float) -> str:
+        key = round(alpha, 3)
+        if key not in self._alphas:
+            self._alphas[key] = f'GS{len(self._alphas) + 1}'
+        return self._alphas[key]
+
+    def _image(self, img, slot) -> str:
+        """
+        Recurso de la imagen encuadrada en el hueco. Se incrusta una sola vez aunque se repita
+        en varias páginas (el borde de la hoja paginada); se guarda la imagen original para
+        que su id no se reutilice mientras viva el documento.
+        """
+        key = (id(img), slot.box, slot.fit)
+        if key not in self._images:
+            name = f'Im{len(self._images) + 1}'
+            self._images[key] = name
+            self._sources.append(img)
+            x0, y0, x1, y1 = slot.box
+            # Se incrusta a 300 DPI como máximo: si la subida es mayor se usa el mismo fit_image del raster
+            if slot.fit == 'cover' or img.width > x1 - x0 or img.height > y1 - y0:
+                img = fit_image(img, slot)
+            self._image_objects[name] = self._embed_image(img)
+        return self._images[key]
+
+    def _embed_image(self, img) -> int:
+        smask = ''
+        if has_alpha(img):
+            rgba = img.convert('RGBA')
+            alpha_id = self._stream(f'/Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} '
+                                    f'/ColorSpace /DeviceGray /BitsPerComponent 8', rgba.getchannel('A').tobytes())
+            smask = f' /SMask {alpha_id} 0 R'
+            img = rgba.convert('RGB')
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=PDF_IMAGE_QUALITY)
+        color_space = '/DeviceGray' if img.mode == 'L' else '/DeviceRGB'
+        return self._stream(f'/Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} '
+                            f'/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode{smask}',
+                            buffer.getvalue(), compress=False)
+
+    # ------------------------------------------------------------------
+    # PÁGINAS
+    # ------------------------------------------------------------------
+
+    def add_page(self, display_list, images=None):
+        """Añade una página A4 con la display list; `images` asocia cada ImageSlot con su imagen decodificada."""
+        images = images or {}
+        self._width, self._height = display_list.size
+        ops = []
+        background = display_list.background
+        if isinstance(background, ImageSlot):
+            self._draw_image(ops, images[background.name], background)
+        else:
+            ops.append(self._fill_rect((0, 0, display_list.size[0] - 1, display_list.size[1] - 1), background))
+
+        for item in display_list.items:
+            self._draw(ops, item, images)
+        self._pages.append((display_list.size, b'\n'.join(ops)))
+
+    def _xy(self, x, y, dx=0, dy=0):
+        """Píxeles (origen arriba a la izquierda) -> puntos PDF (origen abajo a la izquierda)"""
+        return _num((x + dx) * PX_TO_PT), _num((self._height - (y + dy)) * PX_TO_PT)
+
+    def _draw(self, ops, item, images, dx=0, dy=0):
+        if isinstance(item, TextRun):
+            ops.append(self._text(item, dx, dy))
+        elif isinstance(item, OutlinedText):
+            ops.append(self._text(item, dx, dy, outline=item.outline, stroke=item.outline_width * 2))
+        elif isinstance(item, Rect):
+            x0, y0, x1, y1 = item.box
+            ops.append(self._fill_rect((x0 + dx, y0 + dy, x1 + dx, y1 + dy), item.fill))
+        elif isinstance(item, Ellipse):
+            ops.append(self._ellipse(item, dx, dy))
+        elif isinstance(item, Line):
+            color, _ = _color(item.fill)
+            path = ' '.join(f'{" ".join(self._xy(x, y, dx, dy))} {"m" if i == 0 else "l"}'
+                            for i, (x, y) in enumerate(item.points))
+            ops.append(f'q {color} RG {_num(item.width * PX_TO_PT)} w {path} S Q'.encode('latin-1'))
+        elif isinstance(item, Layer):
+            for child in item.items:
+                self._draw(ops, child, images, dx + item.x, dy + item.y)
+        elif isinstance(item, Stamp):
+            # Los sellos del atlas son solo un atajo del raster: en el PDF van sus items como vectores y texto
+            for child in item.items:
+                self._draw(ops, child, images, dx, dy)
+        elif isinstance(item, ImageSlot):
+            self._draw_image(ops, images[item.name], item)
+
+    def _text(self, item, dx, dy, outline=None, stroke=0) -> bytes:
+        resource = self._font(item.font)
+        cids = self._fonts[item.font.path][1]
+        # Identity-H: 2 bytes por carácter. Cada carácter distinto tiene su CID (el 0 es .notdef),
+        # así los que la fuente no tiene (cuadro vacío, como en el PNG) también se extraen bien
+        codes = ''.join(f'{cids.setdefault(char, len(cids) + 1):04x}' for char in item.text)
+        # draw.text coloca (x, y) en la línea del ascendente; el PDF posiciona por la línea base
+        ascent = get_font(*item.font).getmetrics()[0]
+        x, y = self._xy(item.x, item.y + ascent, dx, dy)
+        color, _ = _color(item.fill)
+        size = _num(item.font.size * PX_TO_PT)
+        paint, after = f'{color} rg', ''
+        if outline:
+            # Contorno en un solo texto: modo 6 rellena, traza 2r alrededor del glifo y lo deja como
+            # recorte; el relleno se repinta dentro del recorte para quedar encima del trazo, como la
+            # dilatación del sprite. Así el título se extrae, copia o busca una sola vez.
+            paint = f'{color} rg {_color(outline)[0]} RG 6 Tr {_num(stroke * PX_TO_PT)} w 1 j'
+            after = f' 0 0 {_num(self._width * PX_TO_PT)} {_num(self._height * PX_TO_PT)} re f'
+        return f'q BT /{resource} {size} Tf {paint} {x} {y} Td <{codes}> Tj ET{after} Q'.encode('latin-1')
+
+    def _fill_rect(self, box, fill) -> bytes:
+        x0, y0, x1, y1 = box
+        color, alpha = _color(fill)
+        # draw.rectangle incluye el píxel final: ancho x1 - x0 + 1
+        left, bottom = self._xy(x0, y1 + 1)
+        width, height = _num((x1 - x0 + 1) * PX_TO_PT), _num((y1 - y0 + 1) * PX_TO_PT)
+        gs = f'/{self._alpha(alpha)} gs ' if alpha < 1 else ''
+        return f'q {gs}{color} rg {left} {bottom} {width} {height} re f Q'.encode('latin-1')
+
+    def _ellipse(self, item, dx, dy) -> bytes:
+        x0, y0, x1, y1 = item.box
+        inset = item.width / 2 if item.outline else 0
+        cx, cy = (x0 + x1 + 1) / 2 + dx, (y0 + y1 + 1) / 2 + dy
+        rx, ry = (x1 - x0 + 1) / 2 - inset, (y1 - y0 + 1) / 2 - inset
+        kx, ky = rx * KAPPA, ry * KAPPA
+        p = lambda x, y: ' '.join(self._xy(x, y))
+        path = (f'{p(cx + rx, cy)} m '
+                f'{p(cx + rx, cy + ky)} {p(cx + kx, cy + ry)} {p(cx, cy + ry)} c '
+                f'{p(cx - kx, cy + ry)} {p(cx - rx, cy + ky)} {p(cx - rx, cy)} c '
+                f'{p(cx - rx, cy - ky)} {p(cx - kx, cy - ry)} {p(cx, cy - ry)} c '
+                f'{p(cx + kx, cy - ry)} {p(cx + rx, cy - ky)} {p(cx + rx, cy)} c')
+        paint = []
+        if item.fill is not None:
+            paint.append(f'{_color(item.fill)[0]} rg')
+        if item.outline:
+            paint.append(f'{_color(item.outline)[0]} RG {_num(item.width * PX_TO_PT)} w')
+        op = 'B' if item.fill is not None and item.outline else 'S' if item.outline else 'f'
+        return f'q {" ".join(paint)} {path} {op} Q'.encode('latin-1')
+
+    def _draw_image(self, ops, img, slot):
+        """Incrusta la imagen con el mismo encuadre que el raster (cover recortado o stretch)"""
+        x0, y0, x1, y1 = slot.box
+        width, height = x1 - x0, y1 - y0
+        name = self._image(img, slot)
+        left, bottom = self._xy(x0, y1)
+        ops.append(f'q {_num(width * PX_TO_PT)} 0 0 {_num(height * PX_TO_PT)} {left} {bottom} cm /{name} Do Q'
+                   .encode('latin-1'))
+
+    # ------------------------------------------------------------------
+    # SERIALIZACIÓN
+    # ------------------------------------------------------------------
+
+    def _write_fonts(self) -> str:
+        entries = []
+        for path, (name, cids) in self._fonts.items():
+            ttf = truetype_font(path)
+            font_file = ttf.subset(cids)
+            file_id = self._stream(f'/Length1 {len(font_file)}', font_file)
+            # Prefijo de 6 letras obligatorio para fuentes en subconjunto, derivado de los glifos usados
+            digest = hashlib.md5(''.join(sorted(cids)).encode('utf-8')).digest()
+            tag = ''.join(chr(65 + b % 26) for b in digest[:6])
+            base_font = f'{tag}+{os.path.splitext(os.path.basename(path))[0]}'
+            descriptor = self._add(
+                (f'<< /Type /FontDescriptor /FontName /{base_font} /Flags 4 /FontBBox [{" ".join(map(str, ttf.bbox))}] '
+                 f'/ItalicAngle 0 /Ascent {ttf.ascent} /Descent {ttf.descent} /CapHeight {ttf.cap_height} '
+                 f'/StemV 80 /FontFile2 {file_id} 0 R >>').encode('latin-1'))
+            # CID -> glifo (CIDToGIDMap, 2 bytes por CID) y sus anchos, en el orden de asignación
+            gids = [0] + [ttf.glyph_id(ord(char)) for char in cids]
+            cid_to_gid = self._stream('', b''.join(gid.to_bytes(2, 'big') for gid in gids))
+            widths = ' '.join(str(ttf.width(gid)) for gid in gids[1:])
+            cid_font = self._add(
+                (f'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{base_font} '
+                 f'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+                 f'/FontDescriptor {descriptor} 0 R /DW {ttf.width(0)} /W [1 [{widths}]] '
+                 f'/CIDToGIDMap {cid_to_gid} 0 R >>').encode('latin-1'))
+            to_unicode = self._stream('', _to_unicode(cids))
+            font_id = self._add(
+                (f'<< /Type /Font /Subtype /Type0 /BaseFont /{base_font} /Encoding /Identity-H '
+                 f'/DescendantFonts [{cid_font} 0 R] /ToUnicode {to_unicode} 0 R >>').encode('latin-1'))
+            entries.append(f'/{name} {font_id} 0 R')
+        return ' '.join(entries)
+
+    def to_bytes(self) -> bytes:
+        fonts = self._write_fonts()
+        images = ' '.join(f'/{name} {object_id} 0 R' for name, object_id in self._image_objects.items())
+        states = ' '.join(f'/{name} << /ca {alpha} >>' for alpha, name in self._alphas.items())
+        resources = self._add(f'<< /Font << {fonts} >> /XObject << {images} >> /ExtGState << {states} >> >>'
+                              .encode('latin-1'))
+
+        page_ids = []
+        for (width, height), content in self._pages:
+            content_id = self._stream('', content)
+            page_ids.append(self._add(
+                (f'<< /Type /Page /Parent {self._pages_id} 0 R /MediaBox [0 0 {_num(width * PX_TO_PT)} '
+                 f'{_num(height * PX_TO_PT)}] /Resources {resources} 0 R /Contents {content_id} 0 R >>').encode('latin-1')))
+        kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+        self._add(f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode('latin-1'), self._pages_id)
+        catalog = self._add(f'<< /Type /Catalog /Pages {self._pages_id} 0 R >>'.encode('latin-1'))
+
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for object_id, body in enumerate(self._objects[1:], start=1):
+            offsets.append(len(out))
+            out += f'{object_id} 0 obj\n'.encode('latin-1') + body + b'\nendobj\n'
+        xref = len(out)
+        out += f'xref\n0 {len(self._objects)}\n0000000000 65535 f \n'.encode('latin-1')
+        out += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+        out += (f'trailer\n<< /Size {len(self._objects)} /Root {catalog} 0 R >>\n'
+                f'startxref\n{xref}\n%%EOF\n').encode('latin-1')
+        return bytes(out)
+
+
+@stage('encode')
+def render_pdf(pages) -> bytes:
+    """PDF con una página A4 por (display_list, images) de `pages`, en ese orden."""
+    document = PdfDocument()
+    for display_list, images in pages:
+        document.add_page(display_list, images)
+    return document.to_bytes()
@@ -0,0 +1,41 @@
+import json
+import os
+
+from render_cache import RenderCache
+
+# CONFIGURACIÓN (variables de entorno)
+# PREVIEW_DPI: resolución por defecto de las vistas previas
+# PREVIEW_QUALITY: calidad JPEG/WebP por defecto de las vistas previas
+# PREVIEW_STORE_MB: memoria para los pedidos de vista previa que luego se pueden renderizar completos por id
+PREVIEW_DPI = int(os.environ.get("PREVIEW_DPI", 72))
+PREVIEW_QUALITY = int(os.environ.get("PREVIEW_QUALITY", 75))
+PREVIEW_STORE_MB = int(os.environ.get("PREVIEW_STORE_MB", 64))
+
+# Campos de `info` del layout que se devuelven en la vista previa, con su nombre en la respuesta
+PREVIEW_FIELDS = {
+    'ficha': {'lines_total': 'lineas_total', 'lines_drawn': 'lineas_dibujadas', 'cut_text': 'corte'},
+    'hoja_preguntas': {'questions_total': 'preguntas_total', 'questions_drawn': 'preguntas_dibujadas'},
+}
+
+
+def pack_request(tipo: str, img_bytes: bytes, params: tuple) -> bytes:
+    """Pedido de render (tipo, imagen subida y parámetros) serializado: cabecera JSON y la imagen tal cual"""
+    head = json.dumps({'tipo': tipo, 'params': params}, ensure_ascii=False).encode('utf-8')
+    return head + b'\n' + img_bytes
+
+
+def unpack_request(data: bytes):
+    head, img_bytes = data.split(b'\n', 1)
+    request = json.loads(head)
+    return request['tipo'], img_bytes, tuple(request['params'])
+
+
+def preview_summary(tipo: str, info: dict) -> dict:
+    """Métricas del layout a 300 DPI para la respuesta de la vista previa (truncado, líneas o preguntas)"""
+    summary = {'truncado': info['truncated'], 'y_final': info['y_end'], 'y_max': info['max_height']}
+    summary.update({name: info[field] for field, name in PREVIEW_FIELDS[tipo].items()})
+    return summary
+
+
+# Solo en memoria: contiene las imágenes subidas y basta con que dure mientras se edita
+preview_store = RenderCache(memory_bytes=PREVIEW_STORE_MB * 1024 * 1024, directory=None)
@@ -0,0 +1,328 @@
+from functools import lru_cache
+from PIL import Image, ImageColor, ImageDraw
+import logging
+import math
+import os
+import time
+
+from fonts import get_font
+from image_cache import CONTENT_HASH, base_pages, derived_images
+from layout import Ellipse, ImageSlot, Layer, Line, OutlinedText, Rect, Stamp, TextRun, is_translucent
+from metrics import add_stage, stage
+from sprites import paste_outlined_text, sprite_for
+
+logger = logging.getLogger(__name__)
+
+# Capas decorativas pre-compuestas en memoria (borde ondulado, líneas de puntos, separadores)
+LAYER_CACHE_SIZE = int(os.environ.get("LAYER_CACHE_SIZE", 64))
+# Atlas de sellos pre-rasterizados (números de pregunta, Nombre/Fecha, letras capitales)
+STAMP_CACHE_SIZE = int(os.environ.get("STAMP_CACHE_SIZE", 512))
+# Margen del sprite de un sello alrededor de su caja (antialiasing y redondeos)
+STAMP_PADDING = 2
+
+
+def cover_image(img, width, height):
+    """
+    Escala la imagen para CUBRIR (width x height) y recorta el sobrante, centrado.
+    Solo se remuestrea la zona de la imagen que sobrevive al recorte (parámetro box de resize).
+    """
+    target_aspect = width / height
+    image_aspect = img.width / img.height
+
+    if image_aspect < target_aspect:
+        # La imagen es más "alta" (más estrecha) que el contenedor. Escalar por ancho.
+        new_width = width
+        new_height = int(width / image_aspect)
+
+        # Recortar verticalmente, centrado: (new_height - height) / 2
+        top_crop = max(0, (new_height - height) // 2)
+        scale = img.height / new_height
+        box = (0, top_crop * scale, img.width, (top_crop + height) * scale)
+        logger.info(f"📐 Imagen escalada por ancho y recortada verticalmente (cover centrado): top={top_crop}")
+        return img.resize((new_width, height), Image.Resampling.LANCZOS, box=box)
+    else:
+        # La imagen es más "ancha" (más baja) que el contenedor. Escalar por alto.
+        new_height = height
+        new_width = int(height * image_aspect)
+
+        # Recortar horizontalmente, centrado: (new_width - width) // 2
+        left_crop = max(0, (new_width - width) // 2)
+        scale = img.width / new_width
+        box = (left_crop * scale, 0, (left_crop + width) * scale, img.height)
+        logger.info(f"📐 Imagen escalada por alto y recortada horizontalmente (cover centrado): left={left_crop}")
+        return img.resize((width, new_height), Image.Resampling.LANCZOS, box=box)
+
+
+def stretch_image(img, width, height):
+    """Estira la imagen a (width x height) sin conservar proporción."""
+    logger.info(f"📐 Estirando imagen de fondo {img.width}x{img.height} a {width}x{height}")
+    return img.resize((width, height), Image.Resampling.LANCZOS)
+
+
+@stage('resize')
+def fit_image(img, slot: ImageSlot):
+    """
+    Redimensiona la imagen al slot. Las imágenes de load_image llevan el hash de la subida:
+    el resultado se guarda en derived_images y el mismo borde o cabecera no se remuestrea otra
+    vez. La imagen devuelta puede estar compartida: no se debe pintar encima sin copiarla.
+    """
+    x0, y0, x1, y1 = slot.box
+    content_hash = img.info.get(CONTENT_HASH)
+    key = (content_hash, img.mode, img.size, (x1 - x0, y1 - y0), slot.fit)
+    if content_hash:
+        fitted = derived_images.get(key)
+        if fitted is not None:
+            return fitted
+
+    if slot.fit == 'cover':
+        fitted = cover_image(img, x1 - x0, y1 - y0)
+    else:
+        fitted = stretch_image(img, x1 - x0, y1 - y0)
+    if content_hash:
+        derived_images.put(key, fitted)
+    return fitted
+
+
+def blend_rect(canvas, box, fill, band_height=256):
+    """
+    Compone un rectángulo semitransparente en el sitio, tocando solo su bbox.
+    Equivale a alpha_composite con una capa transparente del tamaño de la hoja, pero sin
+    reservar esa capa (35 MB a 300 DPI): la región se mezcla por franjas horizontales,
+    así que la memoria extra queda acotada aunque el rectángulo cubra casi toda la hoja.
+    """
+    x0, y0, x1, y1 = box
+    left, top = max(0, math.floor(x0)), max(0, math.floor(y0))
+    right, bottom = min(canvas.width, math.ceil(x1) + 1), min(canvas.height, math.ceil(y1) + 1)
+
+    for band_top in range(top, bottom, band_height):
+        band = (left, band_top, right, min(bottom, band_top + band_height))
+        # El rectángulo se dibuja sobre una tesela transparente del tamaño de la franja
+        tile = Image.new('RGBA', (band[2] - band[0], band[3] - band[1]), (255, 255, 255, 0))
+        ImageDraw.Draw(tile).rectangle((x0 - band[0], y0 - band[1], x1 - band[0], y1 - band[1]), fill=fill)
+
+        patch = canvas.crop(band)
+        if patch.mode != 'RGBA':
+            patch = patch.convert('RGBA')
+        patch = Image.alpha_composite(patch, tile)
+        if canvas.mode != 'RGBA':
+            patch = patch.convert(canvas.mode)
+        canvas.paste(patch, band[:2])
+
+
+def draw_item(draw, item):
+    """Dibuja una primitiva opaca (texto, elipse, rectángulo o línea)."""
+    if isinstance(item, TextRun):
+        draw.text((item.x, item.y), item.text, font=get_font(*item.font), fill=item.fill)
+    elif isinstance(item, Ellipse):
+        draw.ellipse(item.box, fill=item.fill, outline=item.outline, width=item.width)
+    elif isinstance(item, Rect):
+        draw.rectangle(item.box, fill=item.fill)
+    elif isinstance(item, Line):
+        draw.line(item.points, fill=item.fill, width=item.width)
+
+
+@lru_cache(maxsize=LAYER_CACHE_SIZE)
+def render_layer(size, items):
+    """Rasteriza una capa estática sobre fondo transparente (se construye una vez por contenido)."""
+    layer = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    for item in items:
+        draw_item(draw, item)
+    return layer
+
+
+def _stamp_box(item):
+    """Caja que ocupa un elemento de un sello (texto o elipse), en coordenadas de la página"""
+    if isinstance(item, TextRun):
+        left, top, right, bottom = get_font(*item.font).getbbox(item.text)
+        return item.x + left, item.y + top, item.x + right, item.y + bottom
+    x0, y0, x1, y1 = item.box
+    return x0, y0, x1 + 1, y1 + 1
+
+
+def _translate(item, dx, dy):
+    if isinstance(item, TextRun):
+        return item._replace(x=item.x + dx, y=item.y + dy)
+    x0, y0, x1, y1 = item.box
+    return item._replace(box=(x0 + dx, y0 + dy, x1 + dx, y1 + dy))
+
+
+@lru_cache(maxsize=STAMP_CACHE_SIZE)
+def stamp_sprite(items):
+    """
+    Rasteriza un sello (elipses y textos con origen en 0, 0) como sprite RGBA.
+    El fondo transparente lleva el color del texto: pegado con su alpha como máscara, el
+    antialiasing del texto que sale del círculo mezcla con la hoja igual que draw.text.
+    Devuelve (sprite, (dx, dy)): el sprite se pega en el origen del sello + (dx, dy).
+    """
+    boxes = [_stamp_box(item) for item in items]
+    # Nunca a la derecha ni debajo del origen: con coordenadas negativas draw.text trunca hacia
+    # cero y el glifo se desplazaría un píxel respecto al dibujado directo sobre la hoja
+    left = min(0, math.floor(min(box[0] for box in boxes)) - STAMP_PADDING)
+    top = min(0, math.floor(min(box[1] for box in boxes)) - STAMP_PADDING)
+    right = math.ceil(max(box[2] for box in boxes)) + STAMP_PADDING
+    bottom = math.ceil(max(box[3] for box in boxes)) + STAMP_PADDING
+
+    ink = next((item.fill for item in reversed(items) if isinstance(item, TextRun)), 'black')
+    sprite = Image.new('RGBA', (right - left, bottom - top), ImageColor.getrgb(ink)[:3] + (0,))
+    draw = ImageDraw.Draw(sprite)
+    for item in items:
+        draw_item(draw, _translate(item, -left, -top))
+    return sprite, (left, top)
+
+
+def stamp_for(item):
+    """Sprite de un Stamp de la display list y la posición donde pegarlo"""
+    # Origen entero por las posiciones de los items (sin medir texto): las fracciones de
+    # posición, y con ellas el antialiasing, se conservan en la clave del atlas
+    anchors = [(child.x, child.y) if isinstance(child, TextRun) else child.box[:2] for child in item.items]
+    x0 = math.floor(min(x for x, _ in anchors))
+    y0 = math.floor(min(y for _, y in anchors))
+    sprite, (dx, dy) = stamp_sprite(tuple(_translate(child, -x0, -y0) for child in item.items))
+    return sprite, (x0 + dx, y0 + dy)
+
+
+def paste_stamp(canvas, item):
+    """Pega un Stamp de la display list con una sola operación."""
+    sprite, dest = stamp_for(item)
+    if canvas.mode == 'RGBA':
+        canvas.alpha_composite(sprite, dest)
+    else:
+        canvas.paste(sprite, dest, sprite)
+
+
+def prebuild(display_list):
+    """Construye de antemano las capas, sprites y sellos estáticos de una display list (arranque)."""
+    for item in display_list.items:
+        if isinstance(item, Layer):
+            render_layer(item.size, item.items)
+        elif isinstance(item, OutlinedText):
+            sprite_for(item)
+        elif isinstance(item, Stamp):
+            stamp_for(item)
+
+
+def has_alpha(img) -> bool:
+    return img.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in img.info
+
+
+def _draw_items(canvas, items, images, last_translucent, spent):
+    """Dibuja los elementos sobre el lienzo, en orden; devuelve el lienzo (ya en RGB)."""
+    draw = ImageDraw.Draw(canvas)
+    for i, item in enumerate(items):
+        start = time.perf_counter()
+        if isinstance(item, Rect) and is_translucent(item):
+            blend_rect(canvas, item.box, item.fill)
+            if i == last_translucent:
+                # Convertir RGBA -> RGB antes del dibujado principal
+                canvas = canvas.convert('RGB')
+                draw = ImageDraw.Draw(canvas)
+            spent_on = 'composite'
+        elif isinstance(item, Layer):
+            # Capa estática pre-compuesta: una sola pegada con su máscara
+            layer = render_layer(item.size, item.items)
+            if canvas.mode == 'RGBA':
+                canvas.alpha_composite(layer, (item.x, item.y))
+            else:
+                canvas.paste(layer, (item.x, item.y), layer)
+            spent_on = 'decorations'
+        elif isinstance(item, OutlinedText):
+            # Sprite cacheado: una sola pegada en vez de redibujar el texto por cada desplazamiento
+            paste_outlined_text(canvas, item)
+            spent_on = 'text_draw'
+        elif isinstance(item, Stamp):
+            # Sello del atlas (número, etiqueta, capital): una pegada, sin FreeType por petición
+            paste_stamp(canvas, item)
+            spent_on = 'text_draw'
+        elif isinstance(item, ImageSlot):
+            # fit_image cuenta como 'resize'; aquí solo la pegada
+            img = fit_image(images[item.name], item)
+            start = time.perf_counter()
+            canvas.paste(img, item.box[:2])
+            spent_on = 'composite'
+        else:
+            draw_item(draw, item)
+            spent_on = 'text_draw' if isinstance(item, TextRun) else 'decorations'
+        spent[spent_on] += time.perf_counter() - start
+    return canvas
+
+
+def _rasterize(display_list, images, spent):
+    background = display_list.background
+
+    fitted = None
+    if isinstance(background, ImageSlot):
+        canvas = fitted = fit_image(images[background.name], background)
+    else:
+        canvas = Image.new('RGB', display_list.size, background)
+
+    start = time.perf_counter()
+    items = display_list.items
+    last_translucent = -1
+    if has_alpha(canvas):
+        # Fondo con transparencia: las capas se componen sobre su alpha, que se descarta al final
+        if canvas.mode != 'RGBA':
+            canvas = canvas.convert('RGBA')
+        last_translucent = max((i for i, item in enumerate(items) if is_translucent(item)), default=-1)
+    # Fondo opaco: todo se dibuja directamente en RGB, sin canvas RGBA de hoja completa
+    if last_translucent == -1 and canvas.mode != 'RGB':
+        canvas = canvas.convert('RGB')
+    if canvas is fitted:
+        # El fondo redimensionado puede estar en la caché de derived_images: se pinta sobre una copia
+        canvas = canvas.copy()
+    spent['composite'] += time.perf_counter() - start
+
+    return _draw_items(canvas, items, images, last_translucent, spent)
+
+
+def _base_page(display_list, images, count, spent):
+    """
+    Los `count` primeros elementos de la página (la parte que no cambia entre variantes,
+    p. ej. borde, capa blanca, encabezado y Nombre/Fecha de la hoja) ya rasterizados, de
+    base_pages. None si no se puede cachear: detrás quedan capas translúcidas, la base lleva
+    imágenes o el fondo no viene de load_image (sin hash de la subida).
+    """
+    items = display_list.items
+    base, rest = items[:count], items[count:]
+    if any(isinstance(item, ImageSlot) for item in base) or any(is_translucent(item) for item in rest):
+        return None
+    background = display_list.background
+    source = None
+    if isinstance(background, ImageSlot):
+        img = images[background.name]
+        if not img.info.get(CONTENT_HASH):
+            return None
+        source = (img.info[CONTENT_HASH], img.mode, img.size)
+
+    key = (source, display_list.size, background, base)
+    canvas = base_pages.get(key)
+    if canvas is None:
+        canvas = _rasterize(display_list._replace(items=base), images, spent)
+        base_pages.put(key, canvas)
+    return canvas
+
+
+def rasterize(display_list, images=None):
+    """
+    Dibuja una display list y devuelve la imagen RGB.
+    `images` asocia el nombre de cada ImageSlot con la imagen ya decodificada.
+    Si `info['base_items']` marca una base estática, se parte de una copia de la base cacheada
+    y solo se dibuja el resto.
+    """
+    images = images or {}
+    # Tiempo por etapa: texto, decoraciones y composición (fondo, capas translúcidas, imágenes)
+    spent = {'composite': 0.0, 'text_draw': 0.0, 'decorations': 0.0}
+
+    count = display_list.info.get('base_items', 0)
+    base = _base_page(display_list, images, count, spent) if count else None
+    if base is not None:
+        start = time.perf_counter()
+        canvas = base.copy()
+        spent['composite'] += time.perf_counter() - start
+        canvas = _draw_items(canvas, display_list.items[count:], images, -1, spent)
+    else:
+        canvas = _rasterize(display_list, images, spent)
+
+    for name, seconds in spent.items():
+        add_stage(name, seconds)
+    return canvas
@@ -0,0 +1,189 @@
+from PIL import Image
+import json
+import logging
+
+import fonts
+import pdf_writer
+import svg_writer
+from encoding import PNG_COMPRESS_LEVEL, VECTOR_FORMATS, encode_image
+from image_loader import load_image
+from layout import (DPI, FICHA_TEXT_SIZE, HOJA_TEXT_SIZE, Stamp, fit_text_size, layout_ficha, layout_ficha_pages,
+                    layout_hoja_preguntas, layout_hoja_preguntas_pages, scale_display_list)
+from rasterizer import prebuild, rasterize, stamp_for
+
+logger = logging.getLogger(__name__)
+
+# Atlas de sellos pre-rasterizado al arrancar: números de pregunta y letras capitales
+ATLAS_NUMBERS = 50
+DROP_CAP_LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZÁÉÍÓÚÜÑ'
+
+
+def warm_up():
+    """
+    Precarga fuentes y pre-construye las decoraciones estáticas del estilo infantil
+    (borde ondulado, separador, líneas de puntos de los 4 colores, encabezado con contorno).
+    Se llama al arrancar y en cada worker del pool.
+    """
+    fonts.warm_up()
+    prebuild(layout_ficha('', '', 'infantil', 1150))
+    prebuild(layout_hoja_preguntas(json.dumps(['?'] * 4), '', 'infantil'))
+    build_atlas()
+
+
+def build_atlas():
+    """
+    Pre-rasteriza los sellos a 300 DPI: círculos (infantil) y números (clásico) del 1 al
+    ATLAS_NUMBERS, Nombre/Fecha y las letras capitales A-Z y mayúsculas acentuadas.
+    Se sacan de los layouts reales, así la posición y el tamaño coinciden con los de la hoja.
+    """
+    for estilo in ('infantil', 'clasico'):
+        for page in layout_hoja_preguntas_pages(json.dumps(['?'] * ATLAS_NUMBERS), '', estilo):
+            prebuild(page)
+    # Misma fuente y color en ambos estilos: basta una capital de muestra y cambiar la letra
+    ficha = layout_ficha('', 'A', 'infantil', 1150)
+    drop_cap = next(item for item in ficha.items if isinstance(item, Stamp))
+    for letter in DROP_CAP_LETTERS:
+        stamp_for(Stamp(tuple(run._replace(text=letter) for run in drop_cap.items)))
+
+
+def _encode_page(display_list, images: dict, fmt: str, compresion, escala: float) -> bytes:
+    """Rasteriza y codifica la página, o la emite como SVG directamente desde la display list"""
+    dpi = round(DPI * escala)
+    if fmt in VECTOR_FORMATS:
+        return svg_writer.render_svg(display_list, images, dpi)
+    return encode_image(rasterize(display_list, images), fmt, compresion, dpi)
+
+
+def render_ficha(img, texto_cuento: str, titulo: str, header_height: int, estilo: str,
+                 fmt: str = 'png', compresion=PNG_COMPRESS_LEVEL, escala: float = 1.0,
+                 text_size: int = FICHA_TEXT_SIZE) -> bytes:
+    """
+    Renderiza la ficha de lectura y devuelve la imagen codificada (PNG, JPEG, WebP o SVG).
+    Es síncrona a propósito: se ejecuta en el pool de renderizado, fuera del event loop.
+    `img` son los bytes subidos o una imagen ya decodificada con load_image (lotes).
+    `escala` < 1 da una vista previa con los mismos saltos de línea que la versión a 300 DPI.
+    """
+    display_list = scale_display_list(layout_ficha(titulo, texto_cuento, estilo, header_height, text_size), escala)
+    header_img = img if isinstance(img, Image.Image) else load_image(img, display_list.slot('header'), 'RGB')
+
+    return _encode_page(display_list, {'header': header_img}, fmt, compresion, escala)
+
+
+def render_hoja_preguntas(img, preguntas: str, titulo_cuento: str, estilo: str,
+                          fmt: str = 'png', compresion=PNG_COMPRESS_LEVEL, escala: float = 1.0,
+                          text_size: int = HOJA_TEXT_SIZE) -> bytes:
+    """
+    Renderiza la hoja de preguntas y devuelve la imagen codificada (PNG, JPEG, WebP o SVG).
+    Es síncrona a propósito: se ejecuta en el pool de renderizado, fuera del event loop.
+    `img` son los bytes subidos o una imagen ya decodificada con load_image (lotes).
+    `escala` < 1 da una vista previa con los mismos saltos de línea que la versión a 300 DPI.
+    """
+    display_list = scale_display_list(layout_hoja_preguntas(preguntas, titulo_cuento, estilo, text_size), escala)
+    # Leer imagen del borde, reducida al decodificar hasta cerca del tamaño A4
+    border_img = img if isinstance(img, Image.Image) else load_image(img, display_list.slot('border'))
+    return _encode_page(display_list, {'border': border_img}, fmt, compresion, escala)
+
+
+def ficha_page_count(texto_cuento: str, titulo: str, header_height: int, estilo: str,
+                     text_size: int = FICHA_TEXT_SIZE) -> tuple:
+    """
+    (páginas, si se truncó en MAX_PAGES) de la ficha paginada. Calcula el layout de todas de una vez;
+    luego cada página lo reutiliza.
+    """
+    pages = layout_ficha_pages(titulo, texto_cuento, estilo, header_height, text_size)
+    return len(pages), pages[-1].info['truncated']
+
+
+def hoja_preguntas_page_count(preguntas: str, titulo_cuento: str, estilo: str,
+                              text_size: int = HOJA_TEXT_SIZE) -> tuple:
+    """(páginas, si se truncó en MAX_PAGES) de la hoja de preguntas paginada"""
+    pages = layout_hoja_preguntas_pages(preguntas, titulo_cuento, estilo, text_size)
+    return len(pages), pages[-1].info['truncated']
+
+
+def render_ficha_page(img, texto_cuento: str, titulo: str, header_height: int, estilo: str, page: int,
+                      fmt: str = 'png', compresion=PNG_COMPRESS_LEVEL, escala: float = 1.0,
+                      text_size: int = FICHA_TEXT_SIZE) -> bytes:
+    """
+    Página `page` (desde 0) de la ficha paginada. Solo la primera lleva la cabecera,
+    así que en las demás la imagen subida ni se decodifica.
+    """
+    pages = layout_ficha_pages(titulo, texto_cuento, estilo, header_height, text_size)
+    display_list = scale_display_list(pages[page], escala)
+    images = {}
+    if page == 0:
+        images['header'] = img if isinstance(img, Image.Image) else load_image(img, display_list.slot('header'), 'RGB')
+    return _encode_page(display_list, images, fmt, compresion, escala)
+
+
+def render_hoja_preguntas_page(img, preguntas: str, titulo_cuento: str, estilo: str, page: int,
+                               fmt: str = 'png', compresion=PNG_COMPRESS_LEVEL, escala: float = 1.0,
+                               text_size: int = HOJA_TEXT_SIZE) -> bytes:
+    """Página `page` (desde 0) de la hoja de preguntas paginada; todas llevan el borde"""
+    pages = layout_hoja_preguntas_pages(preguntas, titulo_cuento, estilo, text_size)
+    display_list = scale_display_list(pages[page], escala)
+    border_img = img if isinstance(img, Image.Image) else load_image(img, display_list.slot('border'))
+    return _encode_page(display_list, {'border': border_img}, fmt, compresion, escala)
+
+
+def render_ficha_pdf(img, texto_cuento: str, titulo: str, header_height: int, estilo: str,
+                     text_size: int = FICHA_TEXT_SIZE) -> bytes:
+    """Ficha paginada como un único PDF vectorial, una página A4 por página del layout"""
+    pages = layout_ficha_pages(titulo, texto_cuento, estilo, header_height, text_size)
+    header = img if isinstance(img, Image.Image) else load_image(img, pages[0].slot('header'), 'RGB')
+    return pdf_writer.render_pdf([(page, {'header': header} if n == 0 else {}) for n, page in enumerate(pages)])
+
+
+def render_hoja_preguntas_pdf(img, preguntas: str, titulo_cuento: str, estilo: str,
+                              text_size: int = HOJA_TEXT_SIZE) -> bytes:
+    """Hoja de preguntas paginada como un único PDF; el borde se incrusta una vez y se reutiliza"""
+    pages = layout_hoja_preguntas_pages(preguntas, titulo_cuento, estilo, text_size)
+    border = img if isinstance(img, Image.Image) else load_image(img, pages[0].slot('border'))
+    return pdf_writer.render_pdf([(page, {'border': border}) for page in pages])
+
+
+def _fit_summary(display_list) -> dict:
+    info = display_list.info
+    return {'text_size': info['text_size'], 'line_spacing': info['line_spacing'], 'truncated': info['truncated']}
+
+
+def fit_ficha(texto_cuento: str, titulo: str, header_height: int, estilo: str) -> dict:
+    """Modo `ajustar`: tamaño de letra e interlineado con los que cabe todo el cuento (solo mide texto)"""
+    size = fit_text_size(layout_ficha, FICHA_TEXT_SIZE, titulo, texto_cuento, estilo, header_height)
+    return _fit_summary(layout_ficha(titulo, texto_cuento, estilo, header_height, size))
+
+
+def fit_hoja_preguntas(preguntas: str, titulo_cuento: str, estilo: str) -> dict:
+    """Modo `ajustar`: tamaño de letra e interlineado con los que caben todas las preguntas"""
+    size = fit_text_size(layout_hoja_preguntas, HOJA_TEXT_SIZE, preguntas, titulo_cuento, estilo)
+    return _fit_summary(layout_hoja_preguntas(preguntas, titulo_cuento, estilo, size))
+
+
+def preview_ficha(img, texto_cuento: str, titulo: str, header_height: int, estilo: str,
+                  fmt: str, compresion, escala: float):
+    """Vista previa de la ficha: imagen reducida y la `info` del layout a 300 DPI (líneas, truncado)"""
+    image_bytes = render_ficha(img, texto_cuento, titulo, header_height, estilo, fmt, compresion, escala)
+    return image_bytes, dict(layout_ficha(titulo, texto_cuento, estilo, header_height).info)
+
+
+def preview_hoja_preguntas(img, preguntas: str, titulo_cuento: str, estilo: str,
+                           fmt: str, compresion, escala: float):
+    """Vista previa de la hoja de preguntas: imagen reducida y la `info` del layout (preguntas, truncado)"""
+    image_bytes = render_hoja_preguntas(img, preguntas, titulo_cuento, estilo, fmt, compresion, escala)
+    return image_bytes, dict(layout_hoja_preguntas(preguntas, titulo_cuento, estilo).info)
+
+
+def render_pdf(header, border, texto_cuento: str, titulo: str, header_height: int, estilo: str,
+               preguntas: str, titulo_cuento: str) -> bytes:
+    """
+    Ficha de lectura y hoja de preguntas en un único PDF A4 de dos páginas.
+    Usa las mismas display lists que el PNG, pero el texto va como texto real (fuentes
+    incrustadas en subconjunto) y las formas como vectores: no se rasteriza la página.
+    """
+    ficha = layout_ficha(titulo, texto_cuento, estilo, header_height)
+    hoja = layout_hoja_preguntas(preguntas, titulo_cuento, estilo)
+    if not isinstance(header, Image.Image):
+        header = load_image(header, ficha.slot('header'), 'RGB')
+    if not isinstance(border, Image.Image):
+        border = load_image(border, hoja.slot('border'))
+    return pdf_writer.render_pdf([(ficha, {'header': header}), (hoja, {'border': border})])
@@ -0,0 +1,199 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURACIÓN (variables de entorno)
+# RENDER_CACHE_MEMORY_MB: renders (PNG, JPEG, WebP, SVG o PDF) que se guardan en memoria (LRU por bytes)
+# RENDER_CACHE_DIR: directorio de la caché en disco ("" la desactiva)
+# RENDER_CACHE_DISK_MB: tamaño máximo de la caché en disco (LRU por fecha de último uso)
+RENDER_CACHE_MEMORY_MB = int(os.environ.get("RENDER_CACHE_MEMORY_MB", 128))
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", "/tmp/render-cache")
+RENDER_CACHE_DISK_MB = int(os.environ.get("RENDER_CACHE_DISK_MB", 1024))
+
+
+def render_key(*parts) -> str:
+    """
+    Hash del contenido de una petición de render (imagen + parámetros).
+    Cada parte lleva su longitud delante para que ('ab', 'c') y ('a', 'bc') no colisionen.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    Caché de bytes por hash de contenido (renders en cualquier formato, imágenes subidas), en dos niveles:
+    memoria (LRU acotada en bytes) y disco (LRU acotada en bytes, sobrevive a reinicios).
+    Un acierto en disco se promueve a memoria.
+
+    `get` y `put` son corrutinas: la memoria se consulta en línea y la lectura y escritura
+    en disco van a un hilo (asyncio.to_thread), sin el lock tomado, para que una entrada de
+    decenas de MB no detenga el event loop ni a las demás peticiones.
+    """
+
+    def __init__(self, memory_bytes=RENDER_CACHE_MEMORY_MB * 1024 * 1024, directory=RENDER_CACHE_DIR,
+                 disk_bytes=RENDER_CACHE_DISK_MB * 1024 * 1024):
+        self.memory_bytes = memory_bytes
+        self.directory = directory or None
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._writing = set()  # claves que se están escribiendo en disco
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self._load_disk_index()
+            except OSError as e:
+                logger.error(f"❌ Caché de renders en disco desactivada ({self.directory}): {e}")
+                self.directory = None
+
+    def _path(self, key: str) -> str:
+        # .bin: el contenido puede ser PNG, JPEG, WebP, SVG, PDF o una imagen subida; el tipo lo da la clave
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _load_disk_index(self):
+        """Reconstruye el índice LRU del disco a partir de las fechas de último uso."""
+        entries = []
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if name.startswith('.') or ext not in ('.bin', '.png'):
+                continue
+            if ext == '.png':
+                # Entrada de una versión anterior (todo se guardaba como .png): se renombra, no se pierde
+                try:
+                    os.replace(os.path.join(self.directory, name), self._path(key))
+                except OSError:
+                    continue
+            stat = os.stat(self._path(key))
+            entries.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        if entries:
+            logger.info(f"💾 Caché en disco ({self.directory}): {len(self._disk)} entradas, {self._disk_size / 1e6:.1f} MB")
+
+    async def get(self, key: str):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+            on_disk = self.directory is not None and key in self._disk
+
+        if on_disk:
+            data = await asyncio.to_thread(self._read_disk, key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+            return data
+
+    def contains(self, key: str) -> bool:
+        """Si la clave está en memoria o en disco, sin contar acierto ni fallo ni mover el LRU"""
+        with self._lock:
+            return key in self._memory or (self.directory is not None and key in self._disk)
+
+    def _read_disk(self, key: str):
+        """Lee una entrada del disco y la promueve a memoria (en un hilo: sin el lock durante la lectura)"""
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                if key in self._disk:
+                    self._disk_size -= self._disk.pop(key)
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._remember(key, data)
+        return data
+
+    async def put(self, key: str, data: bytes):
+        with self._lock:
+            self._remember(key, data)
+            if not self.directory or key in self._disk or key in self._writing:
+                return
+            # Las peticiones idénticas que esperaban el mismo render lo guardan una sola vez
+            self._writing.add(key)
+        try:
+            await asyncio.to_thread(self._write_disk, key, data)
+        finally:
+            with self._lock:
+                self._writing.discard(key)
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        if key not in self._memory:
+            self._memory_size += len(data)
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _write_disk(self, key, data):
+        # Escritura atómica: una entrada a medio escribir nunca se sirve
+        tmp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.error(f"❌ No se pudo guardar el render en caché: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk[key] = len(data)
+            self._disk_size += len(data)
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                old, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_mb": round(self._memory_size / 1e6, 1),
+                "disk_entries": len(self._disk),
+                "disk_mb": round(self._disk_size / 1e6, 1),
+            }
+
+
+render_cache = RenderCache()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import collect_stages, observe_stages
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURACIÓN (variables de entorno)
+# RENDER_POOL: "thread" (por defecto) o "process" para escalar con los núcleos
+# RENDER_WORKERS: renders simultáneos (por defecto, número de CPUs)
+# RENDER_QUEUE_SIZE: renders que pueden esperar turno antes de responder 503
+# RENDER_RETRY_AFTER: segundos sugeridos al cliente en la cabecera Retry-After
+RENDER_POOL = os.environ.get("RENDER_POOL", "thread")
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_QUEUE_SIZE = int(os.environ.get("RENDER_QUEUE_SIZE", RENDER_WORKERS * 2))
+RENDER_RETRY_AFTER = int(os.environ.get("RENDER_RETRY_AFTER", 5))
+
+
+class RenderQueueFull(Exception):
+    """La cola de renderizado está llena; el cliente debe reintentar más tarde."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Cola de renderizado llena, reintentar en {retry_after}s")
+        self.retry_after = retry_after
+
+
+class RenderPool:
+    """
+    Pool acotado de workers para el renderizado síncrono con Pillow.
+    Admite como máximo `workers + queue_size` trabajos a la vez (en curso + en espera);
+    por encima de eso `run` lanza RenderQueueFull en lugar de encolar sin límite.
+    """
+
+    def __init__(self, kind=RENDER_POOL, workers=RENDER_WORKERS, queue_size=RENDER_QUEUE_SIZE,
+                 retry_after=RENDER_RETRY_AFTER, initializer=None):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"RENDER_POOL inválido: {kind!r} (usar 'thread' o 'process')")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.retry_after = retry_after
+        self.initializer = initializer
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render",
+                                                initializer=self.initializer)
+        logger.info(f"🧵 Pool de renderizado '{self.kind}' iniciado: {self.workers} workers, cola={self.queue_size}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self) -> int:
+        """Trabajos admitidos que aún no han terminado (en curso + en cola)"""
+        return self._pending
+
+    @property
+    def queue_depth(self) -> int:
+        """Trabajos esperando un worker libre"""
+        return max(0, self._pending - self.workers)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        """
+        Ejecuta fn(*args) en el pool y espera su resultado sin bloquear el event loop.
+        Los tiempos por etapa medidos en el worker se registran aquí, en el proceso principal.
+        """
+        if self._executor is None:
+            self.start()
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                raise RenderQueueFull(self.retry_after)
+            self._pending += 1
+        try:
+            future = self._executor.submit(collect_stages, fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # El hueco se libera cuando el trabajo termina de verdad, aunque el cliente se haya ido
+        future.add_done_callback(self._release)
+        result, stages = await asyncio.wrap_future(future)
+        observe_stages(stages)
+        return result
@@ -0,0 +1,63 @@
+from functools import lru_cache
+from PIL import Image, ImageChops, ImageDraw
+import math
+import os
+
+from fonts import get_font
+
+# Sprites de texto con contorno en memoria (títulos y encabezados recientes)
+SPRITE_CACHE_SIZE = int(os.environ.get("SPRITE_CACHE_SIZE", 256))
+
+
+def ring_offsets(outline_width):
+    """Desplazamientos del contorno circular: el cuadrado (2r+1)² menos el disco interior"""
+    r = outline_width
+    return [(dx, dy) for dx in range(-r, r + 1) for dy in range(-r, r + 1) if dx * dx + dy * dy >= r * r]
+
+
+@lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def outlined_text_sprite(text, font_spec, fill, outline, outline_width, frac=(0.0, 0.0)):
+    """
+    Texto con contorno pre-renderizado como sprite RGBA.
+
+    El texto se rasteriza una sola vez como máscara; el contorno es la unión (screen) de esa
+    máscara desplazada por el anillo, que equivale a dibujar el texto en cada desplazamiento.
+    Devuelve (sprite, (dx, dy)): el sprite se pega en (int(x) + dx, int(y) + dy).
+    `frac` es la parte fraccionaria de la posición, para conservar el mismo antialiasing.
+    """
+    font = get_font(*font_spec)
+    left, top, right, bottom = font.getbbox(text)
+    pad = outline_width + 1
+    size = (right - left + 2 * pad, bottom - top + 2 * pad)
+    origin = (pad - left, pad - top)
+
+    mask = Image.new('L', size, 0)
+    ImageDraw.Draw(mask).text((origin[0] + frac[0], origin[1] + frac[1]), text, font=font, fill=255)
+
+    # Dilatación por el anillo (el relleno `pad` evita que ImageChops.offset arrastre píxeles del borde)
+    ring = Image.new('L', size, 0)
+    for dx, dy in ring_offsets(outline_width):
+        ring = ImageChops.screen(ring, ImageChops.offset(mask, dx, dy))
+
+    outline_layer = Image.new('RGBA', size, outline)
+    outline_layer.putalpha(ring)
+    fill_layer = Image.new('RGBA', size, fill)
+    fill_layer.putalpha(mask)
+    return Image.alpha_composite(outline_layer, fill_layer), (-origin[0], -origin[1])
+
+
+def sprite_for(item):
+    """Sprite de un OutlinedText de la display list y la posición donde pegarlo"""
+    x0, y0 = math.floor(item.x), math.floor(item.y)
+    frac = (round(item.x - x0, 3), round(item.y - y0, 3))
+    sprite, (dx, dy) = outlined_text_sprite(item.text, item.font, item.fill, item.outline, item.outline_width, frac)
+    return sprite, (x0 + dx, y0 + dy)
+
+
+def paste_outlined_text(canvas, item):
+    """Pega un OutlinedText de la display list con una sola operación."""
+    sprite, dest = sprite_for(item)
+    if canvas.mode == 'RGBA':
+        canvas.alpha_composite(sprite, dest)
+    else:
+        canvas.paste(sprite, dest, sprite)
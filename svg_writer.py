@@ -0,0 +1,166 @@
+import base64
+import io
+import os
+from xml.sax.saxutils import escape
+
+from font_subset import WEB_FONT_TABLES, truetype_font
+from fonts import get_font
+from layout import DPI, Ellipse, ImageSlot, Layer, Line, OutlinedText, Rect, Stamp, TextRun
+from metrics import stage
+from rasterizer import fit_image, has_alpha
+
+# Calidad JPEG de las imágenes incrustadas en el SVG (las que tienen transparencia van en PNG)
+SVG_IMAGE_QUALITY = int(os.environ.get("SVG_IMAGE_QUALITY", 90))
+# Incrustar las fuentes (subconjunto) para que el SVG se vea igual sin DejaVu instalada
+SVG_EMBED_FONTS = os.environ.get("SVG_EMBED_FONTS", "1") not in ("0", "false", "no")
+
+# Familias, grosor y estilo de respaldo de cada TTF si el visor no carga la fuente incrustada
+FALLBACK_FONTS = {
+    'DejaVuSans': ("'DejaVu Sans', sans-serif", None, None),
+    'DejaVuSans-Bold': ("'DejaVu Sans', sans-serif", 'bold', None),
+    'DejaVuSans-Oblique': ("'DejaVu Sans', sans-serif", None, 'italic'),
+    'DejaVuSans-BoldOblique': ("'DejaVu Sans', sans-serif", 'bold', 'italic'),
+    'DejaVuSerif-Bold': ("'DejaVu Serif', serif", 'bold', None),
+}
+DEFAULT_FALLBACK = ('sans-serif', None, None)
+
+
+def _num(value) -> str:
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+
+def _paint(fill, attribute='fill') -> str:
+    """Color de la display list (nombre, #hex o tupla) como atributos SVG"""
+    if isinstance(fill, str):
+        return f'{attribute}="{fill}"'
+    r, g, b, *alpha = fill
+    paint = f'{attribute}="rgb({r},{g},{b})"'
+    if alpha and alpha[0] < 255:
+        paint += f' {attribute}-opacity="{_num(alpha[0] / 255)}"'
+    return paint
+
+
+class SvgDocument:
+    """
+    SVG de una página a partir de su display list: texto, rectángulos, elipses y líneas como
+    elementos vectoriales, y cada imagen incrustada una sola vez a su resolución final.
+    Las capas que se repiten (líneas de puntos de un mismo largo y color) se definen una
+    vez en <defs> y se reutilizan con <use>.
+    """
+
+    def __init__(self, display_list, images=None, dpi=DPI):
+        self.display_list = display_list
+        self.images = images or {}
+        self.dpi = dpi
+        self._fonts = {}  # ruta -> (familia, caracteres usados)
+        self._layers = {}  # (tamaño, items) -> id
+        self._defs = []
+
+    def _font_family(self, spec) -> str:
+        if spec.path not in self._fonts:
+            self._fonts[spec.path] = (f'F{len(self._fonts) + 1}', set())
+        return self._fonts[spec.path][0]
+
+    def _text(self, item, paint: str) -> str:
+        family = self._font_family(item.font)
+        self._fonts[item.font.path][1].update(item.text)
+        fallback, weight, style = FALLBACK_FONTS.get(os.path.splitext(os.path.basename(item.font.path))[0],
+                                                     DEFAULT_FALLBACK)
+        font = f'font-family="{family}, {fallback}"'
+        if weight:
+            font += f' font-weight="{weight}"'
+        if style:
+            font += f' font-style="{style}"'
+        # draw.text coloca (x, y) en la línea del ascendente; SVG posiciona por la línea base
+        ascent = get_font(*item.font).getmetrics()[0]
+        return (f'<text x="{_num(item.x)}" y="{_num(item.y + ascent)}" {font} '
+                f'font-size="{item.font.size}" {paint}>{escape(item.text)}</text>')
+
+    def _image(self, img, slot) -> str:
+        x0, y0, x1, y1 = slot.box
+        # A su resolución final: si la subida es mayor que el hueco se usa el mismo fit_image del raster
+        if slot.fit == 'cover' or img.width > x1 - x0 or img.height > y1 - y0:
+            img = fit_image(img, slot)
+        buffer = io.BytesIO()
+        if has_alpha(img):
+            img.convert('RGBA').save(buffer, format='PNG')
+            media_type = 'image/png'
+        else:
+            img.convert('RGB').save(buffer, format='JPEG', quality=SVG_IMAGE_QUALITY)
+            media_type = 'image/jpeg'
+        data = base64.b64encode(buffer.getvalue()).decode('ascii')
+        return (f'<image x="{x0}" y="{y0}" width="{x1 - x0}" height="{y1 - y0}" preserveAspectRatio="none" '
+                f'xlink:href="data:{media_type};base64,{data}"/>')
+
+    def _element(self, item) -> str:
+        if isinstance(item, TextRun):
+            return self._text(item, _paint(item.fill))
+        if isinstance(item, OutlinedText):
+            # Trazo de 2r debajo del relleno, como la dilatación del sprite. Dos <text> en vez de
+            # paint-order porque no todos los visores lo soportan; la copia del trazo se oculta
+            # a lectores de pantalla
+            stroke = self._text(item, f'fill="none" {_paint(item.outline, "stroke")} stroke-width="{item.outline_width * 2}" '
+                                      f'stroke-linejoin="round" aria-hidden="true"')
+            return stroke + self._text(item, _paint(item.fill))
+        if isinstance(item, Rect):
+            # draw.rectangle incluye el píxel final: ancho x1 - x0 + 1
+            x0, y0, x1, y1 = item.box
+            return (f'<rect x="{_num(x0)}" y="{_num(y0)}" width="{_num(x1 - x0 + 1)}" height="{_num(y1 - y0 + 1)}" '
+                    f'{_paint(item.fill)}/>')
+        if isinstance(item, Ellipse):
+            x0, y0, x1, y1 = item.box
+            inset = item.width / 2 if item.outline else 0
+            paint = _paint(item.fill) if item.fill is not None else 'fill="none"'
+            if item.outline:
+                paint += f' {_paint(item.outline, "stroke")} stroke-width="{item.width}"'
+            return (f'<ellipse cx="{_num((x0 + x1 + 1) / 2)}" cy="{_num((y0 + y1 + 1) / 2)}" '
+                    f'rx="{_num((x1 - x0 + 1) / 2 - inset)}" ry="{_num((y1 - y0 + 1) / 2 - inset)}" {paint}/>')
+        if isinstance(item, Line):
+            points = ' '.join(f'{_num(x)},{_num(y)}' for x, y in item.points)
+            return f'<polyline points="{points}" fill="none" {_paint(item.fill, "stroke")} stroke-width="{item.width}"/>'
+        if isinstance(item, Layer):
+            key = (item.size, item.items)
+            if key not in self._layers:
+                layer_id = f'L{len(self._layers) + 1}'
+                self._layers[key] = layer_id
+                self._defs.append(f'<g id="{layer_id}">' + ''.join(self._element(child) for child in item.items) + '</g>')
+            return f'<use xlink:href="#{self._layers[key]}" x="{item.x}" y="{item.y}"/>'
+        if isinstance(item, Stamp):
+            # Los sellos del atlas son solo un atajo del raster: en vectorial van sus items
+            return '\n'.join(self._element(child) for child in item.items)
+        if isinstance(item, ImageSlot):
+            return self._image(self.images[item.name], item)
+        return ''
+
+    def _font_faces(self) -> str:
+        faces = []
+        for path, (family, chars) in self._fonts.items():
+            data = base64.b64encode(truetype_font(path).subset(chars, WEB_FONT_TABLES)).decode('ascii')
+            faces.append(f'@font-face{{font-family:{family};src:url(data:font/ttf;base64,{data}) format("truetype")}}')
+        return '<style>' + ''.join(faces) + '</style>'
+
+    def to_bytes(self) -> bytes:
+        width, height = self.display_list.size
+        background = self.display_list.background
+        if isinstance(background, ImageSlot):
+            body = [self._image(self.images[background.name], background)]
+        else:
+            body = [f'<rect width="{width}" height="{height}" {_paint(background)}/>']
+        body.extend(self._element(item) for item in self.display_list.items)
+
+        # Tamaño físico A4: el viewBox está en píxeles a `dpi`. xlink:href (y no href, que es de SVG 2)
+        # para que <use> e <image> funcionen también en visores SVG 1.1; los de SVG 2 lo siguen leyendo
+        head = (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                f'width="{_num(width * 25.4 / self.dpi)}mm" height="{_num(height * 25.4 / self.dpi)}mm" '
+                f'viewBox="0 0 {width} {height}">')
+        defs = self._defs[:]
+        if SVG_EMBED_FONTS and self._fonts:
+            defs.insert(0, self._font_faces())
+        parts = [head, '<defs>', *defs, '</defs>', *body, '</svg>']
+        return '\n'.join(parts).encode('utf-8')
+
+
+@stage('encode')
+def render_svg(display_list, images=None, dpi=DPI) -> bytes:
+    """SVG de una página A4 a partir de su display list (en píxeles a `dpi`)"""
+    return SvgDocument(display_list, images, dpi).to_bytes()
@@ -0,0 +1,40 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+# Los módulos del servicio están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def render_cache(monkeypatch, tmp_path):
+    """Caché de renders propia del test (memoria vacía y disco en tmp_path), sin estado de otras ejecuciones"""
+    import app
+    from render_cache import RenderCache
+
+    cache = RenderCache(directory=str(tmp_path / 'render-cache'))
+    monkeypatch.setattr(app, 'render_cache', cache)
+    return cache
+
+
+@pytest.fixture(scope='module')
+def client():
+    """Cliente del servicio con su ciclo de vida (arranque y parada del pool)"""
+    from fastapi.testclient import TestClient
+    from app import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def png():
+    """Fábrica de imágenes PNG de un color, como las que se suben a los endpoints"""
+    def make_png(color: str = 'steelblue', size: tuple = (400, 300)) -> bytes:
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, format='PNG')
+        return buffer.getvalue()
+    return make_png
@@ -0,0 +1,85 @@
+"""
+Segmentador y wrapper originales (antes del wrapper incremental y del tokenizador),
+copiados tal cual como referencia para los tests de regresión y el benchmark.
+"""
+import re
+
+
+def parse_markdown_line(line):
+    """Parsea markdown en una línea"""
+    segments = []
+    # Busca negritas (***texto*** o **texto** o *texto*)
+    pattern = r'(\*\*\*[^\*]+\*\*\*|\*\*[^\*]+\*\*|\*[^\*]+\*)'
+
+    last_end = 0
+    for match in re.finditer(pattern, line):
+        if match.start() > last_end:
+            segments.append((line[last_end:match.start()], 'normal'))
+
+        matched_text = match.group(0)
+        if matched_text.startswith('***') and matched_text.endswith('***'):
+            segments.append((matched_text[3:-3], 'bold'))
+        elif matched_text.startswith('**') and matched_text.endswith('**'):
+            segments.append((matched_text[2:-2], 'bold'))
+        elif matched_text.startswith('*') and matched_text.endswith('*'):
+            segments.append((matched_text[1:-1], 'bold')) # Corregido: asumimos *texto* también es bold si no hay italic separado
+
+        last_end = match.end()
+
+    if last_end < len(line):
+        segments.append((line[last_end:], 'normal'))
+
+    return segments if segments else [(line, 'normal')]
+
+
+def wrap_text_with_markdown(text, fonts, max_width_px, draw):
+    """Divide texto respetando markdown Y PÁRRAFOS"""
+
+    text_normalized = re.sub(r'\n{3,}', '\n\n', text)
+    paragraphs = text_normalized.split('\n\n')
+
+    all_lines = []
+
+    for para_idx, para in enumerate(paragraphs):
+        if not para.strip():
+            continue
+
+        para_lines = para.split('\n')
+
+        for line_idx, line in enumerate(para_lines):
+            if not line.strip():
+                continue
+
+            words = line.strip().split()
+            current_line_words = []
+
+            for word in words:
+                test_line = ' '.join(current_line_words + [word])
+                segments = parse_markdown_line(test_line)
+
+                total_width = 0
+                for seg_text, seg_style in segments:
+                    font = fonts.get(seg_style, fonts['normal'])
+                    # Usar bbox para cálculo de ancho dentro del bucle
+                    try:
+                        bbox = draw.textbbox((0, 0), seg_text, font=font)
+                    except Exception:
+                        bbox = (0, 0, len(seg_text) * 20, 0)
+
+                    total_width += bbox[2] - bbox[0]
+
+                if total_width <= max_width_px:
+                    current_line_words.append(word)
+                else:
+                    if current_line_words:
+                        all_lines.append((' '.join(current_line_words), 'text'))
+                    current_line_words = [word]
+
+            if current_line_words:
+                all_lines.append((' '.join(current_line_words), 'text'))
+
+        # AGREGAR LÍNEA VACÍA ENTRE PÁRRAFOS (excepto después del último)
+        if para_idx < len(paragraphs) - 1:
+            all_lines.append(('', 'paragraph_break'))
+
+    return all_lines
@@ -0,0 +1,28 @@
+import json
+
+
+def _jobs(n: int, tag: str) -> str:
+    return json.dumps([{"tipo": "hoja_preguntas", "imagen": "borde.png", "preguntas": f"1. ¿{tag} {i}?"}
+                       for i in range(n)])
+
+
+def test_nombres_repetidos_dan_400(client, png):
+    files = [('imagenes', ('borde.png', png('red'))), ('imagenes', ('borde.png', png('blue')))]
+    response = client.post('/crear-lote', files=files, data={'trabajos': _jobs(2, 'repetidos')})
+    assert response.status_code == 400
+    assert 'borde.png' in response.json()['detail']
+
+
+def test_salida_invalida_da_400(client, png):
+    files = [('imagenes', ('borde.png', png('red')))]
+    response = client.post('/crear-lote', files=files, data={'trabajos': _jobs(1, 'salida'), 'salida': 'zipp'})
+    assert response.status_code == 400
+
+
+def test_imagen_compartida_cuenta_un_fallo_por_trabajo(client, render_cache, png):
+    files = [('imagenes', ('borde.png', png('green')))]
+    before = render_cache.stats()['misses']
+    response = client.post('/crear-lote', files=files, data={'trabajos': _jobs(3, 'compartida')})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/zip'
+    assert render_cache.stats()['misses'] - before == 3
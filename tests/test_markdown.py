@@ -0,0 +1,107 @@
+"""
+Regresión del tokenizador frente al segmentador original (parse_markdown_line, por línea).
+En markdown bien formado (énfasis sin espacios en los bordes ni asteriscos sueltos) los
+segmentos (texto, estilo) son los mismos. Los únicos cambios son los buscados:
+*cursiva* era negrita y ahora es cursiva, y ***negrita cursiva*** se dibujaba con la negrita
+y ahora con su propia fuente, con el mismo texto y los mismos límites.
+"""
+import random
+import re
+
+import pytest
+
+from layout import line_segments, tokenize_markdown
+from legacy_markdown import parse_markdown_line
+
+WORDS = ('el', 'la', 'oso', 'Luna,', '¿Dónde', 'estás?', '¡Qué', 'alegría!', '—dijo', 'niña.', '42', 'árbol',
+         '“hola”', '(entre', 'paréntesis)', 'x́', 'ñandú')
+# Delimitador de cada énfasis, con el patrón del segmentador original
+LEGACY_SPAN = r'(\*\*\*|\*\*|\*)(?:[^*]+)\1'
+DELIMITER_STYLES = {'***': 'bold_italic', '**': 'bold', '*': 'italic'}
+
+
+def merged(segments) -> list:
+    """Segmentos con los contiguos del mismo estilo unidos (el original no los unía)"""
+    out = []
+    for text, style in segments:
+        if out and out[-1][1] == style:
+            out[-1] = (out[-1][0] + text, style)
+        elif text:
+            out.append((text, style))
+    return out
+
+
+def random_line(rng: random.Random, markup) -> str:
+    parts = []
+    for _ in range(rng.randint(1, 12)):
+        words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+        parts.append(rng.choice(markup).format(words))
+    return ' '.join(parts)
+
+
+def segments(line: str) -> list:
+    return merged(line_segments(tokenize_markdown(line)))
+
+
+def legacy_segments(line: str) -> list:
+    return merged(parse_markdown_line(line))
+
+
+def restyled_legacy_segments(line: str) -> list:
+    """
+    Segmentos del original con el cambio buscado: cada énfasis conserva su texto y sus límites,
+    pero *texto* pasa de negrita a cursiva y ***texto*** a negrita cursiva
+    """
+    spans = iter(re.findall(LEGACY_SPAN, line))
+    restyled = []
+    for text, style in parse_markdown_line(line):
+        if style == 'bold':
+            style = DELIMITER_STYLES[next(spans)]
+        restyled.append((text, style))
+    return merged(restyled)
+
+
+@pytest.mark.parametrize('line', [
+    'Había una vez un oso.',
+    'Había una vez un **oso** muy **grande y peludo**.',
+    'El **zorro**, la **Luna**: ¿dónde **estás**?',
+    '**Todo en negrita**',
+    'Un ***gran*** día y un **buen** final.',
+    'Una *pequeña* casa y un ***gran*** **jardín**.',
+])
+def test_ejemplos(line):
+    assert segments(line) == restyled_legacy_segments(line)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_fuzz_normal_y_negrita(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        line = random_line(rng, ('{}', '{}', '**{}**', '**{}**,', '¡**{}**!'))
+        assert segments(line) == legacy_segments(line), line
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_fuzz_negrita_cursiva(seed):
+    """***texto***: el mismo texto y límites; el estilo pasa de bold a bold_italic"""
+    rng = random.Random(100 + seed)
+    for _ in range(200):
+        line = random_line(rng, ('{}', '{}', '**{}**', '***{}***', '***{}***.'))
+        assert segments(line) == restyled_legacy_segments(line), line
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_fuzz_cursiva(seed):
+    """*texto*: el original lo dibujaba en negrita; es el único cambio de estilo"""
+    rng = random.Random(200 + seed)
+    for _ in range(200):
+        line = random_line(rng, ('{}', '{}', '**{}**', '*{}*', '*{}*,'))
+        assert segments(line) == restyled_legacy_segments(line), line
+
+
+def test_enfasis_que_cruza_lineas():
+    """El segmentador por línea dejaba los asteriscos a la vista; el tokenizador cubre el párrafo"""
+    assert legacy_segments('Había una **gran') == [('Había una **gran', 'normal')]
+    styles = {token.text: token.style for token in tokenize_markdown('Había una **gran\nmontaña** al fondo.')}
+    assert styles['gran'] == styles['montaña'] == 'bold'
+    assert styles['fondo.'] == 'normal'
@@ -0,0 +1,79 @@
+import io
+import zipfile
+
+import pytest
+
+from layout import MAX_PAGES, Layer, Line, Stamp, TextRun, layout_hoja_preguntas_pages
+
+LINE_SPACING = 75
+
+
+def _pregunta_larga(palabras: int, tag: str) -> str:
+    return f"1. ¿{tag}? " + " ".join(f"palabra{i}" for i in range(palabras)) + "\na) uno\nb) dos"
+
+
+def _tops(item):
+    if isinstance(item, (TextRun, Layer)):
+        yield item.y
+    elif isinstance(item, Line):
+        yield item.points[0][1]
+    elif isinstance(item, Stamp):
+        for child in item.items:
+            yield from _tops(child)
+
+
+@pytest.mark.parametrize('estilo', ['infantil', 'clasico'])
+def test_pregunta_mas_alta_que_una_pagina_se_corta_entre_lineas(estilo):
+    texto = _pregunta_larga(900, 'alta') + "\n\n2. ¿Y la siguiente?\na) sí\nb) no"
+    pages = layout_hoja_preguntas_pages(texto, "Cuento", estilo)
+
+    assert len(pages) > 2
+    assert not pages[0].info['truncated']
+    assert pages[-1].info['questions_drawn'] == 2
+    # Ninguna línea pasa del margen inferior y no se pierde ninguna palabra
+    for page in pages:
+        tops = [y for item in page.items[page.info['base_items']:] for y in _tops(item)]
+        assert max(tops) + LINE_SPACING <= page.info['max_height']
+    texto_dibujado = " ".join(item.text for page in pages for item in page.items if isinstance(item, TextRun))
+    assert all(f"palabra{i}" in texto_dibujado for i in range(900))
+
+
+def test_paginas_truncadas_se_indican_en_cabecera(client, png):
+    # Una sola pregunta que necesita más de MAX_PAGES páginas
+    preguntas = _pregunta_larga(250 * (MAX_PAGES + 1), 'truncada')
+    response = client.post('/crear-hoja-preguntas', files={'imagen_borde': ('borde.png', png('orange'))},
+                           data={'preguntas': preguntas, 'paginar': 'true'}, headers={'If-None-Match': '*'})
+    assert response.status_code == 304
+    assert response.headers['X-Paginas'] == str(MAX_PAGES)
+    assert response.headers['X-Paginas-Truncadas'] == '1'
+
+
+def test_sin_truncar_no_hay_cabecera(client, png):
+    response = client.post('/crear-hoja-preguntas', files={'imagen_borde': ('borde.png', png('orange'))},
+                           data={'preguntas': _pregunta_larga(900, 'entera'), 'paginar': 'true'},
+                           headers={'If-None-Match': '*'})
+    assert response.status_code == 304
+    assert 'X-Paginas-Truncadas' not in response.headers
+
+
+def test_pdf_truncado_tiene_max_pages_paginas(client, png):
+    pypdf = pytest.importorskip("pypdf")
+    preguntas = _pregunta_larga(250 * (MAX_PAGES + 1), 'pdf truncado')
+    response = client.post('/crear-hoja-preguntas', files={'imagen_borde': ('borde.png', png('orange'))},
+                           data={'preguntas': preguntas, 'paginar': 'true', 'salida': 'pdf'})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/pdf'
+    assert response.headers['X-Paginas'] == str(MAX_PAGES)
+    assert response.headers['X-Paginas-Truncadas'] == '1'
+    assert len(pypdf.PdfReader(io.BytesIO(response.content)).pages) == MAX_PAGES
+
+
+def test_zip_tiene_una_imagen_por_pagina(client, png):
+    response = client.post('/crear-hoja-preguntas', files={'imagen_borde': ('borde.png', png('orange'))},
+                           data={'preguntas': _pregunta_larga(900, 'zip'), 'paginar': 'true', 'salida': 'zip',
+                                 'formato': 'png', 'dpi': '30'})
+    assert response.status_code == 200
+    assert 'X-Paginas-Truncadas' not in response.headers
+    names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+    assert len(names) == int(response.headers['X-Paginas']) > 2
+    assert names[0].endswith('_pagina_01.png')
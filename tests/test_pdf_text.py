@@ -0,0 +1,31 @@
+import io
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+from render import render_ficha_pdf, render_hoja_preguntas_pdf
+
+
+def _text(pdf: bytes) -> str:
+    return '\n'.join(page.extract_text() for page in pypdf.PdfReader(io.BytesIO(pdf), strict=True).pages)
+
+
+@pytest.mark.parametrize('estilo', ['infantil', 'clasico'])
+def test_texto_fuera_de_cp1252_se_conserva(estilo, png):
+    cuento = 'Había una vez un oso ☺ llamado Ωμέγα. Привет **mundo** “comillas” — raya, y un 🐻.'
+    text = _text(render_ficha_pdf(png(), cuento, 'Oso ☺', 1150, estilo))
+    for fragment in ('☺', 'Ωμέγα', 'Привет', 'mundo', '“comillas” —', '🐻'):
+        assert fragment in text
+    assert '?' not in text
+
+
+def test_titulo_con_contorno_se_extrae_una_vez(png):
+    text = _text(render_ficha_pdf(png(), 'Texto.', 'Oso ☺', 1150, 'infantil'))
+    assert text.count('Oso ☺') == 1
+
+
+def test_hoja_preguntas(png):
+    text = _text(render_hoja_preguntas_pdf(png(), '1. ¿Qué comía el oso ☺?\n2. Привет?', 'El oso', 'infantil'))
+    assert '¿Qué comía el oso ☺?' in text
+    assert 'Привет?' in text
@@ -0,0 +1,26 @@
+import pytest
+
+PREVIEWS = [
+    ('/vista-previa/ficha', 'imagen', {'texto_cuento': 'Había una vez un oso.'}),
+    ('/vista-previa/hoja-preguntas', 'imagen_borde', {'preguntas': '1. ¿Qué comía el oso?'}),
+]
+
+
+@pytest.mark.parametrize('url, field, data', PREVIEWS)
+def test_archivo_que_no_es_imagen_da_400(client, url, field, data):
+    response = client.post(url, files={field: ('cuento.txt', b'no es una imagen')}, data=data)
+    assert response.status_code == 400
+    assert 'imagen válida' in response.json()['detail']
+
+
+@pytest.mark.parametrize('url, field, data', PREVIEWS)
+def test_vista_previa_y_render_completo(client, url, field, data, png):
+    response = client.post(url, files={field: ('borde.png', png())}, data=data)
+    assert response.status_code == 200
+    full = client.get(response.json()['url'])
+    assert full.status_code == 200
+    assert full.headers['content-type'] == 'image/png'
+
+
+def test_render_desconocido_da_404(client):
+    assert client.get('/render/desconocido').status_code == 404
@@ -0,0 +1,34 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from fonts import SANS_ITALIC
+from render import render_ficha, render_hoja_preguntas
+
+SVG = '{http://www.w3.org/2000/svg}'
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+
+def test_fuentes_de_respaldo_en_atributos_propios(png):
+    root = ET.fromstring(render_ficha(png(), 'Había una vez **un oso** y *una osa*.', 'El oso', 1150, 'clasico',
+                                      fmt='svg'))
+    texts = root.iter(f'{SVG}text')
+    fonts = {(t.get('font-family').split(', ', 1)[1], t.get('font-weight'), t.get('font-style')) for t in texts}
+    assert ("'DejaVu Sans', sans-serif", None, None) in fonts
+    assert ("'DejaVu Sans', sans-serif", 'bold', None) in fonts
+    if 'Oblique' in SANS_ITALIC:  # sin fonts-dejavu-extra la cursiva usa la regular
+        assert ("'DejaVu Sans', sans-serif", None, 'italic') in fonts
+    assert not any('"' in family for family, _, _ in fonts)
+
+
+@pytest.mark.parametrize('estilo', ['infantil', 'clasico'])
+def test_use_e_image_con_xlink(estilo, png):
+    root = ET.fromstring(render_hoja_preguntas(png(), '1. ¿Qué comía el oso?\n2. ¿Dónde vivía?', 'El oso', estilo,
+                                               fmt='svg'))
+    refs = [el for el in root.iter() if el.tag in (f'{SVG}use', f'{SVG}image')]
+    assert refs
+    ids = {el.get('id') for el in root.iter() if el.get('id')}
+    for el in refs:
+        assert el.get(XLINK_HREF)
+        if el.tag == f'{SVG}use':
+            assert el.get(XLINK_HREF)[1:] in ids
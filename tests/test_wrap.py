@@ -0,0 +1,93 @@
+"""
+Regresión del wrapper incremental: los saltos de línea deben ser idénticos a los del wrapper
+original, que medía con textbbox el prefijo completo en cada palabra. El énfasis va en palabras
+sueltas (un énfasis partido entre dos líneas sí cambió a propósito con el tokenizador) y las
+cursivas se miden con la negrita, como hacía el segmentador original.
+"""
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from fonts import SANS, SANS_BOLD, get_font
+from layout import wrap_text_with_markdown
+from legacy_markdown import parse_markdown_line, wrap_text_with_markdown as legacy_wrap
+
+WORDS = ('el', 'la', 'un', 'y', 'de', 'oso', 'Luna', 'bosque', 'miró', 'árboles', 'pequeño', 'corazón',
+         'niña', '¿Dónde', 'estás?', '¡Qué', 'alegría!', '—dijo', 'zorro,', 'noche.', '“hola”', '1', '42',
+         'extraordinariamente', 'desafortunadamente,', 'W' * 60, 'iiiiiiii', 'MMMM', 'ñandú', 'ÁÉÍÓÚ',
+         # Bbox distinto del avance: acentos combinantes (texto NFD) y glifos que sobresalen
+         'cafe\u0301', 'nin\u0303a', 'ƒ', 'ďť', 'jj')
+MARKUP = ('{}', '{}', '{}', '{}', '**{}**', '***{}***', '*{}*', '**{}**,', '«*{}*»')
+SEPARATORS = (' ', ' ', ' ', ' ', ' ', '  ', '\n', '\n\n', '\n\n\n', ' \n ')
+
+SAMPLE_STORY = (
+    "Había una vez un **zorro** muy curioso que vivía en el bosque. Cada noche miraba la *Luna* y se "
+    "preguntaba qué habría allá arriba.\n\nUn día decidió subir a la ***montaña*** más alta.\n"
+    "—¿Me acompañas? —le preguntó a su amiga la lechuza.\n\n\nY juntos emprendieron el camino."
+)
+
+
+def fonts_for(size: int, bold_size: int) -> dict:
+    bold = get_font(SANS_BOLD, bold_size)
+    return {'normal': get_font(SANS, size), 'bold': bold, 'italic': bold, 'bold_italic': bold}
+
+
+def random_text(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(1, 120)):
+        parts.append(rng.choice(MARKUP).format(rng.choice(WORDS)))
+        parts.append(rng.choice(SEPARATORS))
+    return ''.join(parts[:-1])
+
+
+def legacy_width(line, fonts) -> int:
+    """Ancho con el que el wrapper original decidía si `line` cabe"""
+    draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    total = 0
+    for seg_text, style in parse_markdown_line(line):
+        bbox = draw.textbbox((0, 0), seg_text, font=fonts.get(style, fonts['normal']))
+        total += bbox[2] - bbox[0]
+    return total
+
+
+def legacy_lines(text, fonts, max_width_px):
+    draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+    return [(''.join(seg for seg, _ in parse_markdown_line(line)) if kind == 'text' else line, kind)
+            for line, kind in legacy_wrap(text, fonts, max_width_px, draw)]
+
+
+def lines(text, fonts, max_width_px):
+    return [(line.text, line.kind) for line in wrap_text_with_markdown(text, fonts, max_width_px)]
+
+
+@pytest.mark.parametrize('size', [28, 36, 44, 50, 52])
+@pytest.mark.parametrize('max_width_px', [2160, 1790, 900, 300])
+def test_cuento_de_ejemplo(size, max_width_px):
+    fonts = fonts_for(size, size)
+    assert lines(SAMPLE_STORY, fonts, max_width_px) == legacy_lines(SAMPLE_STORY, fonts, max_width_px)
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_fuzz_saltos_identicos(seed):
+    rng = random.Random(seed)
+    for _ in range(10):
+        text = random_text(rng)
+        size = rng.randint(20, 60)
+        fonts = fonts_for(size, rng.choice((size, round(size * 52 / 50))))
+        max_width_px = rng.randint(150, 2200)
+        assert lines(text, fonts, max_width_px) == legacy_lines(text, fonts, max_width_px), (text, size, max_width_px)
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_fuzz_en_el_limite(seed):
+    """Anchos justo en el límite de un prefijo (±1 px): donde la estimación por avances podría fallar"""
+    rng = random.Random(1000 + seed)
+    for _ in range(10):
+        words = random_text(rng).split()[:40] + ['fin.']
+        size = rng.randint(20, 60)
+        fonts = fonts_for(size, rng.choice((size, round(size * 52 / 50))))
+        width = legacy_width(' '.join(words[:rng.randint(1, min(len(words), 12))]), fonts)
+        text = ' '.join(words)
+        for max_width_px in (width - 1, width, width + 1):
+            assert lines(text, fonts, max_width_px) == legacy_lines(text, fonts, max_width_px), (text, size, max_width_px)
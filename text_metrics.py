@@ -0,0 +1,98 @@
+from functools import lru_cache
+from PIL import ImageFont
+import os
+
+# Entradas máximas de las cachés de anchos (compartidas por todo el proceso)
+TOKEN_WIDTH_CACHE_SIZE = int(os.environ.get("TOKEN_WIDTH_CACHE_SIZE", 65536))
+SEGMENT_WIDTH_CACHE_SIZE = int(os.environ.get("SEGMENT_WIDTH_CACHE_SIZE", 8192))
+
+
+@lru_cache(maxsize=TOKEN_WIDTH_CACHE_SIZE)
+def token_width(font, token: str) -> float:
+    """Avance horizontal de una palabra (sin espacios) en la fuente dada. Se mide una sola vez."""
+    return font.getlength(token)
+
+
+@lru_cache(maxsize=SEGMENT_WIDTH_CACHE_SIZE)
+def text_bbox(font, text: str) -> tuple:
+    """Bbox de un texto dibujado en (0, 0), igual que draw.textbbox((0, 0), text, font=font)."""
+    try:
+        return font.getbbox(text)
+    except Exception:
+        return (0, 0, len(text) * 20, 0)
+
+
+def segment_width(font, text: str) -> int:
+    """Ancho exacto de un segmento según su bbox: la misma medida que decide los saltos de línea."""
+    bbox = text_bbox(font, text)
+    return bbox[2] - bbox[0]
+
+
+def advance_width(font, text: str) -> float:
+    """
+    Suma los avances de las palabras de `text` más sus espacios.
+    DejaVu no tiene kerning con el espacio, así que coincide con font.getlength(text).
+    """
+    tokens = text.split(' ')
+    return sum(token_width(font, token) for token in tokens if token) + (len(tokens) - 1) * token_width(font, ' ')
+
+
+class LineMeasure:
+    """
+    Decide si una línea que crece palabra a palabra cabe en `max_width_px`.
+
+    La línea llega ya tokenizada (ver layout.tokenize_markdown): cada palabra añade sus
+    trozos y el separador, y su avance cacheado se suma al total, sin volver a medir ni
+    a segmentar lo anterior. La medida exacta (bbox de cada segmento, como hacía el
+    algoritmo original) solo se calcula cuando la estimación cae a menos de un cuadratín
+    por segmento del límite, de modo que las decisiones de corte son idénticas a las de
+    medir el prefijo completo.
+    """
+
+    def __init__(self, fonts, max_width_px):
+        self.fonts = fonts
+        self.max_width_px = max_width_px
+        self.reset()
+
+    def _font(self, style):
+        return self.fonts.get(style, self.fonts['normal'])
+
+    def _add(self, pieces):
+        total, guard, last_style = self._total, self._guard, self._last_style
+        for text, style in pieces:
+            font = self._font(style)
+            total += token_width(font, text)
+            if style != last_style:
+                # Un segmento más: su margen de un cuadratín se suma al de la línea
+                guard += font.size
+                last_style = style
+        return total, guard, last_style
+
+    def reset(self, pieces=()):
+        """Empieza una línea nueva, vacía o con los trozos de su primera palabra"""
+        self._total, self._guard, self._last_style = 0, 0, None
+        self._total, self._guard, self._last_style = self._add(pieces)
+
+    def fits(self, pieces, segments) -> bool:
+        """
+        Comprueba si la línea cabe al añadirle `pieces` ((texto, estilo) del separador y de
+        la palabra) y, si cabe, los suma. `segments()` da la línea completa, solo si hace
+        falta la medida exacta.
+        """
+        if not all(isinstance(self._font(style), ImageFont.FreeTypeFont) for _, style in pieces):
+            # Fuentes bitmap (load_default): sin estimación, siempre medida exacta
+            return self._exact(segments()) <= self.max_width_px
+
+        total, guard, last_style = self._add(pieces)
+        if total + guard <= self.max_width_px:
+            fits = True
+        elif total - guard > self.max_width_px:
+            fits = False
+        else:
+            fits = self._exact(segments()) <= self.max_width_px
+        if fits:
+            self._total, self._guard, self._last_style = total, guard, last_style
+        return fits
+
+    def _exact(self, segments):
+        return sum(segment_width(self._font(style), seg_text) for seg_text, style in segments)
@@ -0,0 +1,60 @@
+from fastapi import HTTPException
+import os
+
+from metrics import Counter, Histogram, registry
+
+# CONFIGURACIÓN (variables de entorno)
+# MAX_UPLOAD_MB: tamaño máximo de cada archivo subido
+# MAX_BODY_MB: tamaño máximo del cuerpo de una petición (varios archivos en /crear-lote y campos de texto)
+MAX_UPLOAD_MB = float(os.environ.get("MAX_UPLOAD_MB", 20))
+MAX_BODY_MB = float(os.environ.get("MAX_BODY_MB", 100))
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+MAX_BODY_BYTES = int(MAX_BODY_MB * 1024 * 1024)
+
+# Bytes: desde una miniatura hasta el máximo por defecto
+UPLOAD_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+UPLOAD_BYTES = registry.register(Histogram(
+    "upload_bytes", "Tamaño de cada archivo subido que se lee a memoria", buckets=UPLOAD_BUCKETS))
+UPLOADS_REJECTED = registry.register(Counter(
+    "uploads_rejected_total", "Subidas rechazadas con 413 antes de decodificar (body, file, pixels)", ("reason",)))
+
+
+def too_large(reason: str, detail: str) -> HTTPException:
+    UPLOADS_REJECTED.inc(reason=reason)
+    return HTTPException(status_code=413, detail=detail)
+
+
+class UploadLimitMiddleware:
+    """
+    Middleware ASGI: responde 413 a los cuerpos de más de MAX_BODY_MB antes de que el parser
+    multipart los almacene. Con Content-Length se rechaza sin leer un solo byte del cuerpo;
+    sin él (chunked) se cuentan los bytes según llegan y se corta en cuanto se pasa.
+    El error se lanza desde `receive`, dentro de la ruta, así que responde como cualquier
+    HTTPException y las métricas lo cuentan en su endpoint.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_BODY_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        declared = dict(scope['headers']).get(b'content-length')
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+                raise too_large('body', f"Petición demasiado grande: {int(declared) / 1e6:.1f} MB (máximo {MAX_BODY_MB:g} MB)")
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    raise too_large('body', f"Petición demasiado grande (máximo {MAX_BODY_MB:g} MB)")
+            return message
+
+        await self.app(scope, limited_receive, send)